@@ -0,0 +1,192 @@
+from pathlib import Path
+import os
+import stat
+import time
+import threading
+from typing import Dict, List, Set
+import copier
+from content import CHUNK_SIZE, DigestCache
+from metrics import METRICS
+
+
+# ============================================================= #
+# ============================================================= #
+
+
+class BackupStore:
+    """
+    Content addressed store of the files that a run remove or overwrite
+    (replaced on system, adopted over a package file, stowed over one).
+
+    Layout (in `dir`):
+      - `objects/<2>/<rest>`  file content, named by its blake2b digest,
+                              the same content is stored only once
+      - `index.jsonl`         one record per backup, appended:
+                              `{"time", "path", "package", "mode",
+                              "digest", "size"}`, or `"link"` (the value)
+                              instead of the digest for a symlink
+
+    A file that is removed right after (`move`) become its blob by a hard
+    link, nothing is copied, otherwise the blob is a copy (reflink when the
+    file system support it). A moved file that is still there once the
+    plan is applied (its unlink failed) is copied then, see `settle`. Digests come from the digest cache when the
+    file was already compared, so a backup usually cost no read at all.
+    """
+
+    def __init__(self, dir: Path, cache: DigestCache | None = None) -> None:
+        self.dir = dir
+        self.objects = dir / "objects"
+        self.index = dir / "index.jsonl"
+        self.cache = cache
+        self.fd: int | None = None
+        self.lock = threading.Lock()
+        # blobs hard linked to a file that is to be removed
+        self.moved: Set[Path] = set()
+
+    def blob(self, digest: str) -> Path:
+        return self.objects / digest[:2] / digest[2:]
+
+    def digest(self, path: str, st: os.stat_result | None = None) -> str:
+        st = st or os.stat(path)
+        if self.cache is not None and (digest := self.cache.get(Path(path), st)):
+            return digest
+
+        import hashlib
+
+        hasher = hashlib.blake2b()
+        with open(path, "rb") as file:
+            while chunk := file.read(CHUNK_SIZE):
+                hasher.update(chunk)
+        digest = hasher.hexdigest()
+        if self.cache is not None:
+            self.cache.put(Path(path), st, digest)
+        return digest
+
+    def save(
+        self, path: str, package: str = "", move: bool = False, restore: bool = False
+    ) -> Dict | None:
+        """
+        Back up the file (or symlink) at `path`, return its record, `None`
+        if there is nothing to back up (missing, directory).
+
+        :param move: the file is removed right after, it can be hard linked
+        :param restore: saved by a restore, never restored by the next one
+        """
+        try:
+            st = os.lstat(path)
+        except FileNotFoundError:
+            return None
+        record = {
+            "time": time.time(),
+            "path": path,
+            "package": package,
+            "mode": stat.S_IMODE(st.st_mode),
+        }
+        if restore:
+            record["restore"] = True
+        if stat.S_ISLNK(st.st_mode):
+            record["link"] = os.readlink(path)
+        elif stat.S_ISREG(st.st_mode):
+            record["digest"] = self.digest(path, st)
+            record["size"] = st.st_size
+            self._store(path, st, record["digest"], move)
+        else:
+            return None
+
+        import json
+
+        self._append(json.dumps(record))
+        METRICS.count("backups")
+        return record
+
+    def _store(self, path: str, st: os.stat_result, digest: str, move: bool) -> None:
+        blob = self.blob(digest)
+        if blob.exists():
+            METRICS.count("backups_deduped")
+            return
+
+        blob.parent.mkdir(parents=True, exist_ok=True)
+        tmp = self._tmp(blob)
+        try:
+            # a file with other hard links can still change, copy it
+            if not (move and st.st_nlink == 1):
+                raise OSError("not moved")
+            os.link(path, tmp)
+        except OSError:
+            copier.copy(Path(path), tmp)
+        else:
+            with self.lock:
+                self.moved.add(blob)
+        os.replace(tmp, blob)
+        METRICS.count("backup_bytes", st.st_size)
+
+    def _tmp(self, blob: Path) -> Path:
+        return blob.parent / f".tmp-{os.getpid()}-{threading.get_ident()}"
+
+    def settle(self) -> None:
+        """
+        Copy the blobs of moved files that are still on system (their
+        unlink failed or was skipped), so a later edit of the file never
+        change its backup. Called once a plan is applied.
+        """
+        with self.lock:
+            moved, self.moved = self.moved, set()
+        for blob in moved:
+            try:
+                if os.stat(blob).st_nlink == 1:
+                    continue
+            except FileNotFoundError:
+                continue
+            tmp = self._tmp(blob)
+            copier.copy(blob, tmp)
+            os.replace(tmp, blob)
+            METRICS.count("backups_unshared")
+
+    def _append(self, line: str) -> None:
+        with self.lock:
+            if self.fd is None:
+                self.dir.mkdir(parents=True, exist_ok=True)
+                self.fd = os.open(
+                    self.index, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644
+                )
+            # one write per record, the record is there before the file is
+            # removed
+            os.write(self.fd, (line + "\n").encode())
+
+    def records(self) -> List[Dict]:
+        """
+        Return every record, oldest first.
+        """
+        try:
+            with open(self.index, "r") as file:
+                lines = file.readlines()
+        except FileNotFoundError:
+            return []
+        import json
+
+        records: List[Dict] = []
+        for line in lines:
+            try:
+                records.append(json.loads(line))
+            except json.JSONDecodeError:
+                # torn write of an interrupted run
+                continue
+        return records
+
+    def latest(self, packages: Set[str] | None = None) -> Dict[str, Dict]:
+        """
+        Return the last record of every path (of `packages`, or all), the
+        ones saved by a restore are skipped, so restoring twice do nothing.
+        """
+        latest: Dict[str, Dict] = {}
+        for record in self.records():
+            if record.get("restore"):
+                continue
+            if packages is None or record["package"] in packages:
+                latest[record["path"]] = record
+        return latest
+
+    def close(self) -> None:
+        if self.fd is not None:
+            os.close(self.fd)
+            self.fd = None
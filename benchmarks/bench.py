@@ -0,0 +1,492 @@
+#!/usr/bin/env python3
+"""
+Benchmark harness for me-stow.
+
+Generate a synthetic source/root layout in a temporary directory, run every
+operation (startup, init, status, list, diff, stow, remove) end to end as the user would,
+cold (first run, nothing recorded yet) and warm (same run again), and write
+the result as JSON, so runs of different commits can be compared.
+
+Usage:
+  python3 benchmarks/bench.py [options] [--output result.json]
+  python3 benchmarks/bench.py --compare old.json new.json
+
+Syscalls are counted with `strace -c` when it's installed, otherwise the
+`os` functions called by the script are counted (stat/lstat/readlink/
+scandir/symlink/unlink/mkdir/rmdir/open...), which is enough to compare
+two commits.
+
+Memory is the peak RSS of every cold run, and (`memory`) the bytes per
+entry of the target index of all packages, against the same index as a
+dict of path strings.
+"""
+
+from pathlib import Path
+import os
+import sys
+import json
+import time
+import random
+import shutil
+import argparse
+import platform
+import tempfile
+import subprocess
+from typing import Dict, List
+
+REPO = Path(__file__).resolve().parent.parent
+
+# os functions counted when strace is not available
+COUNTED = (
+    "stat",
+    "lstat",
+    "readlink",
+    "scandir",
+    "listdir",
+    "symlink",
+    "unlink",
+    "mkdir",
+    "rmdir",
+    "rename",
+    "replace",
+    "open",
+    "fsync",
+    "ftruncate",
+    "copy_file_range",
+    "sendfile",
+)
+
+
+# ============================================================= #
+# LAYOUT ====================================================== #
+
+
+def generate(base: Path, args: argparse.Namespace) -> None:
+    """
+    Make `base/{app,src,home}`: a copy of the script, `packages` packages of
+    `depth` levels with `dirs` sub directories and `files` files in every
+    directory, and the system files that conflict with `conflicts` of them.
+    """
+    rng = random.Random(args.seed)
+    app, src, home = base / "app", base / "src", base / "home"
+    for dir in (app, src, home):
+        dir.mkdir(parents=True)
+    for file in REPO.glob("*.py"):
+        shutil.copy(file, app)
+    with open(app / "config.json", "w") as file:
+        json.dump({"source_path": str(src), "root_path": str(home)}, file)
+
+    content = b"x" * args.size
+    for p in range(args.packages):
+        pkg = src / f"pkg{p:03}"
+        # every package has its own top directory, plus a shared one
+        tops = [pkg / f".pkg{p:03}", pkg / ".config" / "shared"]
+        for top in tops:
+            for dir in tree_dirs(top, args.depth, args.dirs):
+                dir.mkdir(parents=True, exist_ok=True)
+                for f in range(args.files):
+                    name = f"p{p:03}-f{f}" if top == tops[1] else f"f{f}"
+                    with open(dir / name, "wb") as file:
+                        file.write(content)
+                    if rng.random() < args.conflicts:
+                        # same file already on system
+                        target = home / (dir / name).relative_to(pkg)
+                        target.parent.mkdir(parents=True, exist_ok=True)
+                        with open(target, "wb") as file:
+                            file.write(content[::-1] or b"y")
+
+
+def tree_dirs(top: Path, depth: int, width: int) -> List[Path]:
+    dirs = [top]
+    level = [top]
+    for _ in range(depth):
+        level = [dir / f"d{i}" for dir in level for i in range(width)]
+        dirs.extend(level)
+    return dirs
+
+
+# ============================================================= #
+# RUN ========================================================= #
+
+
+def run(base: Path, args: List[str], count: bool) -> Dict:
+    """
+    Run the script once, return wall time, peak RSS (and syscall counts).
+    """
+    cmd = [sys.executable, str(base / "app" / "me-stow.py"), *args]
+    counts_file = base / "syscalls.json"
+    env = dict(os.environ)
+    if count:
+        if shutil.which("strace"):
+            cmd = ["strace", "-f", "-c", "-o", str(counts_file), *cmd]
+        else:
+            cmd = [sys.executable, __file__, "--child", str(counts_file), *cmd[1:]]
+
+    start = time.perf_counter()
+    with tempfile.TemporaryFile() as stderr:
+        proc = subprocess.Popen(
+            cmd,
+            stdin=subprocess.DEVNULL,
+            stdout=subprocess.DEVNULL,
+            stderr=stderr,
+            env=env,
+        )
+        # `wait4` give the resource usage of this child only
+        _, status, usage = os.wait4(proc.pid, 0)
+        elapsed = time.perf_counter() - start
+        proc.returncode = os.waitstatus_to_exitcode(status)
+        if proc.returncode not in (0, 1):
+            stderr.seek(0)
+            raise RuntimeError(f"{' '.join(args)} failed: {stderr.read().decode()}")
+
+    # kB on Linux, bytes on macOS
+    rss = usage.ru_maxrss // 1024 if sys.platform == "darwin" else usage.ru_maxrss
+    result: Dict = {"time": round(elapsed, 4), "maxrss_kb": rss}
+    if count:
+        result["syscalls"] = read_counts(counts_file)
+    return result
+
+
+def read_counts(file: Path) -> Dict[str, int]:
+    text = file.read_text()
+    file.unlink()
+    if text.lstrip().startswith("{"):
+        return json.loads(text)
+
+    # strace -c table: % time, seconds, usecs/call, calls, [errors], syscall
+    counts: Dict[str, int] = {}
+    for line in text.splitlines():
+        cols = line.split()
+        if len(cols) >= 5 and cols[3].isdigit() and cols[-1] != "total":
+            counts[cols[-1]] = int(cols[3])
+    return counts
+
+
+def child(counts_file: str, script: str, argv: List[str]) -> None:
+    """
+    Run the script with the `os` functions wrapped by counters.
+    """
+    import atexit
+    import runpy
+    import importlib
+    import builtins
+
+    sys.path.insert(0, str(Path(script).parent))
+    try:
+        # check `os.supports_dir_fd` against the real functions, not wrappers
+        importlib.import_module("fsops")
+    except ImportError:
+        pass
+
+    counts = {name: 0 for name in COUNTED}
+
+    def wrap(name: str, func):
+        def counted(*args, **kwargs):
+            counts[name] += 1
+            return func(*args, **kwargs)
+
+        return counted
+
+    for name in COUNTED:
+        if hasattr(os, name):
+            setattr(os, name, wrap(name, getattr(os, name)))
+    # file objects (json, copy...) are opened with the builtin
+    counts["open"] = 0
+    builtins.open = wrap("open", builtins.open)
+
+    def dump() -> None:
+        with open(counts_file, "w") as file:
+            json.dump({k: v for k, v in counts.items() if v}, file)
+
+    atexit.register(dump)
+    sys.argv = [script, *argv]
+    runpy.run_path(script, run_name="__main__")
+
+
+def bench_op(base: Path, setup, args: List[str], warm: bool, repeat: int) -> Dict:
+    """
+    Time one operation: cold is the first run after `setup`, warm is the
+    same run again right after it (everything already done, the steady
+    state of running it on every shell start). Best of `repeat`.
+    """
+    colds, warms, rss = [], [], []
+    for _ in range(repeat):
+        setup()
+        cold = run(base, args, False)
+        colds.append(cold["time"])
+        rss.append(cold["maxrss_kb"])
+        if warm:
+            warms.append(run(base, args, False)["time"])
+    setup()
+    result = {
+        "args": args,
+        "cold": min(colds),
+        "warm": min(warms) if warm else None,
+        "maxrss_kb": min(rss),
+    }
+    result["cold_syscalls"] = run(base, args, True).get("syscalls", {})
+    if warm:
+        result["warm_syscalls"] = run(base, args, True).get("syscalls", {})
+    return result
+
+
+def bench_startup(base: Path, repeat: int) -> Dict:
+    """
+    Time `-h` (imports and arguments, nothing else) through the plain
+    python entry point and through the script, with the bare interpreter
+    as baseline. Best of `repeat` * 10, as a run is only a few ms.
+    """
+    app = base / "app"
+    # commits before the entry point: the script for both
+    main = app / "main.py" if (app / "main.py").exists() else app / "me-stow.py"
+    cmds = {
+        "cold": [sys.executable, "-S", str(main), "-h"],
+        "script": [sys.executable, str(app / "me-stow.py"), "-h"],
+        "baseline": [sys.executable, "-S", "-c", "pass"],
+    }
+    result: Dict = {"args": ["-h"], "warm": None}
+    for name, cmd in cmds.items():
+        # first run write the bytecode cache
+        subprocess.run(
+            cmd, stdin=subprocess.DEVNULL, stdout=subprocess.DEVNULL, check=False
+        )
+        times = []
+        for _ in range(repeat * 10):
+            start = time.perf_counter()
+            subprocess.run(
+                cmd, stdin=subprocess.DEVNULL, stdout=subprocess.DEVNULL, check=False
+            )
+            times.append(time.perf_counter() - start)
+        result[name] = round(min(times), 4)
+
+    # modules of the app loaded to print the help, should be `classes` alone
+    proc = subprocess.run(
+        [*cmds["cold"][:2], "-X", "importtime", *cmds["cold"][2:]],
+        stdin=subprocess.DEVNULL,
+        stdout=subprocess.DEVNULL,
+        stderr=subprocess.PIPE,
+        text=True,
+        check=False,
+    )
+    local = {path.stem for path in app.glob("*.py")}
+    result["imports"] = [
+        name
+        for line in proc.stderr.splitlines()
+        if (name := line.rsplit("|", 1)[-1].strip()) in local
+    ]
+    return result
+
+
+# run in a fresh interpreter, in the app directory
+MEMORY_SCRIPT = """
+import os, sys, json, tracemalloc
+from pathlib import Path
+sys.path.insert(0, os.getcwd())
+from index import TargetIndex
+from ignore import package_ignore
+from walker import walk
+
+src, home = Path(sys.argv[1]), Path(sys.argv[2])
+packages = sorted(p for p in src.iterdir() if p.is_dir())
+
+tracemalloc.start()
+index = TargetIndex.build(home, packages)
+tree = tracemalloc.get_traced_memory()[0]
+entries = len(index.tree)
+del index
+
+tracemalloc.stop()
+tracemalloc.start()
+owners = {}
+for pkg in packages:
+    for item in walk(pkg, package_ignore(pkg)):
+        owners[str(home) + os.sep + item.rel] = pkg.name
+strings = tracemalloc.get_traced_memory()[0]
+print(json.dumps({"entries": entries, "tree": tree, "strings": strings}))
+"""
+
+
+def bench_memory(base: Path) -> Dict:
+    """
+    Bytes per entry of the target index of all packages (`--list=conflicts`,
+    and `init` conflicts), against a dict of full path strings.
+    """
+    proc = subprocess.run(
+        [sys.executable, "-c", MEMORY_SCRIPT, str(base / "src"), str(base / "home")],
+        cwd=base / "app",
+        capture_output=True,
+        check=True,
+    )
+    data = json.loads(proc.stdout)
+    entries = max(data["entries"], 1)
+    return {
+        "args": [],
+        "cold": None,
+        "warm": None,
+        "entries": data["entries"],
+        "bytes_per_entry": round(data["tree"] / entries, 1),
+        "baseline_bytes_per_entry": round(data["strings"] / entries, 1),
+    }
+
+
+def benchmark(args: argparse.Namespace) -> Dict:
+    base = Path(tempfile.mkdtemp(prefix="me-stow-bench-"))
+    extra = args.extra.split()
+    try:
+        generate(base, args)
+        home, app = base / "home", base / "app"
+        pristine = base / "pristine"
+        shutil.copytree(home, pristine, symlinks=True)
+        src = base / "src"
+        snapshot = base / "src-pristine"
+        shutil.copytree(src, snapshot, symlinks=True)
+
+        def reset() -> None:
+            # system and sources back to the generated state, no manifest
+            for dir, copy in ((home, pristine), (src, snapshot)):
+                shutil.rmtree(dir)
+                shutil.copytree(copy, dir, symlinks=True)
+            for name in ("manifests", "digests.json", "journal.log", "backups"):
+                path = app / name
+                if path.is_dir():
+                    shutil.rmtree(path)
+                elif path.exists():
+                    path.unlink()
+
+        def inited() -> None:
+            reset()
+            run(base, ["--init", *extra], False)
+
+        def stow_dir() -> None:
+            reset()
+            stow = home / ".stow-me"
+            for dir in tree_dirs(stow, args.depth, args.dirs):
+                dir.mkdir(parents=True, exist_ok=True)
+                for f in range(args.files):
+                    (dir / f"s{f}").write_bytes(b"s" * args.size)
+
+        packages = sorted(p.name for p in src.iterdir())
+        stow_args = ["--stow", "stowed", str(home / ".stow-me")]
+        # name: (setup, arguments, has warm run)
+        ops = {
+            "init": (reset, ["--init", *extra], True),
+            "init_incremental": (inited, ["--init", "--incremental", *extra], True),
+            "status": (inited, ["--status"], True),
+            "list": (inited, ["--list=full"], True),
+            # conflicts have the same size as their package file, all hashed
+            "diff": (reset, ["--diff", *extra], True),
+            "stow": (stow_dir, stow_args, False),
+            "remove": (inited, ["--remove", *packages, *extra], False),
+        }
+        results = {}
+        if not args.ops or "startup" in args.ops:
+            print("-- bench 'startup'...", file=sys.stderr)
+            results["startup"] = bench_startup(base, args.repeat)
+        for op, (setup, op_args, warm) in ops.items():
+            if args.ops and op not in args.ops:
+                continue
+            print(f"-- bench '{op}'...", file=sys.stderr)
+            results[op] = bench_op(base, setup, op_args, warm, args.repeat)
+        if not args.ops or "memory" in args.ops:
+            print("-- bench 'memory'...", file=sys.stderr)
+            reset()
+            results["memory"] = bench_memory(base)
+        return results
+    finally:
+        shutil.rmtree(base, ignore_errors=True)
+
+
+def git_commit() -> str:
+    try:
+        out = subprocess.run(
+            ["git", "-C", str(REPO), "rev-parse", "--short", "HEAD"],
+            capture_output=True,
+            text=True,
+            check=False,
+        )
+        return out.stdout.strip()
+    except OSError:
+        return ""
+
+
+def compare(old_file: str, new_file: str) -> None:
+    with open(old_file) as file:
+        old = json.load(file)
+    with open(new_file) as file:
+        new = json.load(file)
+    print(f"{'op':<18} {'':<5} {old['commit']:>10} {new['commit']:>10} {'ratio':>7}")
+    for op, result in new["results"].items():
+        if op not in old["results"]:
+            continue
+        for kind in ("cold", "warm", "maxrss_kb", "bytes_per_entry"):
+            a, b = old["results"][op].get(kind), result.get(kind)
+            if a is None or b is None:
+                continue
+            ratio = b / a if a else 0
+            print(f"{op:<18} {kind:<5} {a:>10.4f} {b:>10.4f} {ratio:>6.2f}x")
+
+
+def main() -> None:
+    if len(sys.argv) > 2 and sys.argv[1] == "--child":
+        child(sys.argv[2], sys.argv[3], sys.argv[4:])
+        return
+
+    parser = argparse.ArgumentParser(description="me-stow benchmark")
+    parser.add_argument("--packages", type=int, default=20)
+    parser.add_argument("--files", type=int, default=10, help="files per directory")
+    parser.add_argument("--depth", type=int, default=2, help="nesting depth")
+    parser.add_argument("--dirs", type=int, default=3, help="sub directories")
+    parser.add_argument(
+        "--conflicts", type=float, default=0.05, help="ratio of files on system"
+    )
+    parser.add_argument("--size", type=int, default=256, help="file size (bytes)")
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--ops", nargs="*", help="only these operations")
+    parser.add_argument(
+        "--extra", default="", help="extra flags for init/remove, e.g. '--jobs=4'"
+    )
+    parser.add_argument(
+        "--max-startup-ms",
+        type=float,
+        default=30,
+        help="exit with code 1 if `-h` take longer (0: no check)",
+    )
+    parser.add_argument("--output", help="write JSON result to this file")
+    parser.add_argument("--compare", nargs=2, metavar=("OLD", "NEW"))
+    args = parser.parse_args()
+
+    if args.compare:
+        compare(*args.compare)
+        return
+
+    params = {
+        k: getattr(args, k)
+        for k in ("packages", "files", "depth", "dirs", "conflicts", "size", "seed")
+    }
+    data = {
+        "commit": git_commit(),
+        "python": platform.python_version(),
+        "machine": platform.machine(),
+        "params": params,
+        "extra": args.extra,
+        "results": benchmark(args),
+    }
+    text = json.dumps(data, indent=2)
+    if args.output:
+        with open(args.output, "w") as file:
+            file.write(text + "\n")
+    print(text)
+
+    startup = data["results"].get("startup")
+    if startup and args.max_startup_ms and startup["cold"] * 1000 > args.max_startup_ms:
+        print(
+            f"[error] -- startup {startup['cold'] * 1000:.1f} ms, over"
+            f" {args.max_startup_ms:g} ms (imports: {', '.join(startup['imports'])})",
+            file=sys.stderr,
+        )
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
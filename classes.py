@@ -1,16 +1,21 @@
-from pathlib import Path
+from __future__ import annotations
+import os
 import sys
-import json
 from enum import Enum
-from dataclasses import dataclass
-from typing import Dict, List, Generator
+
+# for type checkers only, this module is all that is imported to print the
+# help, `pathlib` and the rest are imported by what use them
+TYPE_CHECKING = False
+if TYPE_CHECKING:
+    from pathlib import Path
+    from typing import Dict, List, Generator, Tuple
+    from ignore import IgnoreMatcher
 
 
 # ============================================================= #
 # ============================================================= #
 
 
-@dataclass
 class Arguments:
     INIT = "init"
     REMOVE = "remove"
@@ -23,6 +28,24 @@ class Arguments:
     SAVE_CONFIG = "saveconfig"
     COPY_BACK = "copyback"
     PROCESS_ALL = "all"
+    INCREMENTAL = "incremental"
+    FOLD = "fold"
+    JOBS = "jobs"
+    DRY_RUN = "dry-run"
+    METRICS = "metrics"
+    PROFILE = "profile"
+    STATUS = "status"
+    WATCH = "watch"
+    PRUNE = "prune"
+    RESTORE_BACKUP = "restore-backup"
+    SERVE = "serve"
+    DIFF = "diff"
+    SOURCE = "source"
+    ROOT = "root"
+    ROOTS = "roots"
+    YES = "yes"
+    NON_INTERACTIVE = "non-interactive"
+    FORMAT = "format"
 
 
 class ResolveType(Enum):
@@ -37,17 +60,40 @@ class Operation(Enum):
     REMOVE = Arguments.REMOVE
     STOW = Arguments.STOW
     LIST = Arguments.LIST
+    STATUS = Arguments.STATUS
+    WATCH = Arguments.WATCH
+    PRUNE = Arguments.PRUNE
+    RESTORE_BACKUP = Arguments.RESTORE_BACKUP
+    SERVE = Arguments.SERVE
+    DIFF = Arguments.DIFF
 
 
-@dataclass
 class ConfigKey:
     SOURCE = "source_path"
     ROOT = "root_path"
     RESOLVE = "resolve"
+    # {name: path} of more roots, every package is deployed to all of them
+    ROOTS = "roots"
+    # {package: [root name, ...]}, only these roots for the package
+    PACKAGE_ROOTS = "package_roots"
+
+
+# name of `root_path` among the roots
+DEFAULT_ROOT = "default"
+
+
+class EnvKey:
+    SOURCE = "ME_STOW_SOURCE"
+    ROOT = "ME_STOW_ROOT"
+    RESOLVE = "ME_STOW_RESOLVE"
+    NON_INTERACTIVE = "ME_STOW_NONINTERACTIVE"
+    SOCKET = "ME_STOW_SOCKET"
 
 
 class Params:
     def __init__(self, config_file: Path) -> None:
+        from metrics import METRICS
+
         # DEFAULT PARAMS
         self._op = Operation.NONE
         self.verbose = False
@@ -55,12 +101,36 @@ class Params:
         self.copy_back = False
         self.get_all = False
         self.list_full = False
+        self.list_conflicts = False
+        self.watch_poll = False
+        self.diff_unified = False
+        self.incremental = False
+        self.fold = False
+        self.jobs = 1
+        self.dry_run = False
+        # None, "text" or "json"
+        self.metrics: str | None = None
+        self.profile = False
+        # "text" or "ndjson"
+        self.format = "text"
         self.packages: List[Path] = []
         self.stowers: List[Path] = []
+        # walked lazily while stowing, not expanded here
+        self.stow_dirs: List[Path] = []
         self.exclude: List[str] = []
+        # roots of this run (`--roots=`), all of them if empty
+        self.only_roots: List[str] = []
+        self.yes = False
+        # never prompt (shell hook, cron...), missing answer is an error
+        self.interactive = not (
+            os.environ.get(EnvKey.NON_INTERACTIVE, "") not in ("", "0")
+            or has_flag(Arguments.NON_INTERACTIVE)
+        )
 
-        self.assign_configurations(config_file)
-        self.assign_user_arguments()
+        with METRICS.phase("config"):
+            self.assign_configurations(config_file)
+        with METRICS.phase("args"):
+            self.assign_user_arguments()
 
         # CHECK POINT
         self.eval_operation()
@@ -68,6 +138,8 @@ class Params:
         if self.verbose:
             print(f"-- Current source: '{self.source_dir}'")
             print(f"-- Current root: '{self.root}'")
+            for name, path in list(self.roots.items())[1:]:
+                print(f"-- Root '{name}': '{path}'")
             print(f"-- Running op: '{self.op.value}'")
             self.print_all_packages()
             if self.op == Operation.LIST:
@@ -76,14 +148,41 @@ class Params:
     def assign_configurations(self, config_file: Path):
         """
         Assign configurations from config file (if exist) or assign default value.
+
+        Environment variables (`ME_STOW_*`), then `--source=` and `--root=`
+        override the config file. In non-interactive mode
+        nothing is asked, a missing source is an error and the config file
+        is not written.
         """
+        from pathlib import Path
+
         config: Dict[str] = {}
         try:
             with open(config_file, "r") as file:
+                import json
+
                 config = json.load(file)
         except FileNotFoundError:
-            print("[warning] -- config file not found")
-            self.save_config = True
+            if self.interactive:
+                print("[warning] -- config file not found")
+                self.save_config = True
+
+        for key, env, arg in (
+            (ConfigKey.SOURCE, EnvKey.SOURCE, Arguments.SOURCE),
+            (ConfigKey.ROOT, EnvKey.ROOT, Arguments.ROOT),
+        ):
+            if value := flag_value(arg) or os.environ.get(env):
+                config[key] = os.path.expanduser(value)
+        if value := os.environ.get(EnvKey.RESOLVE):
+            # `--resolve=` is read with the other arguments
+            config[ConfigKey.RESOLVE] = value
+
+        if ConfigKey.SOURCE not in config and not self.interactive:
+            raise ValueError(
+                f"source directory not set (config, `{EnvKey.SOURCE}` or `--source=`)"
+            )
+        if ConfigKey.ROOT not in config and not self.interactive:
+            config[ConfigKey.ROOT] = str(Path.home())
 
         self.source_dir = (
             Path(config[ConfigKey.SOURCE])
@@ -110,6 +209,27 @@ class Params:
             )
         )
 
+        self.roots: Dict[str, Path] = {DEFAULT_ROOT: self.root}
+        for name, path in config.get(ConfigKey.ROOTS, {}).items():
+            if name in self.roots:
+                raise ValueError(f"duplicate root name: '{name}'")
+            path = Path(os.path.abspath(os.path.expanduser(path)))
+            if not path.exists():
+                raise FileNotFoundError(str(path))
+            self.roots[name] = path
+        self.package_roots: Dict[str, List[str]] = config.get(
+            ConfigKey.PACKAGE_ROOTS, {}
+        )
+        for package, names in self.package_roots.items():
+            if unknown := [name for name in names if name not in self.roots]:
+                raise ValueError(f"unknown root of '{package}': {', '.join(unknown)}")
+        # written back as they are by `--saveconfig`
+        self.extra_config = {
+            key: config[key]
+            for key in (ConfigKey.ROOTS, ConfigKey.PACKAGE_ROOTS)
+            if key in config
+        }
+
         self.resolve = (
             ResolveType(config[ConfigKey.RESOLVE])
             if ConfigKey.RESOLVE in config
@@ -119,6 +239,8 @@ class Params:
         return config
 
     def assign_user_arguments(self) -> None:
+        from pathlib import Path
+
         if len(sys.argv) == 1:
             self.op = Operation.HELP
             return
@@ -137,6 +259,12 @@ class Params:
 
                         if val == "full":  # for LIST op only
                             self.list_full = True
+                        elif val == "conflicts":  # for LIST op only
+                            self.list_conflicts = True
+                        elif val == "poll":  # for WATCH and SERVE op only
+                            self.watch_poll = True
+                        elif val == "unified":  # for DIFF op only
+                            self.diff_unified = True
                     case Arguments.VERBOSE:
                         self.verbose = True
                     case Arguments.FORCE:
@@ -149,6 +277,41 @@ class Params:
                         self.copy_back = True
                     case Arguments.PROCESS_ALL:
                         self.get_all = True
+                    case Arguments.INCREMENTAL:
+                        self.incremental = True
+                    case Arguments.FOLD:
+                        self.fold = True
+                    case Arguments.DRY_RUN:
+                        self.dry_run = True
+                    case Arguments.METRICS:
+                        self.metrics = val or "text"
+                        if self.metrics not in ("text", "json"):
+                            raise ValueError(f"invalid value for `--metrics`: '{val}'")
+                    case Arguments.FORMAT:
+                        # records are opened by the script, before parsing
+                        self.format = val
+                        if self.format not in ("text", "ndjson"):
+                            raise ValueError(f"invalid value for `--format`: '{val}'")
+                    case Arguments.PROFILE:
+                        # the profiler itself is started before parsing
+                        self.profile = True
+                    case Arguments.YES:
+                        self.yes = True
+                    case Arguments.ROOTS:
+                        # names are case sensitive
+                        value = flag_value(Arguments.ROOTS) or ""
+                        self.only_roots = [name for name in value.split(",") if name]
+                        if unknown := [
+                            n for n in self.only_roots if n not in self.roots
+                        ]:
+                            raise ValueError(f"unknown root: {', '.join(unknown)}")
+                    case Arguments.SOURCE | Arguments.ROOT | Arguments.NON_INTERACTIVE:
+                        # already used by `assign_configurations`
+                        pass
+                    case Arguments.JOBS:
+                        self.jobs = int(val) if val else os.cpu_count() or 1
+                        if self.jobs < 1:
+                            raise ValueError(f"invalid value for `--jobs`: '{val}'")
                 continue
 
             if arg.startswith("-"):
@@ -180,7 +343,7 @@ class Params:
 
             if self.op == Operation.STOW and (dir := Path(arg).absolute()).is_dir():
                 # stow all the files in this directory
-                self.stowers.extend([f for f in dir.rglob("*") if f.is_file()])
+                self.stow_dirs.append(dir)
 
             else:
                 raise ValueError(f"[warning] -- path not exist: '{arg}'")
@@ -200,22 +363,47 @@ class Params:
                         f"stow op accept only 1 package, current: [{leng}]"
                     )
 
-            case Operation.INIT | Operation.REMOVE if self.stowers:
+            case (
+                Operation.INIT
+                | Operation.REMOVE
+                | Operation.STATUS
+                | Operation.WATCH
+                | Operation.PRUNE
+                | Operation.RESTORE_BACKUP
+                | Operation.SERVE
+                | Operation.DIFF
+            ) if (self.stowers or self.stow_dirs):
                 raise ValueError(f"don't pass in file when running: '{self.op.name}'")
 
-            case Operation.INIT:
+            case (
+                Operation.INIT
+                | Operation.STATUS
+                | Operation.WATCH
+                | Operation.PRUNE
+                | Operation.RESTORE_BACKUP
+                | Operation.SERVE
+                | Operation.DIFF
+            ):
                 if not self.packages:
                     self.get_all = True
+                if self.op == Operation.DIFF and not has_flag(Arguments.JOBS):
+                    # hashing use all the cpu, unless told otherwise
+                    self.jobs = os.cpu_count() or 1
 
             case Operation.REMOVE:
                 if not self.packages:
-                    if input("Remove all packages [y/N]: ").lower().startswith("y"):
+                    if self.yes or (
+                        self.interactive
+                        and input("Remove all packages [y/N]: ").lower().startswith("y")
+                    ):
                         self.get_all = True
+                    elif not self.interactive:
+                        raise ValueError("use `--yes` to remove all the packages")
 
             case Operation.NONE:
                 if not self.packages:
                     raise ValueError("Invalid arguments!!")
-                elif self.stowers:
+                elif self.stowers or self.stow_dirs:
                     self.op = Operation.STOW
                 else:
                     self.op = Operation.INIT
@@ -230,32 +418,93 @@ class Params:
                 raise ValueError(f"don't use `--all` when running '{self.op.name}'")
             self.get_all_packages()
 
+    def root_packages(self, packages: List[Path]) -> List[Tuple[str, Path, List[Path]]]:
+        """
+        Return (name, root, packages deployed to it) of every root of the
+        run, in config order (`root_path` first).
+        """
+        names = self.only_roots or list(self.roots)
+        return [
+            (
+                name,
+                self.roots[name],
+                [p for p in packages if name in self.package_roots.get(p.name, names)],
+            )
+            for name in names
+        ]
+
     def get_package_to_stow(self) -> Path:
         return self.packages[0]
 
     def get_all_packages(self) -> None:
-        self.packages = [
-            p
-            for p in self.source_dir.iterdir()
-            if p.is_dir() and not p.name.startswith(".") and p.name not in self.exclude
-        ]
+        from pathlib import Path
+        from metrics import METRICS
+
+        # sorted, so packages always processed (and win conflicts) in same order
+        # `scandir` know the type of every entry, no `stat` for each
+        with METRICS.phase("discovery"), os.scandir(self.source_dir) as it:
+            self.packages = sorted(
+                Path(p.path)
+                for p in it
+                if p.is_dir()
+                and not p.name.startswith(".")
+                and p.name not in self.exclude
+            )
 
     def print_all_packages(self) -> None:
+        from ignore import package_ignore
+        from index import TargetIndex
+        from output import RECORDS
+
+        if RECORDS.enabled and self.op == Operation.LIST:
+            self.record_all_packages()
+            return
+
         print(f"\nPackages to stow : [{len(self.packages)}]")
         for pkg in self.packages:
             name = f"'{pkg.name}'"
             print(name, "-" * (40 - (len(name))))
             if self.list_full:
-                for line in print_tree(pkg):
+                for line in print_tree(pkg, ignore=package_ignore(pkg)):
                     print(line)
 
+        if self.list_conflicts:
+            report = TargetIndex.build(self.root, self.packages).report()
+            print(f"\nCollisions (same target in many packages) : [{len(report)}]")
+            for line in report:
+                print(line)
+
+    def record_all_packages(self) -> None:
+        """
+        Same as `print_all_packages`, as records, no line is formatted.
+        """
+        from walker import walk
+        from ignore import package_ignore
+        from index import TargetIndex
+        from output import RECORDS
+
+        for pkg in self.packages:
+            RECORDS.package(pkg.name, None)
+            if self.list_full:
+                for item in walk(pkg, package_ignore(pkg)):
+                    RECORDS.entry(pkg.name, item.rel, item.is_dir)
+
+        if self.list_conflicts:
+            index = TargetIndex.build(self.root, self.packages)
+            for target, pkgs in index.sorted_collisions():
+                RECORDS.collision(target, pkgs)
+        RECORDS.summary(self.op.value, len(self.packages), len(self.packages))
+
     def save_configuration(self, file_dir: Path) -> None:
         config = {
             ConfigKey.SOURCE: str(self.source_dir),
             ConfigKey.ROOT: str(self.root),
-            ConfigKey.RESOLVE: self.resolve,
+            ConfigKey.RESOLVE: self.resolve.value,
+            **self.extra_config,
         }
 
+        import json
+
         with open(file_dir, "w") as file:
             json.dump(config, file, indent=4)
 
@@ -295,7 +544,10 @@ class Params:
     def source_dir(self, path: Path):
         if not path.exists():
             raise FileNotFoundError(str(path))
-        self._source_dir = path
+        from pathlib import Path
+
+        # absolute, links and manifests must not depend on the current directory
+        self._source_dir = Path(os.path.abspath(path))
 
     @property
     def root(self):
@@ -305,7 +557,39 @@ class Params:
     def root(self, path: Path):
         if not path.exists():
             raise FileNotFoundError(str(path))
-        self._root = path
+        from pathlib import Path
+
+        self._root = Path(os.path.abspath(path))
+
+
+def flag_value(name: str) -> str | None:
+    """
+    Return the value of `--name=value` in the command line (case kept).
+    """
+    prefix = f"--{name}="
+    for arg in sys.argv[1:]:
+        if arg.lower().startswith(prefix):
+            return arg[len(prefix) :]
+    return None
+
+
+def wants_help() -> bool:
+    """
+    Return `True` if the command line only ask for the help (no argument,
+    `-h` or `--help`), nothing else is read to answer it.
+    """
+    args = [arg.lower() for arg in sys.argv[1:]]
+    return not args or "-h" in args or f"--{Arguments.HELP}" in args
+
+
+def has_flag(name: str) -> bool:
+    """
+    Return `True` if `--name` (with or without value) is in the command line.
+    """
+    return any(
+        arg.lower() == f"--{name}" or arg.lower().startswith(f"--{name}=")
+        for arg in sys.argv[1:]
+    )
 
 
 def is_folder_name(name: str) -> bool:
@@ -328,20 +612,24 @@ TREE_TEE = "├── "
 TREE_LAST = "└── "
 
 
-def print_tree(dir_path: Path, prefix: str = "") -> Generator[str]:
+def print_tree(
+    dir_path: Path, prefix: str = "", ignore: IgnoreMatcher | None = None
+) -> Generator[str]:
     """
-    A recursive generator, given a directory Path object will yield
+    A generator, given a directory Path object will yield
     a visual tree structure line by line with each line prefixed by
     the same characters
 
     Credit to: https://stackoverflow.com/a/59109706 with some modification
     """
-    contents = [d for d in dir_path.iterdir() if d.is_dir()]
-    contents += [f for f in dir_path.iterdir() if f.is_file()]
-    pointers = [TREE_TEE] * (len(contents) - 1) + [TREE_LAST]
-
-    for pointer, path in zip(pointers, contents):
-        yield prefix + pointer + path.name
-        if path.is_dir():
-            extension = TREE_BRANCH if pointer == TREE_TEE else TREE_SPACE
-            yield from print_tree(path, prefix=prefix + extension)
+    from walker import walk
+
+    # prefix of each depth, for the entries on the current path
+    prefixes = [prefix]
+    for item in walk(dir_path, ignore):
+        del prefixes[item.depth + 1 :]
+        pointer = TREE_LAST if item.is_last else TREE_TEE
+        yield prefixes[item.depth] + pointer + item.name
+        if item.is_dir:
+            extension = TREE_SPACE if item.is_last else TREE_BRANCH
+            prefixes.append(prefixes[item.depth] + extension)
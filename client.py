@@ -0,0 +1,60 @@
+#!/usr/bin/env -S python3 -S
+"""
+Thin client of `me-stow --serve`, a query cost an interpreter start and
+one round trip to the server, nothing is imported from me-stow.
+
+Usage:
+  client.py owner <path>          exit code 1 if the path is not managed
+  client.py status [package...]   exit code 1 if any link is not ok
+  client.py list
+  client.py ping
+
+Print the JSON answer. The socket is `me-stow.sock` next to this file,
+or `ME_STOW_SOCKET`.
+"""
+
+import os
+import sys
+import json
+import socket
+
+
+def main() -> int:
+    args = sys.argv[1:]
+    if not args or args[0] in ("-h", "--help"):
+        print(__doc__)
+        return 2
+    if args[0] == "owner" and len(args) > 1:
+        # the server run in another working directory
+        args[1:] = [os.path.abspath(os.path.expanduser(" ".join(args[1:])))]
+
+    here = os.path.dirname(os.path.realpath(__file__))
+    path = os.environ.get("ME_STOW_SOCKET") or os.path.join(here, "me-stow.sock")
+    with socket.socket(socket.AF_UNIX) as sock:
+        try:
+            sock.connect(path)
+        except OSError as e:
+            print(f"[error] -- server not running on '{path}' ({e})", file=sys.stderr)
+            return 2
+        sock.sendall((" ".join(args) + "\n").encode())
+        reply = b""
+        while not reply.endswith(b"\n"):
+            if not (chunk := sock.recv(65536)):
+                break
+            reply += chunk
+
+    print(reply.decode(), end="")
+    data = json.loads(reply)
+    if "error" in data:
+        return 2
+    if args[0] == "owner":
+        return 0 if data["package"] else 1
+    if args[0] == "status":
+        # any count other than linked-ok is drift
+        drift = any(k != "linked-ok" for counts in data.values() for k in counts)
+        return 1 if drift else 0
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,96 @@
+from pathlib import Path
+import os
+from typing import Dict, List
+
+
+# ============================================================= #
+# ============================================================= #
+
+CHUNK_SIZE = 1024 * 1024
+
+
+class DigestCache:
+    """
+    Sidecar cache of file digests, keyed by path.
+
+    A digest is only trusted while size, mtime and inode of the file are the
+    same as when it was computed, so unchanged files are never read again.
+    """
+
+    def __init__(self, file: Path) -> None:
+        self.file = file
+        self._digests: Dict[str, List] | None = None
+        self._dirty = False
+
+    @property
+    def digests(self) -> Dict[str, List]:
+        # load on first use, most run never compare any file
+        if self._digests is None:
+            import json
+
+            try:
+                with open(self.file, "r") as file:
+                    self._digests = json.load(file)
+            except (FileNotFoundError, json.JSONDecodeError):
+                self._digests = {}
+        return self._digests
+
+    def get(self, path: Path, st: os.stat_result) -> str | None:
+        item = self.digests.get(str(path))
+        if item and item[:3] == [st.st_size, st.st_mtime_ns, st.st_ino]:
+            return item[3]
+        return None
+
+    def put(self, path: Path, st: os.stat_result, digest: str) -> None:
+        self.digests[str(path)] = [st.st_size, st.st_mtime_ns, st.st_ino, digest]
+        self._dirty = True
+
+    def save(self) -> None:
+        if not self._dirty:
+            return
+        import json
+
+        tmp = self.file.with_suffix(".tmp")
+        with open(tmp, "w") as file:
+            json.dump(self.digests, file)
+        os.replace(tmp, self.file)
+        self._dirty = False
+
+
+def same_content(a: Path, b: Path, cache: DigestCache | None = None) -> bool:
+    """
+    Check two files have the same content, from cheap to expensive:
+    same file, size, cached digests, then compare chunk by chunk.
+
+    :raise FileNotFoundError: if one of the files not exist
+    """
+    sa = os.stat(a)
+    sb = os.stat(b)
+    if os.path.samestat(sa, sb):
+        return True
+    if sa.st_size != sb.st_size:
+        return False
+
+    if cache is not None:
+        da = cache.get(a, sa)
+        db = cache.get(b, sb)
+        if da is not None and db is not None:
+            return da == db
+
+    import hashlib
+
+    # both files are the same when it finish, so one digest is enough
+    hasher = hashlib.blake2b()
+    with open(a, "rb") as fa, open(b, "rb") as fb:
+        while chunk := fa.read(CHUNK_SIZE):
+            other = fb.read(CHUNK_SIZE)
+            if chunk != other:
+                # Stop at the first different chunk, nothing to cache
+                return False
+            hasher.update(chunk)
+
+    if cache is not None:
+        digest = hasher.hexdigest()
+        cache.put(a, sa, digest)
+        cache.put(b, sb, digest)
+    return True
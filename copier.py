@@ -0,0 +1,143 @@
+from pathlib import Path
+import os
+from enum import Enum
+from typing import Callable, Dict
+from metrics import METRICS
+
+try:
+    import fcntl
+except ImportError:  # not on unix
+    fcntl = None
+
+
+# ============================================================= #
+# ============================================================= #
+
+# from linux/fs.h: _IOW(0x94, 9, int)
+FICLONE = 0x40049409
+BUFFER_SIZE = 1024 * 1024
+
+
+class CopyStrategy(Enum):
+    REFLINK = "reflink"
+    COPY_FILE_RANGE = "copy_file_range"
+    SENDFILE = "sendfile"
+    BUFFERED = "buffered"
+
+
+# number of files copied with each strategy
+COPY_STATS: Dict[CopyStrategy, int] = {s: 0 for s in CopyStrategy}
+
+# called after every copy with (src, dst, strategy), set by `-v`
+on_copy: Callable[[Path, Path, CopyStrategy], None] | None = None
+
+
+def copyfile(src: Path, dst: Path) -> CopyStrategy:
+    """
+    Copy file content (like `shutil.copyfile`) with the cheapest way the
+    system support, in order: reflink (btrfs/xfs share the blocks, nothing
+    is copied), `copy_file_range` (in kernel, may be offload to the fs),
+    `sendfile`, and finally a buffered copy.
+
+    Return the strategy that was used.
+    """
+    with METRICS.phase("copy"):
+        return _copyfile(src, dst)
+
+
+def _copyfile(src: Path, dst: Path) -> CopyStrategy:
+    with open(src, "rb") as fsrc:
+        st = os.fstat(fsrc.fileno())
+        try:
+            if os.path.samestat(st, os.stat(dst)):
+                import shutil as su
+
+                raise su.SameFileError(f"{src!r} and {dst!r} are the same file")
+        except FileNotFoundError:
+            pass
+
+        with open(dst, "wb") as fdst:
+            strategy = _copy_fd(fsrc.fileno(), fdst.fileno(), st.st_size)
+            if strategy == CopyStrategy.BUFFERED:
+                import shutil as su
+
+                su.copyfileobj(fsrc, fdst, BUFFER_SIZE)
+
+    COPY_STATS[strategy] += 1
+    METRICS.count("bytes_copied", st.st_size)
+    if on_copy is not None:
+        on_copy(Path(src), Path(dst), strategy)
+    return strategy
+
+
+def copy(src: Path, dst: Path) -> CopyStrategy:
+    """
+    Same as `copyfile`, also copy the permission bits (like `shutil.copy`).
+    """
+    if os.path.isdir(dst):
+        dst = Path(dst) / Path(src).name
+    import shutil as su
+
+    strategy = copyfile(src, dst)
+    su.copymode(src, dst)
+    return strategy
+
+
+def copytree(src: Path, dst: Path, exist_ok: bool = False) -> None:
+    """
+    `shutil.copytree` that copy every file with `copy`.
+    """
+    import shutil as su
+
+    su.copytree(src, dst, symlinks=True, copy_function=copy, dirs_exist_ok=exist_ok)
+
+
+def _copy_fd(src_fd: int, dst_fd: int, size: int) -> CopyStrategy:
+    """
+    Try the zero-copy ways, return `BUFFERED` if none of them work,
+    then the caller have to copy it.
+    """
+    if fcntl is not None:
+        try:
+            fcntl.ioctl(dst_fd, FICLONE, src_fd)
+            return CopyStrategy.REFLINK
+        except OSError:
+            pass
+
+    if size == 0:
+        return CopyStrategy.BUFFERED
+
+    if hasattr(os, "copy_file_range") and _copy_loop(
+        os.copy_file_range, src_fd, dst_fd, size
+    ):
+        return CopyStrategy.COPY_FILE_RANGE
+
+    if hasattr(os, "sendfile") and _copy_loop(
+        lambda s, d, n: os.sendfile(d, s, None, n), src_fd, dst_fd, size
+    ):
+        return CopyStrategy.SENDFILE
+
+    return CopyStrategy.BUFFERED
+
+
+def _copy_loop(func: Callable, src_fd: int, dst_fd: int, size: int) -> bool:
+    """
+    Call `func(src_fd, dst_fd, count)` until the whole file is copied.
+
+    Return `False` if the syscall is not supported for these files (only
+    possible before anything was copied, so the next strategy can start
+    over from the beginning).
+    """
+    copied = 0
+    count = min(max(size, BUFFER_SIZE), 1 << 30)
+    while True:
+        try:
+            sent = func(src_fd, dst_fd, count)
+        except OSError:
+            if copied:
+                raise
+            return False
+        if sent == 0:
+            # some special fs report 0 without copying anything
+            return copied > 0
+        copied += sent
@@ -0,0 +1,135 @@
+from pathlib import Path
+import os
+import json
+import socket
+import threading
+import socketserver
+from typing import Dict
+from index import PackageIndex
+from status import check_link, count_status
+
+
+# ============================================================= #
+# ============================================================= #
+
+# one request per line, one JSON object per line back, many requests can
+# be sent on the same connection:
+#   owner <path>          package (and source, link status) of a path
+#   status [package...]   link status counts of the packages (or all)
+#   list                  packages and number of targets
+#   ping
+COMMANDS = ("owner", "status", "list", "ping")
+
+
+class QueryHandler(socketserver.StreamRequestHandler):
+    def handle(self) -> None:
+        for line in self.rfile:
+            try:
+                reply = answer(self.server.index, line.decode().rstrip("\n"))
+            except Exception as e:  # noqa: BLE001
+                reply = {"error": str(e)}
+            self.wfile.write(json.dumps(reply).encode() + b"\n")
+            self.wfile.flush()
+
+
+class QueryServer(socketserver.ThreadingUnixStreamServer):
+    """
+    Answer queries of the index on a Unix socket, every connection in its
+    own thread.
+    """
+
+    daemon_threads = True
+
+    def __init__(self, path: Path, index: PackageIndex) -> None:
+        self.index = index
+        claim_socket(path)
+        super().__init__(str(path), QueryHandler)
+        # only the user can ask
+        os.chmod(path, 0o600)
+
+
+def claim_socket(path: Path) -> None:
+    """
+    Remove the socket left by a server that is not running any more.
+
+    :raise FileExistsError: if a server is already answering on it
+    """
+    if not os.path.exists(path):
+        return
+    with socket.socket(socket.AF_UNIX) as sock:
+        try:
+            sock.connect(str(path))
+        except (ConnectionRefusedError, FileNotFoundError):
+            os.unlink(path)
+            return
+    raise FileExistsError(f"a server is already running on '{path}'")
+
+
+def start_server(path: Path, index: PackageIndex) -> QueryServer:
+    """
+    Start answering in a background thread, stop with `stop_server`.
+    """
+    server = QueryServer(path, index)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+def stop_server(server: QueryServer) -> None:
+    server.shutdown()
+    server.server_close()
+    try:
+        os.unlink(server.server_address)
+    except FileNotFoundError:
+        pass
+
+
+def answer(index: PackageIndex, line: str) -> Dict:
+    command, _, arg = line.strip().partition(" ")
+    match command:
+        case "owner":
+            return answer_owner(index, arg)
+        case "status":
+            names = arg.split() or [pkg.name for pkg in index.packages]
+            result = {}
+            for name in names:
+                # one `lstat` per link, a file in a folded directory is not
+                # a link itself but is linked (same as `--status`)
+                links = index.links(name)
+                counts = count_status([check_link(t, s) for t, s in links])
+                result[name] = {k: n for k, n in counts.items() if n}
+            return result
+        case "list":
+            return {
+                "packages": [pkg.name for pkg in index.packages],
+                "targets": len(index.targets),
+            }
+        case "ping":
+            return {"ok": True}
+        case _:
+            return {"error": f"unknown command '{command}', use: {', '.join(COMMANDS)}"}
+
+
+def answer_owner(index: PackageIndex, path: str) -> Dict:
+    """
+    Look up a target on system, or a file in a package (then its target).
+    """
+    path = os.path.normpath(path)
+    target = path
+    for pkg in index.packages:
+        prefix = str(pkg) + os.sep
+        if path.startswith(prefix):
+            target = index.root + path[len(prefix) :]
+            break
+
+    found = index.owner(target)
+    if found is None:
+        return {"path": path, "package": None}
+    package, source = found
+    status, _ = check_link(target, source)
+    return {
+        "path": path,
+        "target": target,
+        "package": package,
+        "source": source,
+        "status": status,
+    }
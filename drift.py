@@ -0,0 +1,190 @@
+from pathlib import Path
+import os
+import stat
+from typing import Dict, List, Tuple
+from content import CHUNK_SIZE, DigestCache
+from metrics import METRICS
+from walker import walk
+
+
+# ============================================================= #
+# ============================================================= #
+
+
+class DriftStatus:
+    SAME = "same"
+    DIFFER = "differ"
+    # one side is a directory, or not a regular file
+    TYPE = "type-differ"
+    UNREADABLE = "unreadable"
+
+
+ALL_DRIFT = (
+    DriftStatus.SAME,
+    DriftStatus.DIFFER,
+    DriftStatus.TYPE,
+    DriftStatus.UNREADABLE,
+)
+
+# less than this to hash is done in process, a pool cost more to start
+# than hashing a few small files
+POOL_MIN_BYTES = 8 * 1024 * 1024
+
+# files bigger than this are never shown as unified diff
+DIFF_MAX_SIZE = 1024 * 1024
+
+
+def hash_file(path: str) -> str | None:
+    """
+    Blake2b digest of the file, read by chunks, `None` if it can't be read.
+
+    Run in the worker processes, so only plain values in and out.
+    """
+    import hashlib
+
+    hasher = hashlib.blake2b()
+    try:
+        with open(path, "rb") as file:
+            while chunk := file.read(CHUNK_SIZE):
+                hasher.update(chunk)
+    except OSError:
+        return None
+    return hasher.hexdigest()
+
+
+def hash_files(
+    paths: List[str], sizes: Dict[str, int], jobs: int
+) -> Dict[str, str | None]:
+    """
+    Return digest of every path, in a process pool when there is enough to
+    read. Biggest files go first, so one big file don't finish alone at
+    the end.
+    """
+    paths = sorted(paths, key=lambda p: sizes[p], reverse=True)
+    total = sum(sizes[p] for p in paths)
+    METRICS.count("bytes_hashed", total)
+    if jobs <= 1 or len(paths) < 2 or total < POOL_MIN_BYTES:
+        return {path: hash_file(path) for path in paths}
+
+    from concurrent.futures import ProcessPoolExecutor
+
+    with ProcessPoolExecutor(max_workers=min(jobs, len(paths))) as pool:
+        return dict(zip(paths, pool.map(hash_file, paths)))
+
+
+def expand_pairs(pairs: List[Tuple[str, str]]) -> List[Tuple[str, str]]:
+    """
+    Return (target, source) of every file under the pairs, a directory on
+    both sides (folded directory that is a real one on system) is walked.
+    """
+    files: List[Tuple[str, str]] = []
+    for target, source in pairs:
+        if (
+            os.path.isdir(source)
+            and not os.path.islink(target)
+            and os.path.isdir(target)
+        ):
+            for item in walk(source):
+                if not item.is_dir:
+                    files.append((os.path.join(target, item.rel), item.path))
+        else:
+            files.append((target, source))
+    return files
+
+
+def find_drift(
+    pairs: List[Tuple[str, str]], cache: DigestCache | None = None, jobs: int = 1
+) -> List[Tuple[str, str, str]]:
+    """
+    Compare every real file on system (target) with its package file
+    (source), return (target, source, status) of each, in order.
+
+    From cheap to expensive: same file, type, size, cached digests, then
+    hash what is left, every path once, in `jobs` processes. Digests go
+    back to the cache, so the next report (and the backups of the adopt
+    that follow) don't read the files again.
+    """
+    result: List[Tuple[str, str, str] | None] = []
+    pending: List[Tuple[int, str, str, os.stat_result, os.stat_result]] = []
+    for target, source in pairs:
+        try:
+            st_target = os.lstat(target)
+            st_source = os.stat(source)
+        except OSError:
+            result.append((target, source, DriftStatus.UNREADABLE))
+            continue
+        if not (stat.S_ISREG(st_target.st_mode) and stat.S_ISREG(st_source.st_mode)):
+            result.append((target, source, DriftStatus.TYPE))
+        elif os.path.samestat(st_target, st_source):
+            result.append((target, source, DriftStatus.SAME))
+        elif st_target.st_size != st_source.st_size:
+            result.append((target, source, DriftStatus.DIFFER))
+        else:
+            # decided below
+            result.append(None)
+            pending.append((len(result) - 1, target, source, st_target, st_source))
+
+    digests: Dict[str, str | None] = {}
+    sizes: Dict[str, int] = {}
+    for _, target, source, st_target, st_source in pending:
+        for path, st in ((target, st_target), (source, st_source)):
+            cached = cache.get(Path(path), st) if cache is not None else None
+            if cached is not None:
+                digests[path] = cached
+            else:
+                sizes[path] = st.st_size
+    METRICS.count("files_hashed", len(sizes))
+    with METRICS.phase("hash"):
+        hashed = hash_files(list(sizes), sizes, jobs)
+    digests.update(hashed)
+
+    for i, target, source, st_target, st_source in pending:
+        if cache is not None:
+            for path, st in ((target, st_target), (source, st_source)):
+                if path in hashed and hashed[path] is not None:
+                    cache.put(Path(path), st, hashed[path])
+        a, b = digests[target], digests[source]
+        if a is None or b is None:
+            result[i] = (target, source, DriftStatus.UNREADABLE)
+        else:
+            result[i] = (
+                target,
+                source,
+                DriftStatus.SAME if a == b else DriftStatus.DIFFER,
+            )
+    return result
+
+
+def unified_diff(target: str, source: str) -> List[str] | None:
+    """
+    Return the unified diff (package file -> system file) of two text
+    files, `None` for binary or too big files.
+    """
+    texts: List[List[str]] = []
+    for path in (source, target):
+        try:
+            if os.path.getsize(path) > DIFF_MAX_SIZE:
+                return None
+            with open(path, "rb") as file:
+                data = file.read()
+        except OSError:
+            return None
+        if b"\0" in data:
+            return None
+        try:
+            texts.append(data.decode().splitlines(keepends=True))
+        except UnicodeDecodeError:
+            return None
+
+    import difflib
+
+    lines = difflib.unified_diff(texts[0], texts[1], fromfile=source, tofile=target)
+    # last line of a file without newline
+    return [line if line.endswith("\n") else line + "\n" for line in lines]
+
+
+def count_drift(drift: List[Tuple[str, str, str]]) -> Dict[str, int]:
+    counts = {status: 0 for status in ALL_DRIFT}
+    for _, _, status in drift:
+        counts[status] += 1
+    return counts
@@ -0,0 +1,83 @@
+import os
+from typing import TYPE_CHECKING, Tuple
+
+if TYPE_CHECKING:
+    from typing import Self
+
+
+# ============================================================= #
+# ============================================================= #
+
+# every call made relative to a directory fd
+DIR_FD = {os.stat, os.readlink, os.symlink, os.unlink, os.mkdir} <= os.supports_dir_fd
+DIR_FLAGS = os.O_RDONLY | getattr(os, "O_DIRECTORY", 0) | getattr(os, "O_CLOEXEC", 0)
+
+
+class DirCursor:
+    """
+    Run file operations relative to the (open) parent directory, instead of
+    giving the whole path to the kernel every time.
+
+    `at(path)` return the path to use and the `dir_fd` to pass to the `os`
+    function (`None` means a normal path call), so a call site look like
+    `name, fd = cursor.at(path); os.unlink(name, dir_fd=fd)`.
+
+    Paths come in groups of the same directory (a plan batch, a directory
+    listing...), only the last directory is kept open. With `lazy`, it is
+    opened on the second path in a row inside it, so a lone file cost no
+    extra `open`/`close`. Once opened, the directory can't be swapped
+    (renamed, replaced by a link) under the following operations.
+
+    Not thread safe, one cursor per thread.
+    """
+
+    def __init__(self, lazy: bool = True) -> None:
+        self.lazy = lazy
+        self.dir: str | None = None
+        self.fd: int | None = None
+        self.failed = False
+
+    def at(self, path: str) -> Tuple[str, int | None]:
+        if not DIR_FD:
+            return path, None
+        dir, _, name = path.rpartition(os.sep)
+        if dir != self.dir:
+            self.close()
+            self.dir = dir
+            if self.lazy:
+                return path, None
+        if self.fd is None:
+            if self.failed:
+                return path, None
+            try:
+                self.fd = os.open(dir or os.sep, DIR_FLAGS)
+            except OSError:
+                # missing (or not a directory), let the call report it
+                self.failed = True
+                return path, None
+        return name, self.fd
+
+    def close(self) -> None:
+        if self.fd is not None:
+            os.close(self.fd)
+        self.dir, self.fd, self.failed = None, None, False
+
+    def __enter__(self) -> "Self":
+        return self
+
+    def __exit__(self, *_) -> None:
+        self.close()
+
+
+def lstat(path: str, cursor: DirCursor | None = None) -> os.stat_result:
+    if cursor is None:
+        return os.lstat(path)
+    name, fd = cursor.at(path)
+    return os.stat(name, dir_fd=fd, follow_symlinks=False)
+
+
+def readlink(path: str, cursor: DirCursor | None = None) -> str:
+    if cursor is None:
+        return os.readlink(path)
+    name, fd = cursor.at(path)
+    return os.readlink(name, dir_fd=fd)
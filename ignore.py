@@ -0,0 +1,137 @@
+from pathlib import Path
+import re
+import fnmatch
+import os
+from typing import Iterable, List
+
+# name of the ignore file: in a directory being stowed, in a package, or in
+# source directory (for every package)
+IGNORE_FILE = ".stow-ignore"
+
+
+# ============================================================= #
+# ============================================================= #
+
+
+class IgnoreMatcher:
+    """
+    All ignore patterns compiled into one regex per kind, so an entry is
+    checked with at most two `match` calls however many patterns there are.
+
+    Pattern syntax (one per line in an ignore file, `#` for comment):
+      - `*.swp`, `.git`      glob, match the name at any depth
+      - `cache/*.tmp`        glob with `/`, match the relative path
+      - `build/`             trailing `/`, only match directories
+      - `re:.*\\.py[co]$`     regex, match the relative path
+    """
+
+    def __init__(self, patterns: Iterable[str] = ()) -> None:
+        self.patterns: List[str] = []
+        # [any entry, directory only], for the name and the relative path
+        self._names: List[List[str]] = [[], []]
+        self._paths: List[List[str]] = [[], []]
+        self.add(patterns)
+
+    def add(self, patterns: Iterable[str]) -> None:
+        for line in patterns:
+            pattern = line.strip()
+            if not pattern or pattern.startswith("#"):
+                continue
+            self.patterns.append(pattern)
+
+            if pattern.startswith("re:"):
+                self._paths[0].append(pattern[3:])
+                continue
+            dir_only = pattern.endswith("/")
+            pattern = pattern.rstrip("/")
+            regex = fnmatch.translate(pattern.lstrip("/"))
+            if "/" in pattern:
+                self._paths[dir_only].append(regex)
+            else:
+                self._names[dir_only].append(regex)
+        self._compile()
+
+    def add_file(self, file: Path | str) -> bool:
+        """
+        Add the patterns of an ignore file, return `False` if not exist.
+        """
+        try:
+            with open(file, "r") as f:
+                self.add(f.readlines())
+        except (FileNotFoundError, NotADirectoryError):
+            return False
+        return True
+
+    def _compile(self) -> None:
+        def join(regexes: List[str]):
+            if not regexes:
+                return None
+            return re.compile("|".join(f"(?:{r})" for r in regexes))
+
+        self.names = [join(self._names[0]), join(self._names[1])]
+        self.paths = [join(self._paths[0]), join(self._paths[1])]
+
+    def __bool__(self) -> bool:
+        return bool(self.patterns)
+
+    def match(self, rel: str, name: str, is_dir: bool) -> bool:
+        """
+        :param rel: path relative to the walked directory, `/` separated
+        """
+        for regex in (self.names[0], self.names[1] if is_dir else None):
+            if regex is not None and regex.match(name):
+                return True
+        for regex in (self.paths[0], self.paths[1] if is_dir else None):
+            if regex is not None and regex.match(rel):
+                return True
+        return False
+
+    def filter(
+        self, rel: str, entries: List[os.DirEntry], is_dir: bool
+    ) -> List[os.DirEntry]:
+        """
+        Entries of directory `rel` (relative to the walked directory, empty
+        for the top) that are not ignored.
+        """
+        prefix = rel + "/" if rel else ""
+        return [e for e in entries if not self.match(prefix + e.name, e.name, is_dir)]
+
+    def ignores_in(self, top: Path | str, rel: str) -> bool:
+        """
+        Return `True` if anything under directory `top` (at `rel`) is ignored.
+        """
+        stack = [(str(top), rel)]
+        while stack:
+            path, rel = stack.pop()
+            try:
+                with os.scandir(path) as it:
+                    entries = list(it)
+            except OSError:
+                continue
+            for entry in entries:
+                is_dir = entry.is_dir(follow_symlinks=False)
+                sub = f"{rel}/{entry.name}" if rel else entry.name
+                if self.match(sub, entry.name, is_dir):
+                    return True
+                if is_dir:
+                    stack.append((entry.path, sub))
+        return False
+
+
+def load_ignore(*files: Path | str) -> IgnoreMatcher:
+    """
+    Matcher of all the ignore files that exist, the ignore file itself is
+    always ignored.
+    """
+    matcher = IgnoreMatcher([IGNORE_FILE])
+    for file in files:
+        matcher.add_file(file)
+    return matcher
+
+
+def package_ignore(package: Path) -> IgnoreMatcher:
+    """
+    Matcher of a package: the global ignore file in source directory, then
+    the one in the package, patterns are relative to the package.
+    """
+    return load_ignore(package.parent / IGNORE_FILE, package / IGNORE_FILE)
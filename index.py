@@ -0,0 +1,283 @@
+from pathlib import Path
+from array import array
+import os
+import threading
+from typing import Dict, Iterable, List, Tuple
+from walker import scan_dir, walk
+from tree import PathTree
+from ignore import IgnoreMatcher, package_ignore
+
+
+# ============================================================= #
+# ============================================================= #
+
+
+class TargetIndex:
+    """
+    In memory index of every target path (path on system) to the package
+    that own it, to find targets that more than one package want.
+
+    Packages have to be added in the order they are processed, the owner
+    of a target is the last package added (the one that win on init).
+
+    Targets are nodes of a `PathTree`, owners small ints in arrays beside
+    it, so a million targets cost a few tens of MB, not full path strings
+    in dicts.
+
+    Filled from the worker pool of `init --jobs`, adding is done under a
+    lock (the tree and the arrays are changed in several steps).
+    """
+
+    def __init__(self) -> None:
+        self.tree = PathTree()
+        # package names, by id (position)
+        self.packages: List[str] = []
+        self.package_ids: Dict[str, int] = {}
+        # node -> id of the owner package of the file, -1 if none
+        self.owners = array("i")
+        # node -> id of the first package that has the directory, -1 if none
+        self.dirs = array("i")
+        # node -> all packages that want it, in order
+        self.collisions: Dict[int, List[str]] = {}
+        self.lock = threading.Lock()
+
+    @classmethod
+    def build(cls, root: Path, packages: List[Path]) -> "TargetIndex":
+        """
+        Index the packages with a single walk over each of them, no target
+        path is ever built.
+        """
+        index = cls()
+        root_node = index.tree.add(str(root))
+        for pkg in packages:
+            for item in walk(pkg, package_ignore(pkg), tree=index.tree, node=root_node):
+                index.add_node(item.node, pkg.name, item.is_dir)
+        return index
+
+    def add(self, target: str, package: str, is_dir: bool = False) -> str | None:
+        """
+        Record a target of the package.
+
+        Return the package that had the target before (file in other
+        package, or file and directory with the same path), None if no one.
+        """
+        with self.lock:
+            return self._add_node(self.tree.add(target), package, is_dir)
+
+    def add_node(self, node: int, package: str, is_dir: bool = False) -> str | None:
+        """
+        Same as `add`, with the node of the target in `tree`.
+        """
+        with self.lock:
+            return self._add_node(node, package, is_dir)
+
+    def _add_node(self, node: int, package: str, is_dir: bool) -> str | None:
+        if (pkg := self.package_ids.get(package)) is None:
+            pkg = self.package_ids[package] = len(self.packages)
+            self.packages.append(package)
+        owners, dirs = self.owners, self.dirs
+        if node >= len(owners):
+            # grown by blocks, not on every new node
+            grow = array("i", [-1]) * (len(self.tree) - len(owners) + 4096)
+            owners.extend(grow)
+            dirs.extend(grow)
+
+        other = owners[node]
+        if is_dir:
+            if dirs[node] < 0:
+                dirs[node] = pkg
+        else:
+            if other < 0:
+                other = dirs[node]
+            owners[node] = pkg
+
+        if other < 0 or other == pkg:
+            return None
+        other_name = self.packages[other]
+        if (packages := self.collisions.get(node)) is None:
+            self.collisions[node] = [other_name, package]
+        elif package not in packages:
+            packages.append(package)
+        return other_name
+
+    def owner(self, target: str) -> str | None:
+        node = self.tree.find(target)
+        if node is None or node >= len(self.owners) or self.owners[node] < 0:
+            return None
+        return self.packages[self.owners[node]]
+
+    def sorted_collisions(self) -> List[Tuple[str, List[str]]]:
+        """
+        Return (target, packages) of every collision, sorted by target.
+        """
+        return sorted((self.tree.path(n), pkgs) for n, pkgs in self.collisions.items())
+
+    def report(self) -> List[str]:
+        """
+        Return one line for each collision, sorted by target.
+        """
+        return [
+            f"[collision] '{target}' -- {', '.join(pkgs)} ('{pkgs[-1]}' win)"
+            for target, pkgs in self.sorted_collisions()
+        ]
+
+
+class PackageIndex:
+    """
+    Targets of the packages kept in memory by a long running process
+    (`--serve`), updated directory by directory when the source change
+    instead of walking the packages again.
+
+    The owner of a target is the last package (in `packages` order) that
+    has it, the one that win on init. Every method take the lock, queries
+    come from the server threads while the watcher refresh it.
+    """
+
+    def __init__(self, root: Path, packages: List[Path]) -> None:
+        self.root = str(root) + os.sep
+        self.packages: List[Path] = []
+        self.order: Dict[str, int] = {}
+        self.ignores: Dict[str, IgnoreMatcher] = {}
+        # source directory -> (package, rel, files, sub directories)
+        self.dirs: Dict[str, Tuple[str, str, List[str], List[str]]] = {}
+        # target -> {package: source}
+        self.targets: Dict[str, Dict[str, str]] = {}
+        self.lock = threading.Lock()
+        self.set_packages(packages)
+
+    def set_packages(self, packages: List[Path]) -> None:
+        """
+        Index new packages, forget the ones that are not there any more.
+        """
+        with self.lock:
+            names = {pkg.name for pkg in packages}
+            for pkg in self.packages:
+                if pkg.name not in names:
+                    self._drop(str(pkg))
+                    del self.ignores[pkg.name]
+            old = set(self.order)
+            self.packages = list(packages)
+            self.order = {pkg.name: i for i, pkg in enumerate(packages)}
+            for pkg in packages:
+                if pkg.name not in old:
+                    self.ignores[pkg.name] = package_ignore(pkg)
+                    self._scan(str(pkg), pkg.name, "")
+
+    def refresh(self, changed: Iterable[str]) -> int:
+        """
+        List the changed source directories again, return number of
+        directories listed.
+
+        Only new sub directories are walked, removed ones are dropped with
+        everything under them. A package whose ignore patterns changed is
+        indexed again as a whole.
+        """
+        count = 0
+        with self.lock:
+            changed = set(changed)
+            for pkg in self.packages:
+                path = str(pkg)
+                if path not in changed and str(pkg.parent) not in changed:
+                    continue
+                ignore = package_ignore(pkg)
+                if ignore.patterns != self.ignores[pkg.name].patterns:
+                    self.ignores[pkg.name] = ignore
+                    self._drop(path)
+                    count += self._scan(path, pkg.name, "")
+            for path in sorted(changed):
+                count += self._refresh_dir(path)
+        return count
+
+    def owner(self, target: str) -> Tuple[str, str] | None:
+        """
+        Return (package, source) of the target, None if not managed.
+        """
+        with self.lock:
+            wanted = self.targets.get(target)
+            if not wanted:
+                return None
+            package = max(wanted, key=self.order.__getitem__)
+            return package, wanted[package]
+
+    def links(self, package: str) -> List[Tuple[str, str]]:
+        """
+        Return (target, source) of every file of the package.
+        """
+        with self.lock:
+            return [
+                (target, wanted[package])
+                for target, wanted in self.targets.items()
+                if package in wanted
+            ]
+
+    def _list(self, path: str, package: str, rel: str) -> Tuple[List[str], List[str]]:
+        dirs, files = scan_dir(path)
+        ignore = self.ignores[package]
+        prefix = rel + "/" if rel else ""
+        return (
+            [f.name for f in files if not ignore.match(prefix + f.name, f.name, False)],
+            [d.name for d in dirs if not ignore.match(prefix + d.name, d.name, True)],
+        )
+
+    def _scan(self, top: str, package: str, rel: str) -> int:
+        count = 0
+        stack = [(top, rel)]
+        while stack:
+            path, rel = stack.pop()
+            try:
+                files, dirs = self._list(path, package, rel)
+            except OSError:
+                continue
+            count += 1
+            self.dirs[path] = (package, rel, files, dirs)
+            prefix = rel + "/" if rel else ""
+            for name in files:
+                self._add(self.root + prefix + name, package, path + os.sep + name)
+            stack.extend((path + os.sep + name, prefix + name) for name in dirs)
+        return count
+
+    def _drop(self, top: str) -> None:
+        stack = [top]
+        while stack:
+            path = stack.pop()
+            if (item := self.dirs.pop(path, None)) is None:
+                continue
+            package, rel, files, dirs = item
+            prefix = rel + "/" if rel else ""
+            for name in files:
+                self._remove(self.root + prefix + name, package)
+            stack.extend(path + os.sep + name for name in dirs)
+
+    def _refresh_dir(self, path: str) -> int:
+        if (item := self.dirs.get(path)) is None:
+            # not indexed: ignored, or inside a new directory (walked whole)
+            return 0
+        package, rel, files, dirs = item
+        try:
+            new_files, new_dirs = self._list(path, package, rel)
+        except OSError:
+            self._drop(path)
+            return 0
+
+        prefix = rel + "/" if rel else ""
+        for name in set(files) - set(new_files):
+            self._remove(self.root + prefix + name, package)
+        for name in set(new_files) - set(files):
+            self._add(self.root + prefix + name, package, path + os.sep + name)
+        for name in set(dirs) - set(new_dirs):
+            self._drop(path + os.sep + name)
+        self.dirs[path] = (package, rel, new_files, new_dirs)
+        count = 1
+        for name in set(new_dirs) - set(dirs):
+            count += self._scan(path + os.sep + name, package, prefix + name)
+        return count
+
+    def _add(self, target: str, package: str, source: str) -> None:
+        self.targets.setdefault(target, {})[package] = source
+
+    def _remove(self, target: str, package: str) -> None:
+        wanted = self.targets.get(target)
+        if wanted is not None:
+            wanted.pop(package, None)
+            if not wanted:
+                del self.targets[target]
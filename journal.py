@@ -0,0 +1,243 @@
+from pathlib import Path
+import os
+import time
+import threading
+from typing import Dict, List, Set
+
+try:
+    import fcntl
+except ImportError:  # not on unix
+    fcntl = None
+
+from planner import Action, ActionType, SkippedError, apply_action
+import copier
+
+
+# ============================================================= #
+# ============================================================= #
+
+
+class Journal:
+    """
+    Append-only log of the actions of a run, so a run that was interrupted
+    (crash, power loss, ctrl-c between unlink and link...) can be finished
+    on the next run.
+
+    Every record is one JSON line:
+      - `{"txn": id, "begin": time}`
+      - `{"txn": id, "seq": n, "kind": .., "target": .., "source": ..,
+          "package": .., "is_dir": ..}` intent of every action, before anything is changed
+      - `{"txn": id, "done": [n, ...]}` actions finished, after every batch
+
+    All intents are written with a single `fsync` before the first action,
+    done records are only flushed (losing them only cost some extra work on
+    replay). A finished transaction truncate the file, so a non-empty
+    journal always mean an unfinished one.
+    """
+
+    def __init__(self, file: Path) -> None:
+        self.file = file
+        self.fd: int | None = None
+        self.txn = ""
+        self.lock = threading.Lock()
+
+    def begin(self, actions: List[Action]) -> None:
+        import json
+
+        self.recover()
+        self._open()
+        self.txn = f"{os.getpid()}-{time.time_ns()}"
+        lines = [json.dumps({"txn": self.txn, "begin": time.time()})]
+        for seq, action in enumerate(actions):
+            lines.append(
+                json.dumps(
+                    {
+                        "txn": self.txn,
+                        "seq": seq,
+                        "kind": action.kind.value,
+                        "target": action.target,
+                        "source": action.source,
+                        "package": action.package,
+                        "is_dir": action.is_dir,
+                    }
+                )
+            )
+        self._write(lines)
+        os.fsync(self.fd)
+
+    def done(self, seqs: List[int]) -> None:
+        import json
+
+        if self.fd is not None and seqs:
+            self._write([json.dumps({"txn": self.txn, "done": seqs})])
+
+    def commit(self) -> None:
+        if self.fd is None:
+            return
+        os.ftruncate(self.fd, 0)
+        self._close()
+
+    def pending(self) -> List[Action]:
+        """
+        Return the actions of unfinished transactions that are not done yet,
+        in the order they was planned.
+        """
+        try:
+            with open(self.file, "r") as file:
+                lines = file.readlines()
+        except FileNotFoundError:
+            return []
+        import json
+
+        actions: Dict[str, Dict[int, Action]] = {}
+        done: Set[tuple] = set()
+        for line in lines:
+            try:
+                record = json.loads(line)
+            except json.JSONDecodeError:
+                # torn write at the end, the action after it never started
+                break
+            txn = record["txn"]
+            if "seq" in record:
+                actions.setdefault(txn, {})[record["seq"]] = Action(
+                    ActionType(record["kind"]),
+                    record["target"],
+                    record["source"],
+                    record.get("package", ""),
+                    record["is_dir"],
+                )
+            elif "done" in record:
+                done.update((txn, seq) for seq in record["done"])
+
+        return [
+            action
+            for txn, items in actions.items()
+            for seq, action in sorted(items.items())
+            if (txn, seq) not in done
+        ]
+
+    def recover(self) -> int:
+        """
+        Finish the unfinished transaction (if any) left by an interrupted
+        run, return number of actions replayed.
+
+        Every action is replayed in a way that is safe to run twice, since
+        an action may have happened even when it's not recorded as done.
+        """
+        if not self.file.exists() or self.file.stat().st_size == 0:
+            return 0
+        self._open()
+        try:
+            actions = self.pending()
+            if actions:
+                print(
+                    f"-- [journal] finishing {len(actions)} actions of an interrupted run"
+                )
+            for action, err in replay(actions):
+                print(f"-- [journal] [failed] -- {action} with error: {err}")
+            os.ftruncate(self.fd, 0)
+        finally:
+            self._close()
+        return len(actions)
+
+    def _open(self) -> None:
+        if self.fd is not None:
+            return
+        self.file.parent.mkdir(parents=True, exist_ok=True)
+        self.fd = os.open(self.file, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+        if fcntl is not None:
+            # one run at a time, the other wait until this one is finished
+            fcntl.flock(self.fd, fcntl.LOCK_EX)
+
+    def _close(self) -> None:
+        if self.fd is not None:
+            os.close(self.fd)
+            self.fd = None
+
+    def _write(self, lines: List[str]) -> None:
+        data = ("\n".join(lines) + "\n").encode()
+        with self.lock:
+            os.write(self.fd, data)
+
+
+def replay(actions: List[Action]) -> List[tuple]:
+    """
+    Apply the actions again, skip what is already on system.
+
+    A target that already link to where the last action of it should link
+    is finished, all of its actions are skipped. Return the actions failed.
+    """
+    finished: Set[str] = set()
+    # seq of the last link of every target
+    last_link: Dict[str, int] = {}
+    for seq, action in enumerate(actions):
+        if action.kind == ActionType.LINK:
+            last_link[action.target] = seq
+    for target, seq in last_link.items():
+        try:
+            if os.readlink(target) == actions[seq].source:
+                finished.add(target)
+        except OSError:
+            pass
+
+    failed: List[tuple] = []
+    for seq, action in enumerate(actions):
+        if action.target in finished:
+            continue
+        try:
+            replay_action(action, last_link.get(action.target, -1) > seq)
+        except Exception as e:  # noqa: BLE001
+            failed.append((action, e))
+    return failed
+
+
+def linked_to(target: str, source: str) -> bool:
+    try:
+        return os.readlink(target) == source
+    except OSError:
+        return False
+
+
+def replay_action(action: Action, replaced: bool) -> None:
+    """
+    :param replaced: `True` if a link to the target come after this action
+    """
+    target = action.target
+    is_link = os.path.islink(target)
+    exists = is_link or os.path.exists(target)
+    match action.kind:
+        case ActionType.LINK:
+            if not exists:
+                apply_action(action)
+        case ActionType.UNLINK:
+            # a real file is only removed when a link will replace it,
+            # it could be the file restored by `--copy-back`
+            if is_link or (replaced and os.path.isfile(target)):
+                apply_action(action)
+        case ActionType.ADOPT_COPY:
+            # once the target link to the package file, the copy was
+            # finished (a foreign link is copied through)
+            if exists and not linked_to(target, action.source):
+                apply_action(action)
+        case ActionType.BACKUP:
+            # only while what it protect is not changed yet: the file to
+            # unlink is still there, or the system file to adopt is
+            if exists and (
+                action.source == target or not linked_to(target, action.source)
+            ):
+                apply_action(action)
+        case ActionType.RESTORE_COPY:
+            if not is_link:
+                if action.is_dir:
+                    copier.copytree(Path(action.source), Path(target), exist_ok=True)
+                else:
+                    apply_action(action)
+        case ActionType.RMDIR:
+            try:
+                apply_action(action)
+            except SkippedError:
+                # not empty, left as it is
+                pass
+        case _:
+            # mkdir (exist ok)
+            apply_action(action)
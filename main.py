@@ -0,0 +1,20 @@
+#!/usr/bin/env -S python3 -S
+# Plain python entry point, same as running `me-stow.py` but without `uv`:
+# `-S` skip `site` (nothing outside the stdlib is used), and `me-stow.py` is
+# loaded from its cached bytecode (`__pycache__`) instead of compiled again
+# on every run, like a module.
+import os
+import sys
+from importlib.machinery import SourceFileLoader
+
+here = os.path.dirname(os.path.realpath(__file__))
+if sys.path[0] != here:
+    sys.path.insert(0, here)
+
+# workers of a process pool (`--diff`) import this file again
+if __name__ == "__main__":
+    path = os.path.join(here, "me-stow.py")
+    module = type(sys)("me_stow")
+    module.__file__ = path
+    SourceFileLoader("me_stow", path).exec_module(module)
+    module.entry()
@@ -0,0 +1,219 @@
+from pathlib import Path
+import os
+from typing import Dict, List
+from fsops import DirCursor, readlink
+
+
+# ============================================================= #
+# ============================================================= #
+
+
+class LinkType:
+    FILE = "file"
+    DIR = "dir"
+
+
+class ManifestEntry:
+    __slots__ = ("ino", "link_type", "mtime", "source", "target")
+
+    def __init__(
+        self, source: str, target: str, link_type: str, ino: int, mtime: int
+    ) -> None:
+        self.source = source
+        self.target = target
+        self.link_type = link_type
+        self.ino = ino
+        self.mtime = mtime
+
+
+class DirSnapshot:
+    """
+    State of one package directory (and its destination) after last init.
+    """
+
+    __slots__ = ("dest", "dest_mtime", "dirs", "files", "src_mtime")
+
+    def __init__(
+        self,
+        dest: str,
+        src_mtime: int,
+        dest_mtime: int,
+        dirs: List[str],
+        files: List[str],
+    ) -> None:
+        self.dest = dest
+        self.src_mtime = src_mtime
+        self.dest_mtime = dest_mtime
+        self.dirs = dirs
+        self.files = files
+
+
+def as_dict(item: ManifestEntry | DirSnapshot) -> Dict:
+    return {name: getattr(item, name) for name in item.__slots__}
+
+
+class Manifest:
+    """
+    On-disk record of every link made for one package.
+
+    Stored as `<manifest_dir>/<package-name>.json`, so remove/re-init can
+    work from this index instead of walking both source and system tree.
+    """
+
+    VERSION = 1
+
+    def __init__(self, manifest_dir: Path, package: Path) -> None:
+        self.file = manifest_dir / f"{package.name}.json"
+        self.package = package
+        self.entries: Dict[str, ManifestEntry] = {}
+        self.dirs: List[str] = []
+        self.tree: Dict[str, DirSnapshot] = {}
+        # ignore patterns the package was walked with
+        self.ignore: List[str] = []
+        self.loaded = False
+        self._dirs_seen = set()
+
+    @classmethod
+    def load(cls, manifest_dir: Path, package: Path) -> "Manifest":
+        """
+        Load manifest of the package, return an empty one if not exist (or
+        the manifest was written for a different package path).
+        """
+        import json
+
+        manifest = cls(manifest_dir, package)
+        try:
+            with open(manifest.file, "r") as file:
+                data = json.load(file)
+        except (FileNotFoundError, json.JSONDecodeError):
+            return manifest
+
+        if data.get("version") != cls.VERSION or data.get("package") != str(package):
+            return manifest
+
+        for item in data["entries"]:
+            entry = ManifestEntry(**item)
+            manifest.entries[entry.target] = entry
+        manifest.dirs = data["dirs"]
+        for src, item in data.get("tree", {}).items():
+            manifest.tree[src] = DirSnapshot(**item)
+        manifest.ignore = data.get("ignore", [])
+        manifest._dirs_seen = set(manifest.dirs)
+        manifest.loaded = True
+        return manifest
+
+    def save(self) -> None:
+        """
+        Write manifest to disk (atomic replace), delete it if nothing left.
+
+        Stat that was left out while planning (file not exist yet) is
+        filled in here, after the plan was executed.
+        """
+        if not self.entries:
+            self.delete()
+            return
+
+        for entry in self.entries.values():
+            if entry.ino == 0:
+                try:
+                    st = os.stat(entry.source)
+                except OSError:
+                    continue
+                entry.ino, entry.mtime = st.st_ino, st.st_mtime_ns
+        for snap in self.tree.values():
+            if snap.dest_mtime == 0:
+                try:
+                    snap.dest_mtime = os.stat(snap.dest).st_mtime_ns
+                except OSError:
+                    pass
+
+        data = {
+            "version": self.VERSION,
+            "package": str(self.package),
+            "entries": [as_dict(e) for e in self.entries.values()],
+            "dirs": self.dirs,
+            "tree": {src: as_dict(snap) for src, snap in self.tree.items()},
+            "ignore": self.ignore,
+        }
+        import json
+
+        self.file.parent.mkdir(parents=True, exist_ok=True)
+        tmp = self.file.with_suffix(".tmp")
+        with open(tmp, "w") as file:
+            json.dump(data, file)
+        os.replace(tmp, self.file)
+
+    def delete(self) -> None:
+        try:
+            self.file.unlink()
+        except FileNotFoundError:
+            pass
+
+    def add_link(
+        self,
+        source: Path,
+        target: Path,
+        link_type: str,
+        st: os.stat_result | None = None,
+    ) -> None:
+        """
+        Record a link, `st` of the source can be omit, it's filled on `save`.
+        """
+        self.entries[str(target)] = ManifestEntry(
+            source=str(source),
+            target=str(target),
+            link_type=link_type,
+            ino=st.st_ino if st else 0,
+            mtime=st.st_mtime_ns if st else 0,
+        )
+
+    def add_dir(self, target: Path) -> None:
+        if (key := str(target)) not in self._dirs_seen:
+            self._dirs_seen.add(key)
+            self.dirs.append(key)
+
+    def add_snapshot(
+        self,
+        source: Path,
+        src_mtime: int,
+        dest: Path,
+        dirs: List[str],
+        files: List[str],
+    ) -> None:
+        """
+        Record the directory, so next incremental init can skip it when
+        nothing changed on both side.
+
+        The destination mtime is taken on `save`, after all the changes.
+        """
+        self.tree[str(source)] = DirSnapshot(str(dest), src_mtime, 0, dirs, files)
+
+    def unchanged_snapshot(
+        self, source: Path, src_mtime: int, dest: Path
+    ) -> DirSnapshot | None:
+        """
+        Return snapshot of the directory if both source and destination
+        directory was not modified since it was recorded.
+
+        Any entry added/removed/renamed inside a directory bump its mtime,
+        so an unchanged pair mean every entry recorded is still there.
+        """
+        snap = self.tree.get(str(source))
+        if snap is None or snap.src_mtime != src_mtime or snap.dest != str(dest):
+            return None
+        try:
+            if os.stat(dest).st_mtime_ns != snap.dest_mtime:
+                return None
+        except OSError:
+            return None
+        return snap
+
+
+def read_link(path: str, cursor: DirCursor | None = None) -> str | None:
+    """
+    Return the link value, or None if path is missing or not a symlink.
+    """
+    try:
+        return readlink(path, cursor)
+    except OSError:
+        return None
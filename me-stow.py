@@ -1,9 +1,13 @@
 #!/usr/bin/env -S uv run --script
-from pathlib import Path
-from typing import List
-import shutil as su
+from __future__ import annotations
 import sys
-from classes import Operation, Params, ResolveType, Arguments
+from classes import Operation, Params, ResolveType, Arguments, flag_value, wants_help
+
+# for type checkers only, nothing more than `classes` is imported to print
+# the help, operations are imported once the arguments ask for one
+TYPE_CHECKING = False
+if TYPE_CHECKING:
+    from typing import Callable
 
 
 # ============================================================= #
@@ -27,30 +31,97 @@ def print_help(exit=False, exit_code=0) -> None:
     repla = ResolveType.REPLACE.value
     ado = ResolveType.ADOPT.value
     copy_b = Arguments.COPY_BACK
+    incr = Arguments.INCREMENTAL
+    fol = Arguments.FOLD
+    job = Arguments.JOBS
+    dry = Arguments.DRY_RUN
+    metr = Arguments.METRICS
+    prof = Arguments.PROFILE
+    form = Arguments.FORMAT
     verbo = Arguments.VERBOSE
     he = Arguments.HELP
     li = Arguments.LIST
+    sta = Arguments.STATUS
+    wat = Arguments.WATCH
+    ser = Arguments.SERVE
+    pru = Arguments.PRUNE
+    dif = Arguments.DIFF
+    rest = Arguments.RESTORE_BACKUP
+    sour = Arguments.SOURCE
+    roo = Arguments.ROOT
+    roos = Arguments.ROOTS
+    ye = Arguments.YES
+    non = Arguments.NON_INTERACTIVE
     print(f"""
 ------------------------------------------------------------
 Usage:
   me-stow [operation] [options] <packages>
     <packages>      Can pass in one or multiple packages. If non specify
                     | this script will process all the packages that in source dir.
-    
+
     [operation]     NOTE: only one op or omit
     --{i_}          Run this when you want to put stowed file to system.
                     | Make symlink to the file that in source folder.
                     | This is similar to `gnu stow`.
+                    | Entries matched by `.stow-ignore` of the package (or
+                    | of the source directory, for every package) are not
+                    | linked, ignored directories are not even walked
+                    | (syntax: see `--stow`).
     --{st}          Run this when you want to stow file on system to source.
                     | Add new file that currently in system into package.
                     | Make new one if package is not currently exist.
+                    | A directory is walked (and stowed) by batches, entries
+                    | matched by its `.stow-ignore` are skipped, one pattern
+                    | per line: `*.log` (name), `cache/*.tmp` (path),
+                    | `build/` (directory only), `re:<regex>` (path).
     --{remo}        Use this when you want to remove link file in system.
                     | Delete the symlink file on the system (not on source).
                     | can be use with `--copy-back` flag to replace symlink
                     | file with actual file (copy file from source to the
                     | deleted file direction).
     --{li}          List all the package currently on source directions.
-                    
+                    | `=full` also print the tree of every package,
+                    | `=conflicts` print the targets that more than one
+                    | package want (the last package win on `init`).
+
+    --{sta}        Check every link of the packages on system, report
+                    | entries that are missing, broken, pointing elsewhere
+                    | or a real file (conflict). Exit with code 1 if any.
+                    | Use `-v` to also print the healthy links.
+
+    --{dif}[=unified]
+                    | Compare the real files on system that are in the way
+                    | of the links (what `--resolve=adopt` would take) with
+                    | the package files. Exit with code 1 if any differ.
+                    | Use `=unified` to also print the diff of text files,
+                    | `-v` to also print the same ones. Hash with all the
+                    | cpu, unless `--jobs=N` is given.
+
+    --{pru}         Unlink dangling links into the packages (file deleted
+                    | or renamed on source, or whole package deleted).
+                    | Only the directories that packages map to are listed,
+                    | not the whole root, links elsewhere are never touched.
+                    | Directories left empty by the unlinks are removed.
+
+    --{rest}
+                    | Put back the files that `init` and `stow` removed or
+                    | overwrote (last backup of every path of the packages).
+                    | Every system file replaced (`--resolve=replace`,
+                    | `--force`) and package file overwritten (adopt, stow)
+                    | is saved to `backups/` first, same content only once.
+
+    --{wat}[=poll]  Init the packages, then keep watching the source and
+                    | apply every change (file added, removed, renamed) as it
+                    | happen, until ctrl-c. Use inotify (linux), or check the
+                    | directories every second with `=poll` (or when inotify
+                    | is not available). Work with `--fold`, `--jobs`...
+
+    --{ser}[=poll]  Keep the targets of the packages in memory and answer
+                    | "is this path managed, by which package?" (and status,
+                    | list) on a Unix socket until ctrl-c, see `client.py`.
+                    | Changed source directories are listed again as they
+                    | change, nothing on system is changed.
+
     -h | --{he}     Print this help message.
 
     [options]
@@ -65,13 +136,75 @@ Usage:
         {ado}       - (default) Copy current file on system to source folder and
                     | override file on source (this is like `--adopt` on stow),
                     | then user can use git to compare (or restore) them.
+                    | File with the same content is not copied.
 
     --{copy_b}      Use with `remove` operation, this will copy file on source to
                     | the link files on the system. Like replace symlink file
                     | with actual file.
 
+    --{incr}   Use with `init` operation, skip directories that both source
+                    | and system side are not modified since the last init.
+                    | Useful when running `init` on every shell start.
+
+    --{fol}          Use with `init` operation, link the whole directory instead
+                    | of every file inside it when it not exist on system
+                    | (like tree folding of `gnu stow`). Folded directory is
+                    | unfold automatically when other package need to use it.
+
+    --{job}=N        Use with `init` and `remove` operation, process packages
+                    | (and independent sub directories) with N workers.
+                    | Omit N to use all the cpu. When packages use the same
+                    | file, they are still processed in the package order.
+
+    --{dry}       Use with `init`, `remove`, `stow`, `prune` and
+                    | `restore-backup`, only print the actions (mkdir, link,
+                    | unlink, copy, backup) and conflicts
+                    | that would happen, nothing on system is changed.
+
+    --{metr}[=json]
+                    | Print time spent in every phase (config, args,
+                    | discovery, walk, link, copy) and counters (files
+                    | visited, links created, bytes copied, conflicts),
+                    | as text or as one JSON line.
+
+    --{form}=ndjson
+                    | Use with `init`, `remove`, `stow` and `--list`, write one
+                    | JSON record per line on stdout as things happen (action
+                    | applied, entry listed, collision, package result) and a
+                    | last `summary` one, human messages go to stderr.
+
+    --{prof}[=FILE]
+                    | Run with cProfile, print the most expensive functions
+                    | and save the stats to FILE (if given).
+
     -v | --{verbo}  Vebose output
-    
+                    | also print every file copy and how it was copied
+                    | (reflink, copy_file_range, sendfile or buffered).
+
+    --{sour}=DIR    Source directory of this run, override the config.
+    --{roo}=DIR      Root (system) directory of this run, override the config.
+    --{roos}=NAME,...
+                    | Use with `init`, `remove`, `--status` and `--watch`,
+                    | only these roots of the config (`default` is
+                    | `root_path`), all of them by default.
+
+    --{ye}           Answer yes, needed by `--remove` without package when
+                    | not interactive.
+
+    --{non}
+                    | Never prompt (scripts, cron, CI): a missing config is
+                    | not saved, source must be given (flag or environment),
+                    | root default to home.
+
+Environment:
+    ME_STOW_SOURCE, ME_STOW_ROOT
+                    Same as `--{sour}` and `--{roo}` (the flags win).
+    ME_STOW_RESOLVE Same as `--{resol}`.
+    ME_STOW_NONINTERACTIVE=1
+                    Same as `--{non}`.
+    ME_STOW_SOCKET  Socket of `--{ser}` (default: `me-stow.sock` next
+                    | to the script).
+
 Examples:
     CMD = python3 `me-stow.py`
           or just `me-stow` if you put a link in PATH point to `me-stow.py`
@@ -81,6 +214,14 @@ Examples:
     CMD --init <or-you-can-put-pakages-name-here>
     # or you can omit the `--init` flag
     CMD <omit or you can put pakages name here>
+    # only process what changed since the last init
+    CMD --init --incremental
+    # link directory as a whole if possible
+    CMD --init --fold
+    # init all packages with 8 workers
+    CMD --init --jobs=8
+    # see what init would do, without changing anything
+    CMD --init --dry-run
 
     # this will replace current file on your system if confict happen
     CMD <pakages-name> --resolve=replace
@@ -91,12 +232,41 @@ Examples:
     CMD --stow <package-name> <path-to-files>
     # or you can omit the `--stow` flag
     CMD <package-name> <path-to-files>
+    # stow a whole directory, skipping what its `.stow-ignore` match
+    CMD --stow <package-name> <path-to-directory>
+
+    # keep all packages in sync while editing the source
+    CMD --watch
+
+    # answer queries of the shell prompt / editor
+    CMD --serve
+    python3 -S client.py owner ~/.bashrc
+
+    # check that all packages are still linked (exit code 1 if not)
+    CMD --status
+
+    # what would adopt take from the system, and how it differ
+    CMD --diff=unified
+
+    # clean up links left by files deleted/renamed on source
+    CMD --prune
+    CMD --prune --dry-run
+
+    # bring back the files that `--force` replaced
+    CMD --restore-backup <packages-name>
 
     # remove package
     CMD --remove <packages-name>
     CMD --remove --copyback <packages-name>
     CMD --remove # omit package will remove all the packages
 
+    # from a script, without config or prompt
+    ME_STOW_NONINTERACTIVE=1 ME_STOW_SOURCE=~/dotfiles CMD --status
+    CMD --non-interactive --source=~/dotfiles --remove --yes
+
+    # one JSON record per line, for a CI job or another tool
+    CMD --init --format=ndjson | jq -c 'select(.outcome == "failed")'
+
 """)
 
     if exit:
@@ -112,16 +282,38 @@ def err_print_help_exit(msg: str | None) -> None:
     print_help(exit=True, exit_code=1)
 
 
-# ============================================================= #
-# GLOBAL ====================================================== #
-
-CONFIG_FILE = Path(__file__).resolve().parent / "config.json"
-
-# ============================================================= #
-# ============================================================= #
-
-
 def main():
+    if wants_help():
+        print_help(exit=True)
+
+    from operations import (
+        BACKUPS,
+        CONFIG_FILE,
+        DIGESTS,
+        JOURNAL,
+        count_success,
+        diff_packages,
+        init_packages,
+        process_stow_package,
+        prune_packages,
+        recorded_packages,
+        remove_packages,
+        restore_backups,
+        run_roots,
+        serve_packages,
+        status_packages,
+        watch_packages,
+    )
+    from metrics import METRICS
+    from output import RECORDS
+    import copier
+    import planner
+
+    if (flag_value(Arguments.FORMAT) or "").lower() == "ndjson":
+        # records alone on stdout, what is for humans goes to stderr
+        RECORDS.open(sys.stdout.buffer)
+        sys.stdout = sys.stderr
+        planner.on_action = RECORDS.action
     print("Running 'me-stow'...")
     try:
         params = Params(CONFIG_FILE)
@@ -130,6 +322,24 @@ def main():
     except FileNotFoundError as p:
         err_print_help_exit(f"path not exist: '{p}'")
 
+    if params.verbose:
+        copier.on_copy = lambda src, dst, strategy: print(
+            f"-- [copy] '{src}' -> '{dst}' ({strategy.value})"
+        )
+    # every file removed or overwritten is saved first
+    planner.backup_store = BACKUPS
+
+    if params.op in (
+        Operation.INIT,
+        Operation.REMOVE,
+        Operation.STOW,
+        Operation.WATCH,
+        Operation.PRUNE,
+        Operation.RESTORE_BACKUP,
+    ) and not (params.dry_run):
+        # a run that was interrupted is finished before planning a new one
+        JOURNAL.recover()
+
     success = 0
     total = len(params.packages)
     match params.op:
@@ -137,141 +347,143 @@ def main():
             print_help(exit=True)
 
         case Operation.INIT:
+            packages = []
             for pkg_dir in params.packages:
                 if not pkg_dir.exists():
                     print(f"[skipped] -- package not exist: '{pkg_dir.name}'")
                     continue
-                process_init_package(params.root, pkg_dir, params.resolve)
-                # TODO: check for failure
-                success += 1
+                packages.append(pkg_dir)
+
+            results = run_roots(
+                params,
+                packages,
+                lambda root, pkgs, manifest_dir, scans: init_packages(
+                    root,
+                    pkgs,
+                    params.resolve,
+                    params.incremental,
+                    params.fold,
+                    params.jobs,
+                    params.dry_run,
+                    manifest_dir,
+                    scans,
+                ),
+            )
+            total = len(results)
+            success = count_success(results, "init")
 
         case Operation.REMOVE:
-            for pkg_dir in params.packages:
-                remove_stow_package(params.root, pkg_dir, params.copy_back)
-                # TODO: check for failure
-                print(f"[ok] -- '{pkg_dir.name}' removed")
-                success += 1
+            results = run_roots(
+                params,
+                params.packages,
+                lambda root, pkgs, manifest_dir, scans: remove_packages(
+                    root,
+                    pkgs,
+                    params.copy_back,
+                    params.jobs,
+                    params.dry_run,
+                    manifest_dir,
+                    scans,
+                ),
+            )
+            total = len(results)
+            success = count_success(results, "removed")
+
+        case Operation.WATCH:
+            success = watch_packages(params)
+
+        case Operation.SERVE:
+            success = serve_packages(params)
+
+        case Operation.STATUS:
+            results = run_roots(
+                params,
+                params.packages,
+                lambda root, pkgs, manifest_dir, scans: status_packages(
+                    root, pkgs, params.verbose, manifest_dir, scans
+                ),
+            )
+            total = len(results)
+            success = count_success(results, "healthy")
+
+        case Operation.DIFF:
+            results = run_roots(
+                params,
+                params.packages,
+                lambda root, pkgs, manifest_dir, scans: diff_packages(
+                    root,
+                    pkgs,
+                    params.diff_unified,
+                    params.verbose,
+                    params.jobs,
+                    manifest_dir,
+                    scans,
+                ),
+            )
+            total = len(results)
+            success = count_success(results, "same as system")
+
+        case Operation.PRUNE:
+            packages = list(params.packages)
+            if params.get_all:
+                # package deleted from source, but its links are still there
+                packages += [
+                    p for p in recorded_packages(params.source_dir) if p not in packages
+                ]
+            total = len(packages)
+            results = prune_packages(
+                params.root, params.source_dir, packages, params.dry_run
+            )
+            success = count_success(results, "pruned")
+
+        case Operation.RESTORE_BACKUP:
+            packages = list(params.packages)
+            if params.get_all:
+                # backups of deleted packages too
+                recorded = {r["package"] for r in BACKUPS.records() if r["package"]}
+                packages += [
+                    params.source_dir / name
+                    for name in sorted(recorded - {p.name for p in packages})
+                ]
+            total = len(packages)
+            results = restore_backups(params.source_dir, packages, params.dry_run)
+            success = count_success(results, "restored")
 
         case Operation.STOW:
-            total = len(params.stowers)
-            success = process_stow_package(
-                params.get_package_to_stow(), params.stowers, params.root
-            )
+            try:
+                success, total = process_stow_package(
+                    params.get_package_to_stow(),
+                    params.stowers,
+                    params.stow_dirs,
+                    params.root,
+                    params.dry_run,
+                )
+            except ValueError as e:
+                # file to stow is not under root
+                err_print_help_exit(e)
 
     if params.save_config:
         params.save_configuration(CONFIG_FILE)
+    DIGESTS.save()
+    BACKUPS.close()
 
     print_result(params, total, success)
+    if RECORDS.enabled:
+        RECORDS.summary(params.op.value, total, success)
     print("...DONE")
 
+    if params.metrics == "json":
+        print(METRICS.to_json())
+    elif params.metrics:
+        for line in METRICS.summary():
+            print(line)
 
-# ============================================================ #
-# ============================================================ #
+    if params.op in (Operation.STATUS, Operation.DIFF) and success < total:
+        sys.exit(1)
 
 
-def process_init_package(dest_dir: Path, package: Path, res_type: ResolveType) -> None:
-    """
-    Create a symlink from package (and all it's content) to destination directory.
-
-    :NOTE: can run recursively
-    """
-    link_files: List[Path] = []
-    for entry in package.iterdir():
-        if entry.is_file():
-            link_files.append(entry)
-
-        elif entry.is_dir():
-            new_dest = dest_dir / entry.name
-            if new_dest.is_symlink():
-                # This also make sure the new_dest exist and is a symlink
-                match res_type:
-                    case ResolveType.REPLACE:
-                        new_dest.unlink()
-                    case ResolveType.ADOPT:
-                        try:
-                            new_dest = new_dest.resolve(strict=True)
-                        except FileNotFoundError:  # Broken link
-                            new_dest.unlink()
-                    case _:
-                        raise ValueError("Unhandle type: this should not happend!")
-
-            new_dest.mkdir(exist_ok=True)
-            # recursive call
-            process_init_package(new_dest, entry, res_type)
-
-    for file in link_files:
-        dest_file = dest_dir / file.name
-        try:
-            # THIS ONLY PASS WHEN CONFLICTS HAPPEN
-            if res_type == ResolveType.ADOPT:
-                # Override source file with file current in system
-                su.copyfile(dest_file, file)
-            dest_file.unlink()
-        except FileNotFoundError:
-            pass
-        except su.SameFileError:
-            # File already linked and good
-            continue
-
-        dest_file.symlink_to(file)
-
-
-def remove_stow_package(dest_dir: Path, package: Path, restore: bool) -> None:
-    """
-    Remove a stowed package.
-
-    NOTE: can run recursively
-
-    :param restore: `True` will copy file in source into system,
-                    this is like replace linked file with actual file
-    :type restore: bool
-    """
-    for entry in package.iterdir():
-        file_on_sys = dest_dir / entry.name
-
-        if entry.is_dir():
-            # recursive call
-            remove_stow_package(file_on_sys, entry, restore)
-
-        elif file_on_sys.samefile(entry):
-            file_on_sys.unlink()
-
-            if restore:
-                su.copy(entry, file_on_sys)
-
-    try:
-        dest_dir.rmdir()
-    except OSError:
-        # well, don't remove non empty folder
-        pass
-
-
-def process_stow_package(
-    pkg_dir: Path, file_to_stows: List[Path], root_dir: Path
-) -> int:
-    """
-    Stow all the file to the pakage direction.
-    """
-    success = 0
-
-    for file in file_to_stows:
-        try:
-            relative = file.relative_to(root_dir)
-        except ValueError as e:
-            err_print_help_exit(e)
-
-        try:
-            stowed_dir = pkg_dir / relative
-            stowed_dir.parent.mkdir(parents=True, exist_ok=True)
-            su.copyfile(file, stowed_dir)
-            file.unlink()
-            file.symlink_to(stowed_dir)
-        except Exception as e:
-            print(f"-- [failed] -- '{file}' with error: {e}")
-        else:
-            success += 1
-
-    return success
+# ============================================================ #
+# ============================================================ #
 
 
 def print_result(param: Params, total: int, success: int) -> None:
@@ -283,9 +495,50 @@ def print_result(param: Params, total: int, success: int) -> None:
             msg += f"items stowed -> package: '{param.get_package_to_stow().name}'"
         case Operation.REMOVE:
             msg += "packages removed"
+        case Operation.STATUS:
+            msg += "packages healthy"
+        case Operation.WATCH:
+            msg += "packages watched"
+        case Operation.SERVE:
+            msg += "packages served"
+        case Operation.PRUNE:
+            msg += "packages pruned"
+        case Operation.RESTORE_BACKUP:
+            msg += "packages restored"
+        case Operation.DIFF:
+            msg += "packages without drift"
 
     print(msg)
 
 
+def run_profiled(main: Callable[[], None]) -> None:
+    """
+    Run `main` under cProfile, print the most expensive functions and dump
+    the stats to `--profile=<file>` (if given) for `pstats`/snakeviz.
+    """
+    import cProfile
+    import pstats
+
+    file = next(
+        (arg.split("=", 1)[1] for arg in sys.argv if arg.startswith("--profile=")),
+        None,
+    )
+    profiler = cProfile.Profile()
+    try:
+        profiler.runcall(main)
+    finally:
+        if file:
+            profiler.dump_stats(file)
+            print(f"-- [profile] stats saved to: '{file}'")
+        pstats.Stats(profiler).sort_stats("cumulative").print_stats(25)
+
+
+def entry() -> None:
+    if any(arg.startswith(f"--{Arguments.PROFILE}") for arg in sys.argv[1:]):
+        run_profiled(main)
+    else:
+        main()
+
+
 if __name__ == "__main__":
-    main()
+    entry()
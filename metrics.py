@@ -0,0 +1,65 @@
+import time
+import threading
+from contextlib import contextmanager
+from typing import Dict, Iterator, List
+
+
+# ============================================================= #
+# ============================================================= #
+
+
+class Metrics:
+    """
+    Per phase timers and counters of one run.
+
+    Always collected (a few calls per directory, not per syscall), printed
+    with `--metrics` (human) or `--metrics=json`. Time of phases that run in
+    several threads (copy) is the sum over all threads.
+    """
+
+    def __init__(self) -> None:
+        self.start = time.perf_counter()
+        self.phases: Dict[str, float] = {}
+        self.counters: Dict[str, int] = {}
+        self.lock = threading.Lock()
+
+    @contextmanager
+    def phase(self, name: str) -> Iterator[None]:
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add_time(name, time.perf_counter() - start)
+
+    def add_time(self, name: str, seconds: float) -> None:
+        with self.lock:
+            self.phases[name] = self.phases.get(name, 0.0) + seconds
+
+    def count(self, name: str, n: int = 1) -> None:
+        with self.lock:
+            self.counters[name] = self.counters.get(name, 0) + n
+
+    def to_dict(self) -> Dict:
+        return {
+            "total": round(time.perf_counter() - self.start, 6),
+            "phases": {k: round(v, 6) for k, v in self.phases.items()},
+            "counters": dict(self.counters),
+        }
+
+    def to_json(self) -> str:
+        import json
+
+        return json.dumps(self.to_dict())
+
+    def summary(self) -> List[str]:
+        data = self.to_dict()
+        lines = [f"-- [metrics] total: {data['total'] * 1000:.1f} ms"]
+        for name, seconds in data["phases"].items():
+            lines.append(f"-- [metrics] {name:<16} {seconds * 1000:>10.1f} ms")
+        for name, n in data["counters"].items():
+            lines.append(f"-- [metrics] {name:<16} {n:>10}")
+        return lines
+
+
+# shared by every module of the run
+METRICS = Metrics()
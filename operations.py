@@ -0,0 +1,1421 @@
+from pathlib import Path
+from array import array
+from typing import TYPE_CHECKING, Callable, Dict, Iterator, List, Set, Tuple
+import os
+import sys
+import threading
+from classes import Params, ResolveType, EnvKey, DEFAULT_ROOT
+from manifest import DirSnapshot, LinkType, Manifest, read_link
+from planner import ActionType, Plan, TargetState, execute_plan
+from journal import Journal
+from fsops import DirCursor
+from index import TargetIndex
+from metrics import METRICS
+from ignore import IGNORE_FILE, IgnoreMatcher, load_ignore, package_ignore
+from walker import ScanCache, WalkEntry, scan_dir, walk
+from content import DigestCache, same_content
+from backup import BackupStore
+from output import RECORDS
+
+if TYPE_CHECKING:
+    from tree import PathTree
+
+# Everything the operations need, imported by `me-stow.py` only once the
+# arguments asked for one (`-h` never load it). Modules of a single
+# operation (status, drift, daemon, watcher) are imported by it.
+
+# ============================================================= #
+# GLOBAL ====================================================== #
+
+CONFIG_FILE = Path(__file__).resolve().parent / "config.json"
+MANIFEST_DIR = CONFIG_FILE.parent / "manifests"
+DIGESTS = DigestCache(CONFIG_FILE.parent / "digests.json")
+JOURNAL = Journal(CONFIG_FILE.parent / "journal.log")
+SOCKET_FILE = Path(os.environ.get(EnvKey.SOCKET) or CONFIG_FILE.parent / "me-stow.sock")
+BACKUPS = BackupStore(CONFIG_FILE.parent / "backups", DIGESTS)
+
+# ============================================================= #
+# ============================================================= #
+
+
+def count_success(results: Dict[str, Exception | None], done: str) -> int:
+    """
+    Print result of every package, return number of package succeeded.
+    """
+    success = 0
+    for name, err in results.items():
+        if RECORDS.enabled:
+            RECORDS.package(name, err)
+        if err is None:
+            print(f"[ok] -- '{name}' {done}")
+            success += 1
+        else:
+            print(f"[failed] -- '{name}' with error: {err}")
+    return success
+
+
+def run_plan(
+    plan: Plan,
+    results: Dict[str, Exception | None],
+    manifests: List[Manifest],
+    dry_run: bool,
+    jobs: int,
+) -> None:
+    """
+    Print the plan (dry run) or execute it, then save the manifest of the
+    packages that succeeded.
+
+    :param results: error of each package (from planning), updated with
+                    blocking conflicts and failed actions
+    """
+    for name, reason in plan.blocked().items():
+        results[name] = results.get(name) or FileExistsError(reason)
+
+    if dry_run:
+        show_plan(plan)
+        return
+
+    for action, err in execute_plan(plan, jobs, JOURNAL):
+        print(f"-- [failed] -- {action} with error: {err}")
+        results[action.package] = results.get(action.package) or err
+
+    for manifest in manifests:
+        if results.get(manifest.package.name) is None:
+            manifest.save()
+
+
+def show_plan(plan: Plan) -> None:
+    """
+    Print the plan of a dry run, or write it as records.
+    """
+    if RECORDS.enabled:
+        RECORDS.plan(plan)
+    else:
+        plan.print()
+
+
+def run_packages(
+    func: Callable[[Path], None], packages: List[Path], jobs: int
+) -> Dict[str, Exception | None]:
+    """
+    Run `func` for every package (in a thread pool when `jobs` > 1),
+    collect error of each package instead of stopping at the first one.
+    """
+
+    def run(pkg_dir: Path) -> Exception | None:
+        try:
+            func(pkg_dir)
+        except Exception as e:  # noqa: BLE001
+            return e
+        return None
+
+    if jobs <= 1:
+        return {pkg_dir.name: run(pkg_dir) for pkg_dir in packages}
+
+    from concurrent.futures import ThreadPoolExecutor
+
+    with ThreadPoolExecutor(max_workers=jobs) as pool:
+        return dict(zip((p.name for p in packages), pool.map(run, packages)))
+
+
+def manifest_dir_of(root_name: str) -> Path:
+    """
+    Manifests of `root_path` stay where they always were, the other roots
+    have their own directory (a package has one manifest per root).
+    """
+    if root_name == DEFAULT_ROOT:
+        return MANIFEST_DIR
+    return MANIFEST_DIR / "roots" / root_name
+
+
+def run_roots(
+    params: Params,
+    packages: List[Path],
+    func: Callable[
+        [Path, List[Path], Path, ScanCache | None], Dict[str, Exception | None]
+    ],
+) -> Dict[str, Exception | None]:
+    """
+    Run `func(root, packages, manifest_dir, scans)` for every root of the
+    run, return error (or None) of each package, as `package@root` for
+    the roots other than `root_path`.
+
+    With more than one root, the roots share one scan cache, so every
+    source directory is listed once per run, however many roots it's
+    deployed to. With one, nothing is listed twice, no listing is kept.
+    """
+    roots = params.root_packages(packages)
+    scans = ScanCache() if sum(1 for _, _, pkgs in roots if pkgs) > 1 else None
+    results: Dict[str, Exception | None] = {}
+    for name, root, pkgs in roots:
+        if not pkgs:
+            continue
+        if len(roots) > 1:
+            print(f"-- [root] '{name}': '{root}'")
+        for pkg, err in func(root, pkgs, manifest_dir_of(name), scans).items():
+            results[pkg if name == DEFAULT_ROOT else f"{pkg}@{name}"] = err
+    return results
+
+
+# ============================================================ #
+# INIT ======================================================= #
+
+
+class InitPlanner:
+    """
+    Walk packages and plan every action needed to init them, nothing on the
+    system is changed until the plan is executed.
+
+    Every link planned is recorded into the new manifest of its package.
+    """
+
+    def __init__(
+        self,
+        packages: List[Path],
+        res_type: ResolveType,
+        incremental: bool = False,
+        fold: bool = False,
+        manifest_dir: Path = MANIFEST_DIR,
+        scans: ScanCache | None = None,
+    ) -> None:
+        self.res_type = res_type
+        self.incremental = incremental
+        self.fold = fold
+        self.manifest_dir = manifest_dir
+        # shared by the planners of every root, None with a single root
+        self.scans = scans
+        self.olds = {pkg: Manifest.load(manifest_dir, pkg) for pkg in packages}
+        self.news = {pkg: Manifest(manifest_dir, pkg) for pkg in packages}
+        self.ignores = {pkg: package_ignore(pkg) for pkg in packages}
+        for pkg, new in self.news.items():
+            new.ignore = self.ignores[pkg].patterns
+            if self.olds[pkg].ignore != new.ignore:
+                # ignore rules changed, no directory can be skipped
+                self.olds[pkg].tree.clear()
+        # manifest of packages (not in this run) changed by unfolding
+        self.others: Dict[Path, Manifest] = {}
+        self.index = TargetIndex()
+        # the last package that want a target win it, as in the index
+        self.order = {pkg.name: i for i, pkg in enumerate(packages)}
+        self.lock = threading.Lock()
+
+    @property
+    def manifests(self) -> List[Manifest]:
+        return list(self.news.values()) + list(self.others.values())
+
+    def old_of(self, manifest: Manifest) -> Manifest:
+        return self.olds.get(manifest.package) or Manifest(
+            self.manifest_dir, manifest.package
+        )
+
+    def ignore_of(self, package: Path) -> IgnoreMatcher:
+        if (ignore := self.ignores.get(package)) is None:
+            # package not in this run (unfolded by one that is)
+            ignore = self.ignores.setdefault(package, package_ignore(package))
+        return ignore
+
+    def scan(
+        self, src_dir: Path, package: Path
+    ) -> Tuple[List[os.DirEntry], List[os.DirEntry]]:
+        """
+        Same as `scan_dir`, without the entries ignored by the package, so
+        an ignored directory is never listed.
+        """
+        dirs, files = (
+            scan_dir(src_dir) if self.scans is None else self.scans.scan(src_dir)
+        )
+        ignore = self.ignore_of(package)
+        rel = str(src_dir)[len(str(package)) + 1 :]
+        return ignore.filter(rel, dirs, True), ignore.filter(rel, files, False)
+
+    def mtime(self, src_dir: Path) -> int:
+        if self.scans is None:
+            return os.stat(src_dir).st_mtime_ns
+        return self.scans.mtime(src_dir)
+
+    def plan_package(self, root: Path, package: Path, plan: Plan) -> None:
+        self.plan_dir(root, package, self.news[package], plan)
+        self.plan_stale(package, plan)
+
+    def plan_stale(self, package: Path, plan: Plan) -> None:
+        """
+        Unlink links of the last run that no longer belong to the package
+        (file deleted/renamed on source).
+        """
+        new = self.news[package]
+        for target, entry in self.olds[package].entries.items():
+            if target not in new.entries and plan.probe(target) == (
+                TargetState.LINK,
+                entry.source,
+            ):
+                is_dir = entry.link_type == LinkType.DIR
+                plan.add(ActionType.UNLINK, target, package=package.name, is_dir=is_dir)
+
+    def plan_dir(
+        self, dest_dir: Path, src_dir: Path, manifest: Manifest, plan: Plan
+    ) -> None:
+        """
+        Plan links from package directory (and all it's content) to
+        destination directory.
+
+        :NOTE: can run recursively
+        """
+        src_mtime = self.mtime(src_dir)
+        if (
+            self.incremental
+            and (
+                snap := self.old_of(manifest).unchanged_snapshot(
+                    src_dir, src_mtime, dest_dir
+                )
+            )
+            # a package before this one change some of its links
+            and not any(str(dest_dir / name) in plan.overlay for name in snap.files)
+        ):
+            self.keep_unchanged_dir(src_dir, dest_dir, manifest, snap, plan)
+            return
+
+        dirs, files = self.scan(src_dir, manifest.package)
+        METRICS.count("files_visited", len(files))
+        linked: List[str] = []
+        sub_dirs: List[str] = []
+        for entry in dirs:
+            if self.plan_sub_dir(dest_dir, Path(entry.path), manifest, plan):
+                sub_dirs.append(entry.name)
+            else:
+                linked.append(entry.name)
+
+        with DirCursor() as cursor:
+            for file in files:
+                linked.append(file.name)
+                self.plan_file(dest_dir, Path(file.path), manifest, plan, cursor)
+
+        manifest.add_snapshot(src_dir, src_mtime, dest_dir, sub_dirs, linked)
+
+    def plan_sub_dir(
+        self, dest_dir: Path, entry: Path, manifest: Manifest, plan: Plan
+    ) -> bool:
+        """
+        Plan a package sub directory into destination directory.
+
+        Return `False` if the directory is folded (linked as a whole).
+        """
+        new_dest = dest_dir / entry.name
+        self.index.add(str(new_dest), manifest.package.name, True)
+        if self.fold and self.fold_dir(entry, new_dest, manifest, plan):
+            return False
+
+        new_dest = self.prepare_dest_dir(new_dest, manifest, plan)
+        manifest.add_dir(new_dest)
+        # recursive call
+        self.plan_dir(new_dest, entry, manifest, plan)
+        return True
+
+    def plan_file(
+        self,
+        dest_dir: Path,
+        file: Path,
+        manifest: Manifest,
+        plan: Plan,
+        cursor: DirCursor | None = None,
+    ) -> None:
+        """
+        Plan the link of a package file, resolve conflict with `res_type`.
+        """
+        dest_file = dest_dir / file.name
+        target = str(dest_file)
+        pkg_name = manifest.package.name
+        self.index.add(target, pkg_name)
+        state, value = plan.probe(target, cursor)
+
+        if state == TargetState.LINK and value == str(file):
+            # File already linked and good
+            entry = self.old_of(manifest).entries.get(target)
+            if entry is not None and entry.source == value:
+                # Recorded in last run, no need to stat it again
+                manifest.entries[target] = entry
+            else:
+                manifest.add_link(file, dest_file, LinkType.FILE)
+            return
+
+        if state == TargetState.DIR:
+            plan.conflict(target, pkg_name, "is a directory on system", False)
+            return
+
+        owner = (
+            package_of(value, manifest.package.parent)
+            if state == TargetState.LINK
+            else None
+        )
+        if owner is not None:
+            rank = self.order.get(owner)
+            if rank is not None and rank > self.order.get(pkg_name, -1):
+                # won by a later package of this run (reported as collision),
+                # not planned nor recorded, so the next init change nothing
+                return
+            # File of other package, never adopt it into this package
+            plan.conflict(target, pkg_name, f"also in package '{owner}', replaced")
+            plan.add(ActionType.UNLINK, target, package=pkg_name)
+            if rank is not None:
+                # recorded by the package it was linked to, lost by it
+                with self.lock:
+                    owner_dir = manifest.package.parent / owner
+                    self.news[owner_dir].entries.pop(target, None)
+
+        elif state != TargetState.MISSING:
+            # THIS ONLY PASS WHEN CONFLICTS HAPPEN
+            what = "file" if state == TargetState.FILE else f"link to '{value}'"
+            plan.conflict(target, pkg_name, f"{what}, {self.res_type.value}")
+            # a relative link point from its own directory, not from cwd
+            system_file = (
+                target
+                if state == TargetState.FILE
+                else os.path.join(os.path.dirname(target), value)
+            )
+            adopt = self.res_type == ResolveType.ADOPT and os.path.isfile(system_file)
+            if adopt and not same_content(Path(system_file), file, DIGESTS):
+                # Override source file with file current in system
+                size = os.stat(system_file).st_size
+                plan.add(ActionType.BACKUP, target, file, pkg_name)
+                plan.add(ActionType.ADOPT_COPY, target, file, pkg_name, size=size)
+            if not adopt or state == TargetState.LINK:
+                # lost once unlinked (adopted content is kept in the package)
+                plan.add(ActionType.BACKUP, target, target, pkg_name)
+            plan.add(ActionType.UNLINK, target, package=pkg_name)
+
+        plan.add(ActionType.LINK, target, file, pkg_name)
+        manifest.add_link(file, dest_file, LinkType.FILE)
+
+    def keep_unchanged_dir(
+        self,
+        src_dir: Path,
+        dest_dir: Path,
+        manifest: Manifest,
+        snap: DirSnapshot,
+        plan: Plan,
+    ) -> None:
+        """
+        Carry the links of an unchanged directory over to the new manifest
+        without listing it, then continue with its sub directories.
+        """
+        old = self.old_of(manifest)
+        manifest.tree[str(src_dir)] = snap
+        pkg_name = manifest.package.name
+        for name in snap.files:
+            target = str(dest_dir / name)
+            if (entry := old.entries.get(target)) is not None:
+                manifest.entries[target] = entry
+                self.index.add(target, pkg_name, entry.link_type == LinkType.DIR)
+
+        for name in snap.dirs:
+            entry = src_dir / name
+            self.index.add(str(dest_dir / name), pkg_name, True)
+            if (sub := old.tree.get(str(entry))) is not None:
+                new_dest = Path(sub.dest)
+            else:
+                new_dest = self.prepare_dest_dir(dest_dir / name, manifest, plan)
+            manifest.add_dir(new_dest)
+            self.plan_dir(new_dest, entry, manifest, plan)
+
+    def fold_dir(
+        self, entry: Path, new_dest: Path, manifest: Manifest, plan: Plan
+    ) -> bool:
+        """
+        Link the whole directory if nothing on system own the destination yet.
+
+        Return `False` when destination already exist (real directory or link
+        of other package), then it's content have to be link one by one.
+        """
+        state, value = plan.probe(new_dest)
+        if state == TargetState.MISSING:
+            package = manifest.package
+            rel = str(entry)[len(str(package)) + 1 :]
+            if self.ignore_of(package).ignores_in(entry, rel):
+                # the link would show the ignored files
+                return False
+            plan.add(ActionType.LINK, new_dest, entry, package.name, True)
+        elif not (state == TargetState.LINK and value == str(entry)):
+            return False
+
+        manifest.add_link(entry, new_dest, LinkType.DIR)
+        return True
+
+    def unfold_dir(
+        self, link: Path, value: str, manifest: Manifest, plan: Plan
+    ) -> bool:
+        """
+        Turn a folded directory back to a real directory, so more than one
+        package can put files in it.
+
+        Manifest of the owner package is updated with the new links.
+        Return `False` if the link is not a folded directory of a package.
+        """
+        source_dir = manifest.package.parent
+        folded = Path(value)
+        if not (folded.is_relative_to(source_dir) and folded.is_dir()):
+            return False
+
+        owner_dir = source_dir / folded.relative_to(source_dir).parts[0]
+        plan.add(ActionType.UNLINK, link, package=owner_dir.name, is_dir=True)
+        plan.add(ActionType.MKDIR, link, package=manifest.package.name)
+        if owner_dir == manifest.package:
+            # Our own folded directory, the caller will link its content
+            return True
+
+        with self.lock:
+            owner = self.news.get(owner_dir) or self.others.get(owner_dir)
+            if owner is None:
+                owner = Manifest.load(self.manifest_dir, owner_dir)
+                self.others[owner_dir] = owner
+            owner.entries.pop(str(link), None)
+            owner.add_dir(link)
+            # no longer a folded directory, next incremental init have to go
+            # into it
+            snap = owner.tree.get(str(folded.parent))
+            if snap is not None and folded.name in snap.files:
+                snap.files.remove(folded.name)
+                snap.dirs.append(folded.name)
+            self.plan_dir(link, folded, owner, plan)
+        return True
+
+    def prepare_dest_dir(self, new_dest: Path, manifest: Manifest, plan: Plan) -> Path:
+        """
+        Plan the destination directory, return the (resolved) path that files
+        should be linked into.
+
+        Folded directory (link to a package directory) is unfolded first.
+        """
+        state, value = plan.probe(new_dest)
+        name = manifest.package.name
+        if state == TargetState.LINK and not self.unfold_dir(
+            new_dest, value, manifest, plan
+        ):
+            match self.res_type:
+                case ResolveType.REPLACE:
+                    plan.add(ActionType.BACKUP, new_dest, new_dest, name, True)
+                    plan.add(ActionType.UNLINK, new_dest, is_dir=True)
+                    state = TargetState.MISSING
+                case ResolveType.ADOPT:
+                    try:
+                        resolved = new_dest.resolve(strict=True)
+                    except FileNotFoundError:  # Broken link
+                        plan.add(ActionType.BACKUP, new_dest, new_dest, name, True)
+                        plan.add(ActionType.UNLINK, new_dest, is_dir=True)
+                        state = TargetState.MISSING
+                    else:
+                        if resolved.is_dir():
+                            return resolved
+                        state = TargetState.FILE
+                case _:
+                    raise ValueError("Unhandle type: this should not happend!")
+
+        if state == TargetState.MISSING:
+            plan.add(ActionType.MKDIR, new_dest, package=manifest.package.name)
+        elif state == TargetState.FILE:
+            raise FileExistsError(f"not a directory on system: '{new_dest}'")
+        return new_dest
+
+    def plan_packages(
+        self, root: Path, packages: List[Path], plan: Plan, jobs: int = 1
+    ) -> Dict[str, Exception | None]:
+        """
+        Plan multiple packages, return error (or None) of each package.
+
+        With `jobs` > 1, target directories shared by several packages are
+        planned first, then every sub tree that only one package use (or
+        every group of entries that conflict on the same target) is planned
+        in a worker pool. Entries of the same target are always planned in
+        package order, so the last package win, the same as one by one.
+        """
+        if jobs <= 1:
+            results: Dict[str, Exception | None] = {}
+            for pkg in packages:
+                sub = Plan(plan)
+                try:
+                    self.plan_package(root, pkg, sub)
+                except Exception as e:  # noqa: BLE001
+                    results[pkg.name] = e
+                else:
+                    results[pkg.name] = None
+                    plan.extend(sub)
+            return results
+
+        from concurrent.futures import ThreadPoolExecutor
+
+        errors: Dict[str, Exception | None] = {pkg.name: None for pkg in packages}
+        units: List[Tuple[Path, List[Tuple[Path, Path, bool]]]] = []
+        levels: List[Tuple[Path, Path, int, Path]] = []
+        try:
+            self.split_units(
+                root, [(pkg, pkg, True) for pkg in packages], plan, units, levels
+            )
+        except Exception as e:  # noqa: BLE001
+            return {pkg.name: e for pkg in packages}
+
+        def run(unit: Tuple[Path, List[Tuple[Path, Path, bool]]]) -> Plan:
+            dest_dir, owners = unit
+            sub = Plan(plan)
+            for pkg, entry, is_dir in owners:
+                owner_plan = Plan(sub)
+                try:
+                    if is_dir:
+                        self.plan_sub_dir(dest_dir, entry, self.news[pkg], owner_plan)
+                    else:
+                        self.plan_file(dest_dir, entry, self.news[pkg], owner_plan)
+                except Exception as e:  # noqa: BLE001
+                    errors[pkg.name] = errors[pkg.name] or e
+                else:
+                    sub.extend(owner_plan)
+            return sub
+
+        with ThreadPoolExecutor(max_workers=jobs) as pool:
+            # merged in unit order, so the plan is the same on every run
+            for sub in pool.map(run, units):
+                plan.extend(sub)
+
+        for pkg, src, src_mtime, dest_dir in levels:
+            # snapshot of the shared directories, for the next incremental init
+            sub_dirs: List[str] = []
+            linked: List[str] = []
+            dirs, files = self.scan(src, pkg)
+            for entry in dirs:
+                if str(dest_dir / entry.name) in self.news[pkg].entries:
+                    linked.append(entry.name)
+                else:
+                    sub_dirs.append(entry.name)
+            linked.extend(f.name for f in files)
+            self.news[pkg].add_snapshot(src, src_mtime, dest_dir, sub_dirs, linked)
+
+        for pkg in packages:
+            if errors[pkg.name] is None:
+                self.plan_stale(pkg, plan)
+        return errors
+
+    def split_units(
+        self,
+        dest_dir: Path,
+        sources: List[Tuple[Path, Path, bool]],
+        plan: Plan,
+        units: List[Tuple[Path, List[Tuple[Path, Path, bool]]]],
+        levels: List[Tuple[Path, Path, int, Path]],
+    ) -> None:
+        """
+        Split directories of several packages (that map to the same
+        destination) into independent units of work.
+
+        :NOTE: can run recursively
+
+        :param sources: (package, directory inside package, True), in order
+        :param units: output, (destination dir, entries with the same name)
+        :param levels: output, the shared directories that was split
+        """
+        by_name: Dict[str, List[Tuple[Path, Path, bool]]] = {}
+        for pkg, src, _ in sources:
+            levels.append((pkg, src, self.mtime(src), dest_dir))
+            dirs, files = self.scan(src, pkg)
+            for entry in dirs:
+                by_name.setdefault(entry.name, []).append((pkg, Path(entry.path), True))
+            for entry in files:
+                by_name.setdefault(entry.name, []).append(
+                    (pkg, Path(entry.path), False)
+                )
+
+        for name, owners in by_name.items():
+            if len(owners) > 1 and all(is_dir for _, _, is_dir in owners):
+                # More than one package use it, so it can't be folded
+                new_dest = self.prepare_dest_dir(
+                    dest_dir / name, self.news[owners[0][0]], plan
+                )
+                for pkg, _, _ in owners:
+                    self.news[pkg].add_dir(new_dest)
+                # recursive call
+                self.split_units(new_dest, owners, plan, units, levels)
+            else:
+                units.append((dest_dir, owners))
+
+
+def package_of(path: str, source_dir: Path) -> str | None:
+    """
+    Return name of the package (in `source_dir`) that `path` belong to,
+    None if not in a package.
+    """
+    path = Path(path)
+    if not path.is_relative_to(source_dir) or path == source_dir:
+        return None
+    return path.relative_to(source_dir).parts[0]
+
+
+def init_packages(
+    root: Path,
+    packages: List[Path],
+    res_type: ResolveType,
+    incremental: bool = False,
+    fold: bool = False,
+    jobs: int = 1,
+    dry_run: bool = False,
+    manifest_dir: Path = MANIFEST_DIR,
+    scans: ScanCache | None = None,
+) -> Dict[str, Exception | None]:
+    """
+    Init multiple packages, return error (or None) of each package.
+    """
+    init_planner = InitPlanner(
+        packages, res_type, incremental, fold, manifest_dir, scans
+    )
+    plan = Plan()
+    with METRICS.phase("walk"):
+        results = init_planner.plan_packages(root, packages, plan, jobs)
+    # reported before anything is linked
+    if RECORDS.enabled:
+        for target, pkgs in init_planner.index.sorted_collisions():
+            RECORDS.collision(target, pkgs)
+    else:
+        for line in init_planner.index.report():
+            print(line)
+    run_plan(plan, results, init_planner.manifests, dry_run, jobs)
+    return results
+
+
+# ============================================================ #
+# REMOVE ===================================================== #
+
+
+def remove_packages(
+    root: Path,
+    packages: List[Path],
+    restore: bool,
+    jobs: int = 1,
+    dry_run: bool = False,
+    manifest_dir: Path = MANIFEST_DIR,
+    scans: ScanCache | None = None,
+) -> Dict[str, Exception | None]:
+    """
+    Remove multiple packages, return error (or None) of each package.
+    """
+    plans = {pkg.name: Plan() for pkg in packages}
+    manifests: Dict[str, Manifest] = {}
+
+    def plan_package(pkg_dir: Path) -> None:
+        manifests[pkg_dir.name] = plan_remove_package(
+            root, pkg_dir, restore, plans[pkg_dir.name], manifest_dir, scans
+        )
+
+    with METRICS.phase("walk"):
+        results = run_packages(plan_package, packages, jobs)
+    plan = Plan()
+    for name, sub in plans.items():
+        if results[name] is None:
+            plan.extend(sub)
+    run_plan(plan, results, [], dry_run, jobs)
+
+    if not dry_run:
+        for name, manifest in manifests.items():
+            if results[name] is None:
+                manifest.delete()
+    return results
+
+
+def plan_remove_package(
+    root: Path,
+    package: Path,
+    restore: bool,
+    plan: Plan,
+    manifest_dir: Path = MANIFEST_DIR,
+    scans: ScanCache | None = None,
+) -> Manifest:
+    """
+    Plan removing a stowed package, use the package manifest if there is
+    one, otherwise fall back to walking the package.
+
+    :param restore: `True` will copy file in source into system,
+                    this is like replace linked file with actual file
+    """
+    manifest = Manifest.load(manifest_dir, package)
+    if manifest.loaded:
+        plan_remove_from_manifest(manifest, restore, plan)
+    else:
+        plan_remove_stow_package(root, package, restore, plan, scans)
+    return manifest
+
+
+def plan_remove_from_manifest(manifest: Manifest, restore: bool, plan: Plan) -> None:
+    """
+    Plan removing all links recorded in manifest without walking the package.
+
+    Link that was changed by user (not pointing to the recorded source)
+    is left as it is.
+    """
+    name = manifest.package.name
+    METRICS.count("files_visited", len(manifest.entries))
+    with DirCursor() as cursor:
+        for entry in manifest.entries.values():
+            if read_link(entry.target, cursor) != entry.source:
+                continue
+
+            is_dir = entry.link_type == LinkType.DIR
+            plan.add(ActionType.UNLINK, entry.target, package=name, is_dir=is_dir)
+            if restore:
+                plan.add(
+                    ActionType.RESTORE_COPY, entry.target, entry.source, name, is_dir
+                )
+
+    # deepest first, so parent can be removed after it children
+    for dir in reversed(manifest.dirs):
+        plan.add(ActionType.RMDIR, dir, package=name)
+
+
+def plan_remove_stow_package(
+    dest_dir: Path,
+    package: Path,
+    restore: bool,
+    plan: Plan,
+    scans: ScanCache | None = None,
+) -> None:
+    """
+    Plan removing a stowed package by walking it.
+    """
+    name = package.name
+    dev = package.stat().st_dev
+    dest_dirs: List[Path] = [dest_dir]
+    with DirCursor() as cursor:
+        for item in walk(package, package_ignore(package), scans):
+            METRICS.count("files_visited")
+            file_on_sys = dest_dir / item.rel
+
+            if is_same_file(file_on_sys, item, dev, cursor):
+                # linked file, or folded directory (link to the whole directory)
+                item.descend = False
+                plan.add(
+                    ActionType.UNLINK, file_on_sys, package=name, is_dir=item.is_dir
+                )
+
+                if restore:
+                    plan.add(
+                        ActionType.RESTORE_COPY,
+                        file_on_sys,
+                        item.path,
+                        name,
+                        item.is_dir,
+                    )
+
+            elif item.is_dir:
+                dest_dirs.append(file_on_sys)
+
+    # deepest first, so parent can be removed after it children
+    for dir in reversed(dest_dirs):
+        plan.add(ActionType.RMDIR, dir, package=name)
+
+
+def is_same_file(
+    file_on_sys: Path, item: WalkEntry, dev: int, cursor: DirCursor | None = None
+) -> bool:
+    """
+    Same as `samefile`, but the package side come from the directory listing
+    (inode) and the device of the package, so it cost one `stat`.
+    """
+    name, fd = cursor.at(str(file_on_sys)) if cursor else (file_on_sys, None)
+    try:
+        st = os.stat(name, dir_fd=fd)
+    except OSError:
+        # Missing on system or broken link
+        return False
+    return st.st_ino == item.entry.inode() and st.st_dev == dev
+
+
+# ============================================================ #
+# WATCH ====================================================== #
+
+# seconds without event before a batch is applied, and the longest
+# a batch can be delayed by a continuous burst of events
+WATCH_DEBOUNCE = 0.3
+WATCH_MAX_DELAY = 3.0
+
+
+def watch_packages(params: Params) -> int:
+    """
+    Init the packages, then keep them in sync with the source directory
+    until interrupted (ctrl-c), return number of packages watched.
+
+    Events are only used to know when to run: every batch of changes is an
+    incremental init, so only the directories that changed are listed and
+    only the needed mkdir/link/unlink are applied.
+    """
+    packages = [pkg for pkg in params.packages if pkg.exists()]
+
+    def sync() -> Dict[str, Exception | None]:
+        return run_roots(
+            params,
+            packages,
+            lambda root, pkgs, manifest_dir, scans: init_packages(
+                root,
+                pkgs,
+                params.resolve,
+                True,
+                params.fold,
+                params.jobs,
+                False,
+                manifest_dir,
+                scans,
+            ),
+        )
+
+    count_success(sync(), "init")
+    DIGESTS.save()
+
+    # ctypes/select are only needed by this op
+    from watcher import make_watcher
+
+    watcher = make_watcher(params.watch_poll)
+    source_dir = str(params.source_dir)
+    if params.get_all:
+        # also see packages that are added later
+        watcher.add_tree(source_dir)
+    else:
+        for pkg in packages:
+            watcher.add_tree(pkg)
+    print(f"-- [watch] watching {len(packages)} packages, ctrl-c to stop")
+
+    try:
+        while True:
+            changed = watcher.collect(WATCH_DEBOUNCE, WATCH_MAX_DELAY)
+            if params.get_all and source_dir in changed:
+                params.get_all_packages()
+                packages = params.packages
+            names = sorted({package_of(d, params.source_dir) for d in changed} - {None})
+            print(f"-- [watch] {len(changed)} directories changed: {', '.join(names)}")
+
+            packages = [pkg for pkg in packages if pkg.exists()]
+            for name, err in sync().items():
+                if err is not None:
+                    print(f"[failed] -- '{name}' with error: {err}")
+            DIGESTS.save()
+            RECORDS.flush()
+    except KeyboardInterrupt:
+        print("\n-- [watch] stopped")
+    finally:
+        watcher.close()
+    return len(packages)
+
+
+# ============================================================ #
+# SERVE ====================================================== #
+
+# queries should see a change quickly, no need to wait for a whole burst
+SERVE_DEBOUNCE = 0.05
+SERVE_MAX_DELAY = 0.5
+
+
+def serve_packages(params: Params) -> int:
+    """
+    Keep the targets of the packages in memory and answer queries on
+    `SOCKET_FILE` until interrupted (ctrl-c), return number of packages
+    served. Nothing on system is changed.
+
+    Changed source directories are listed again as they change, a query
+    never walk anything (see `daemon.py` for the protocol).
+    """
+    import signal
+    from watcher import make_watcher
+    from daemon import start_server, stop_server
+    from index import PackageIndex
+
+    packages = [pkg for pkg in params.packages if pkg.exists()]
+    with METRICS.phase("walk"):
+        index = PackageIndex(params.root, packages)
+    try:
+        server = start_server(SOCKET_FILE, index)
+    except FileExistsError as e:
+        print(f"[error] -- {e}")
+        sys.exit(1)
+    watcher = make_watcher(params.watch_poll)
+    source_dir = str(params.source_dir)
+    if params.get_all:
+        # also see packages that are added later
+        watcher.add_tree(source_dir)
+    else:
+        for pkg in packages:
+            watcher.add_tree(pkg)
+    print(
+        f"-- [serve] {len(packages)} packages, {len(index.targets)} targets,"
+        f" answering on '{SOCKET_FILE}', ctrl-c to stop"
+    )
+
+    # stopped by a service manager, still remove the socket
+    signal.signal(signal.SIGTERM, lambda *_: sys.exit(0))
+    try:
+        while True:
+            changed = watcher.collect(SERVE_DEBOUNCE, SERVE_MAX_DELAY)
+            if params.get_all and source_dir in changed:
+                params.get_all_packages()
+                index.set_packages(params.packages)
+            count = index.refresh(changed)
+            if params.verbose:
+                print(f"-- [serve] {count} directories listed again")
+    except KeyboardInterrupt:
+        print("\n-- [serve] stopped")
+    finally:
+        stop_server(server)
+        watcher.close()
+    return len(index.packages)
+
+
+# ============================================================ #
+# STATUS ===================================================== #
+
+
+def status_packages(
+    root: Path,
+    packages: List[Path],
+    verbose: bool = False,
+    manifest_dir: Path = MANIFEST_DIR,
+    scans: ScanCache | None = None,
+) -> Dict[str, Exception | None]:
+    """
+    Check every link of the packages, return error (or None) of each
+    package, drift on system is an error.
+
+    Links of all packages are checked in one batch.
+    """
+    from status import EntryStatus, check_nodes, count_status, format_counts
+
+    tree, links = links_tree(root, packages, manifest_dir, scans)
+    targets, sources = array("l"), array("l")
+    for pkg_targets, pkg_sources in links.values():
+        targets.extend(pkg_targets)
+        sources.extend(pkg_sources)
+    METRICS.count("files_visited", len(targets))
+    with METRICS.phase("check"):
+        statuses = check_nodes(tree, targets, sources)
+    results: Dict[str, Exception | None] = {}
+    start = 0
+    for name, (pkg_targets, _) in links.items():
+        pkg_statuses = statuses[start : start + len(pkg_targets)]
+        start += len(pkg_targets)
+        for target, (status, value) in zip(pkg_targets, pkg_statuses):
+            if status != EntryStatus.OK or verbose:
+                arrow = f" -> '{value}'" if value else ""
+                print(f"-- [{status}] '{tree.path(target)}'{arrow}")
+
+        counts = count_status(pkg_statuses)
+        drift = len(pkg_targets) - counts[EntryStatus.OK]
+        results[name] = ValueError(f"drift: {format_counts(counts)}") if drift else None
+    return results
+
+
+def links_tree(
+    root: Path,
+    packages: List[Path],
+    manifest_dir: Path = MANIFEST_DIR,
+    scans: ScanCache | None = None,
+) -> Tuple["PathTree", Dict[str, Tuple[array, array]]]:
+    """
+    Return the links every package should have, as nodes (targets,
+    sources) of one tree shared by all packages.
+
+    A target wanted by more than one package belong to the last one only,
+    the one that win it on init.
+    """
+    from tree import PathTree
+
+    tree = PathTree()
+    links: Dict[str, Tuple[array, array]] = {}
+    with METRICS.phase("walk"):
+        for pkg_dir in packages:
+            links[pkg_dir.name] = package_links(
+                root, pkg_dir, tree, manifest_dir, scans
+            )
+    if len(links) > 1:
+        # one byte per node, set once a later package has the target
+        claimed = bytearray(len(tree))
+        for name in reversed(list(links)):
+            targets, sources = links[name]
+            if any(claimed[t] for t in targets):
+                keep = [i for i, t in enumerate(targets) if not claimed[t]]
+                targets = array("l", [targets[i] for i in keep])
+                sources = array("l", [sources[i] for i in keep])
+                links[name] = (targets, sources)
+            for t in targets:
+                claimed[t] = 1
+    return tree, links
+
+
+def package_links(
+    root: Path,
+    package: Path,
+    tree: "PathTree",
+    manifest_dir: Path = MANIFEST_DIR,
+    scans: ScanCache | None = None,
+) -> Tuple[array, array]:
+    """
+    Add every link the package should have to the tree, return the nodes
+    of the targets and of the sources.
+
+    The package is always walked (listings shared through `scans`), so a
+    file added since the last init is expected too. Links of the manifest
+    whose source is not in the package any more are added after.
+    """
+    targets, sources = array("l"), array("l")
+    prefix = str(root) + os.sep
+    # source directory node -> target directory node
+    mirror = {tree.add(str(package)): tree.add(str(root))}
+    for item in walk(
+        package, package_ignore(package), scans, tree, tree.add(str(package))
+    ):
+        target = tree.child(mirror[tree.parents[item.node]], item.name)
+        if item.is_dir:
+            if read_link(prefix + item.rel) == item.path:
+                # folded directory
+                item.descend = False
+            else:
+                mirror[item.node] = target
+                continue
+        targets.append(target)
+        sources.append(item.node)
+
+    manifest = Manifest.load(manifest_dir, package)
+    if manifest.loaded:
+        walked = set(sources)
+        for entry in manifest.entries.values():
+            if (source := tree.add(entry.source)) not in walked:
+                targets.append(tree.add(entry.target))
+                sources.append(source)
+    return targets, sources
+
+
+# ============================================================ #
+# DIFF ======================================================= #
+
+
+def diff_packages(
+    root: Path,
+    packages: List[Path],
+    unified: bool = False,
+    verbose: bool = False,
+    jobs: int = 1,
+    manifest_dir: Path = MANIFEST_DIR,
+    scans: ScanCache | None = None,
+) -> Dict[str, Exception | None]:
+    """
+    Compare the real files on system that are in the way of the links
+    (what `--resolve=adopt` would take) with the package files, return
+    error (or None) of each package, a file that differ is an error.
+
+    Nothing is changed. Files of all packages are hashed in one batch.
+    """
+    from status import EntryStatus, check_nodes, format_counts
+    from drift import DriftStatus, count_drift, expand_pairs, find_drift, unified_diff
+
+    tree, links = links_tree(root, packages, manifest_dir, scans)
+    targets, sources = array("l"), array("l")
+    for pkg_targets, pkg_sources in links.values():
+        targets.extend(pkg_targets)
+        sources.extend(pkg_sources)
+    METRICS.count("files_visited", len(targets))
+    with METRICS.phase("check"):
+        statuses = check_nodes(tree, targets, sources)
+    conflicts: Dict[str, List[Tuple[str, str]]] = {}
+    start = 0
+    for name, (pkg_targets, pkg_sources) in links.items():
+        pkg_statuses = statuses[start : start + len(pkg_targets)]
+        start += len(pkg_targets)
+        # only the few conflicts get their paths back
+        conflicts[name] = expand_pairs(
+            [
+                (tree.path(target), tree.path(source))
+                for target, source, (status, _) in zip(
+                    pkg_targets, pkg_sources, pkg_statuses
+                )
+                if status == EntryStatus.CONFLICT
+            ]
+        )
+
+    with METRICS.phase("compare"):
+        drift = find_drift(
+            [link for items in conflicts.values() for link in items], DIGESTS, jobs
+        )
+    results: Dict[str, Exception | None] = {}
+    start = 0
+    for name, links in conflicts.items():
+        items = drift[start : start + len(links)]
+        start += len(links)
+        for target, source, status in items:
+            if status == DriftStatus.SAME and not verbose:
+                continue
+            print(f"-- [{status}] '{target}'")
+            if status == DriftStatus.DIFFER and unified:
+                lines = unified_diff(target, source)
+                if lines is None:
+                    print("   (binary or too big, not shown)")
+                else:
+                    sys.stdout.writelines(lines)
+
+        counts = count_drift(items)
+        differ = len(items) - counts[DriftStatus.SAME]
+        results[name] = (
+            ValueError(f"drift: {format_counts(counts)}") if differ else None
+        )
+    return results
+
+
+# ============================================================ #
+# PRUNE ====================================================== #
+
+
+def recorded_packages(source_dir: Path) -> List[Path]:
+    """
+    Return packages that have a manifest, including the deleted ones.
+    """
+    return [source_dir / file.stem for file in sorted(MANIFEST_DIR.glob("*.json"))]
+
+
+def prune_packages(
+    root: Path, source_dir: Path, packages: List[Path], dry_run: bool = False
+) -> Dict[str, Exception | None]:
+    """
+    Unlink dangling links (that point into the packages) left by files
+    deleted or renamed on source, return error (or None) of each package.
+
+    Only directories that packages map to (now, or in their manifest) are
+    listed, never the whole root.
+    """
+    from status import find_dangling
+
+    manifests = {pkg: Manifest.load(MANIFEST_DIR, pkg) for pkg in packages}
+    dirs: Set[str] = set()
+    with METRICS.phase("walk"):
+        for pkg, manifest in manifests.items():
+            dirs |= mapped_dirs(root, pkg, manifest)
+    METRICS.count("dirs_visited", len(dirs))
+
+    prefixes = tuple(str(pkg) + os.sep for pkg in packages)
+    with METRICS.phase("check"):
+        dangling = find_dangling(sorted(dirs), prefixes)
+
+    plan = Plan()
+    changed: List[Manifest] = []
+    for target, value in dangling:
+        pkg = source_dir / (package_of(value, source_dir) or "")
+        print(f"[dangling] -- '{target}' -> '{value}'")
+        plan.add(ActionType.UNLINK, target, package=pkg.name)
+        manifest = manifests.get(pkg)
+        if manifest is not None and manifest.entries.pop(target, None) is not None:
+            changed.append(manifest)
+    plan_empty_dirs(root, dangling, source_dir, plan)
+
+    results: Dict[str, Exception | None] = {pkg.name: None for pkg in packages}
+    run_plan(plan, results, list(dict.fromkeys(changed)), dry_run, 1)
+    return results
+
+
+def plan_empty_dirs(
+    root: Path, unlinked: List[Tuple[str, str]], source_dir: Path, plan: Plan
+) -> None:
+    """
+    Plan removing the directories (under root) that the unlinked links
+    leave empty, deepest first, same as remove.
+    """
+    prefix = os.path.join(str(root), "")
+    gone = {target for target, _ in unlinked}
+    # directory -> package of the first link unlinked in it
+    owners: Dict[str, str] = {}
+    for target, value in unlinked:
+        name = package_of(value, source_dir) or ""
+        dir = os.path.dirname(target)
+        while dir.startswith(prefix) and dir not in owners:
+            owners[dir] = name
+            dir = os.path.dirname(dir)
+
+    for dir in sorted(owners, key=lambda d: d.count(os.sep), reverse=True):
+        try:
+            names = os.listdir(dir)
+        except OSError:
+            continue
+        if all(os.path.join(dir, name) in gone for name in names):
+            plan.add(ActionType.RMDIR, dir, package=owners[dir])
+            gone.add(dir)
+
+
+def mapped_dirs(root: Path, package: Path, manifest: Manifest) -> Set[str]:
+    """
+    Return target directories of the package: from its manifest (also the
+    ones of files deleted since), and from the package as it is now.
+    """
+    dirs = {str(root)}
+    dirs.update(manifest.dirs)
+    dirs.update(e.target.rpartition(os.sep)[0] for e in manifest.entries.values())
+    if package.is_dir():
+        prefix = str(root) + os.sep
+        for item in walk(package, package_ignore(package)):
+            if item.is_dir:
+                dirs.add(prefix + item.rel)
+    return dirs
+
+
+# ============================================================ #
+# RESTORE ==================================================== #
+
+
+def restore_backups(
+    source_dir: Path, packages: List[Path], dry_run: bool = False
+) -> Dict[str, Exception | None]:
+    """
+    Put back the last backup of every path saved while processing the
+    packages, return error (or None) of each package.
+
+    What is there now is backed up first (unless it's a link of a
+    package), marked so that the next restore don't pick it.
+    """
+    import time
+
+    names = {pkg.name for pkg in packages}
+    results: Dict[str, Exception | None] = {pkg.name: None for pkg in packages}
+    manifests: Dict[str, Manifest] = {}
+    changed: List[Manifest] = []
+    plan = Plan()
+    for path, record in BACKUPS.latest(names).items():
+        name = record["package"]
+        state, value = plan.probe(path)
+        if "link" in record:
+            if state == TargetState.LINK and value == record["link"]:
+                continue
+        elif state == TargetState.FILE and BACKUPS.digest(path) == record["digest"]:
+            continue
+
+        date = time.strftime("%Y-%m-%d %H:%M:%S", time.localtime(record["time"]))
+        print(f"[backup] -- '{path}' from {date}")
+        parent = os.path.dirname(path)
+        match plan.probe(parent)[0]:
+            case TargetState.MISSING:
+                plan.add(ActionType.MKDIR, parent, package=name)
+            case TargetState.LINK | TargetState.FILE:
+                # folded directory, restoring would write into the package
+                plan.conflict(path, name, "parent is not a directory", False)
+                continue
+        if state == TargetState.DIR:
+            plan.conflict(path, name, "is a directory on system", False)
+            continue
+        if not dry_run and (
+            state == TargetState.FILE
+            or (state == TargetState.LINK and package_of(value, source_dir) is None)
+        ):
+            BACKUPS.save(path, name, restore=True)
+        if state != TargetState.MISSING:
+            plan.add(ActionType.UNLINK, path, package=name)
+        if "link" in record:
+            plan.add(ActionType.LINK, path, record["link"], name)
+        else:
+            blob = BACKUPS.blob(record["digest"])
+            plan.add(ActionType.RESTORE_COPY, path, blob, name, size=record["size"])
+
+        # no longer a link of the package
+        if name not in manifests:
+            manifests[name] = Manifest.load(MANIFEST_DIR, source_dir / name)
+        if manifests[name].entries.pop(path, None) is not None:
+            changed.append(manifests[name])
+
+    run_plan(plan, results, list(dict.fromkeys(changed)), dry_run, 1)
+    return results
+
+
+# ============================================================ #
+# STOW ======================================================= #
+
+
+# stowed files are planned and applied by batches of this many actions,
+# so memory stay flat however big the directory is
+STOW_BATCH = 4096
+
+
+def iter_stowers(
+    files: List[Path], dirs: List[Path], root_dir: Path
+) -> Iterator[Tuple[str, str]]:
+    """
+    Yield (file, path relative to root) of every file to stow, directories
+    are walked lazily with their `.stow-ignore` applied (ignored
+    directories are never listed).
+
+    :raise ValueError: if a path is not under `root_dir`
+    """
+    for file in files:
+        yield str(file), str(file.relative_to(root_dir))
+
+    for dir in dirs:
+        dir_rel = dir.relative_to(root_dir)
+        prefix = "" if dir_rel == Path(".") else str(dir_rel) + os.sep
+        for item in walk(dir, load_ignore(dir / IGNORE_FILE)):
+            if not item.is_dir:
+                yield item.path, prefix + item.rel
+
+
+def process_stow_package(
+    pkg_dir: Path,
+    files: List[Path],
+    dirs: List[Path],
+    root_dir: Path,
+    dry_run: bool = False,
+) -> Tuple[int, int]:
+    """
+    Stow all the file (and files in the directories) to the pakage direction,
+    return (success, total).
+    """
+    manifest = Manifest.load(MANIFEST_DIR, pkg_dir)
+    # Package without manifest was init by older version, a partial
+    # manifest would make `remove` miss the rest, so only new package get one.
+    new_package = not pkg_dir.exists()
+    name = pkg_dir.name
+    pkg_prefix = str(pkg_dir) + os.sep
+
+    def apply(plan: Plan) -> int:
+        if dry_run:
+            show_plan(plan)
+            return sum(action.kind == ActionType.LINK for action in plan.actions)
+
+        failed = {action.target for action, _ in execute_plan(plan, journal=JOURNAL)}
+        success = 0
+        for action in plan.actions:
+            if action.kind != ActionType.LINK:
+                continue
+            if action.target in failed:
+                print(f"-- [failed] -- '{action.target}'")
+                continue
+            manifest.add_link(Path(action.source), Path(action.target), LinkType.FILE)
+            success += 1
+        return success
+
+    plan = Plan()
+    success = total = 0
+    for file, relative in iter_stowers(files, dirs, root_dir):
+        total += 1
+        with METRICS.phase("walk"):
+            stowed = pkg_prefix + relative
+            parent = os.path.dirname(stowed)
+            if plan.probe(parent)[0] == TargetState.MISSING:
+                plan.add(ActionType.MKDIR, parent, package=name)
+            try:
+                same = os.path.exists(stowed) and same_content(
+                    Path(file), Path(stowed), DIGESTS
+                )
+                size = 0 if same else os.stat(file).st_size
+            except OSError as e:
+                print(f"-- [failed] -- '{file}' with error: {e}")
+                continue
+
+            if not same:
+                if os.path.lexists(stowed):
+                    # package file is overwritten
+                    plan.add(ActionType.BACKUP, file, stowed, name)
+                plan.add(ActionType.ADOPT_COPY, file, stowed, name, size=size)
+            plan.add(ActionType.UNLINK, file, package=name)
+            plan.add(ActionType.LINK, file, stowed, name)
+
+        if len(plan.actions) >= STOW_BATCH:
+            success += apply(plan)
+            # dry run: nothing was done, keep the planned state
+            plan = Plan(plan) if dry_run else Plan()
+
+    success += apply(plan)
+    METRICS.count("files_visited", total)
+
+    if not dry_run and (manifest.loaded or new_package):
+        manifest.save()
+
+    return success, total
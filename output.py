@@ -0,0 +1,175 @@
+import time
+import threading
+from typing import TYPE_CHECKING, BinaryIO, Dict, List
+from metrics import METRICS
+
+if TYPE_CHECKING:
+    from planner import Action, Plan
+
+
+# ============================================================= #
+# ============================================================= #
+
+# records are written by blocks of about this many bytes
+BUFFER_SIZE = 64 * 1024
+
+
+class RecordWriter:
+    """
+    Machine readable output (`--format=ndjson`): one JSON object per line,
+    written as things happen, one per action applied (or planned, on a dry
+    run), per entry listed, per package result, and a last `summary` one.
+
+    Records carry `type`, then `path`, `package`, `action`, `outcome`,
+    `duration` (seconds), `bytes` where they apply. Lines are buffered and
+    written by blocks, nothing else is kept but the counts per package for
+    the summary.
+    """
+
+    def __init__(self) -> None:
+        self.stream: BinaryIO | None = None
+        self.buffer: List[bytes] = []
+        self.size = 0
+        # package -> {outcome: number of actions}, and its result
+        self.counts: Dict[str, Dict[str, int]] = {}
+        self.results: Dict[str, str | None] = {}
+        self.lock = threading.Lock()
+
+    @property
+    def enabled(self) -> bool:
+        return self.stream is not None
+
+    def open(self, stream: BinaryIO) -> None:
+        import json
+        import atexit
+        from planner import SkippedError
+
+        self.stream = stream
+        self._skipped = SkippedError
+        self._dumps = json.JSONEncoder(ensure_ascii=False).encode
+        # `sys.exit` in the middle of a run (list, errors) still flush
+        atexit.register(self.flush)
+
+    def write(self, record: Dict) -> None:
+        line = (self._dumps(record) + "\n").encode()
+        with self.lock:
+            self.buffer.append(line)
+            self.size += len(line)
+            if self.size >= BUFFER_SIZE:
+                self._flush()
+
+    def flush(self) -> None:
+        with self.lock:
+            self._flush()
+
+    def _flush(self) -> None:
+        if self.buffer and self.stream is not None:
+            self.stream.write(b"".join(self.buffer))
+            self.stream.flush()
+        self.buffer.clear()
+        self.size = 0
+
+    def count(self, package: str, outcome: str) -> None:
+        with self.lock:
+            counts = self.counts.setdefault(package, {})
+            counts[outcome] = counts.get(outcome, 0) + 1
+
+    # ============================================================= #
+    # RECORDS ===================================================== #
+
+    def action(
+        self, action: "Action", duration: float, error: Exception | None
+    ) -> None:
+        if error is None:
+            outcome = "ok"
+        elif isinstance(error, self._skipped):
+            outcome = "skipped"
+        else:
+            outcome = "failed"
+        record = {
+            "type": "action",
+            "action": action.kind.value,
+            "path": action.target,
+            "package": action.package,
+            "outcome": outcome,
+            "duration": round(duration, 6),
+            "bytes": action.size,
+        }
+        if action.source:
+            record["source"] = action.source
+        if error is not None:
+            record["error"] = str(error)
+        self.count(action.package, outcome)
+        self.write(record)
+
+    def plan(self, plan: "Plan") -> None:
+        """
+        Records of a dry run, the conflicts and every action planned.
+        """
+        for conflict in plan.conflicts:
+            self.write(
+                {
+                    "type": "conflict",
+                    "path": conflict.target,
+                    "package": conflict.package,
+                    "reason": conflict.reason,
+                    "blocked": not conflict.resolved,
+                }
+            )
+        for action in plan.actions:
+            record = {
+                "type": "action",
+                "action": action.kind.value,
+                "path": action.target,
+                "package": action.package,
+                "outcome": "planned",
+                "bytes": action.size,
+            }
+            if action.source:
+                record["source"] = action.source
+            self.count(action.package, "planned")
+            self.write(record)
+
+    def entry(self, package: str, path: str, is_dir: bool) -> None:
+        self.write({"type": "entry", "package": package, "path": path, "dir": is_dir})
+
+    def collision(self, target: str, packages: List[str]) -> None:
+        self.write(
+            {
+                "type": "collision",
+                "path": target,
+                "packages": packages,
+                "winner": packages[-1],
+            }
+        )
+
+    def package(self, name: str, error: Exception | None) -> None:
+        self.results[name] = None if error is None else str(error)
+        record = {"type": "package", "package": name, "outcome": "ok"}
+        if error is not None:
+            record["outcome"] = "failed"
+            record["error"] = str(error)
+        self.write(record)
+
+    def summary(self, op: str, total: int, success: int) -> None:
+        packages: Dict[str, Dict] = {}
+        for name in {**self.results, **self.counts}:
+            item: Dict = {"ok": 0, "failed": 0, **self.counts.get(name, {})}
+            if name in self.results:
+                item["result"] = "failed" if self.results[name] else "ok"
+            packages[name] = item
+        self.write(
+            {
+                "type": "summary",
+                "op": op,
+                "total": total,
+                "success": success,
+                "duration": round(time.perf_counter() - METRICS.start, 6),
+                "packages": packages,
+            }
+        )
+        self.flush()
+
+
+# shared by every module of the run, writes nothing until opened
+RECORDS = RecordWriter()
@@ -0,0 +1,342 @@
+from pathlib import Path
+import os
+import stat
+import time
+from enum import Enum
+from typing import TYPE_CHECKING, Callable, Dict, List, Set, Tuple
+import copier
+from fsops import DirCursor, lstat, readlink
+from metrics import METRICS
+
+if TYPE_CHECKING:
+    from journal import Journal
+    from backup import BackupStore
+
+
+# ============================================================= #
+# ============================================================= #
+
+
+class ActionType(Enum):
+    MKDIR = "mkdir"
+    LINK = "link"
+    UNLINK = "unlink"
+    ADOPT_COPY = "adopt-copy"
+    RESTORE_COPY = "restore-copy"
+    RMDIR = "rmdir"
+    BACKUP = "backup"
+
+
+class TargetState:
+    MISSING = "missing"
+    DIR = "dir"
+    FILE = "file"
+    LINK = "link"
+
+
+class Action:
+    """
+    One change on the file system.
+
+    `target` is the path that is changed, `source` is the file in package
+    (link value, or the other side of a copy). ADOPT_COPY copy `target`
+    into `source`, RESTORE_COPY copy `source` to `target`. BACKUP save
+    `source` (the target itself, or the package file of an adopt) before
+    the following actions on `target` change it.
+    """
+
+    __slots__ = ("is_dir", "kind", "package", "size", "source", "target")
+
+    def __init__(
+        self,
+        kind: ActionType,
+        target: str,
+        source: str = "",
+        package: str = "",
+        is_dir: bool = False,
+        size: int = 0,
+    ) -> None:
+        self.kind = kind
+        self.target = target
+        self.source = source
+        self.package = package
+        self.is_dir = is_dir
+        self.size = size
+
+    def __str__(self) -> str:
+        match self.kind:
+            case ActionType.LINK:
+                return f"[{self.kind.value}] '{self.target}' -> '{self.source}'"
+            case ActionType.ADOPT_COPY:
+                return f"[{self.kind.value}] '{self.target}' => '{self.source}'"
+            case ActionType.RESTORE_COPY:
+                return f"[{self.kind.value}] '{self.source}' => '{self.target}'"
+            case ActionType.BACKUP:
+                return f"[{self.kind.value}] '{self.source}'"
+            case _:
+                return f"[{self.kind.value}] '{self.target}'"
+
+
+class Conflict:
+    __slots__ = ("package", "reason", "resolved", "target")
+
+    def __init__(
+        self, target: str, package: str, reason: str, resolved: bool = True
+    ) -> None:
+        self.target = target
+        self.package = package
+        self.reason = reason
+        # `False` when it block the package (can't be resolve automatically)
+        self.resolved = resolved
+
+    def __str__(self) -> str:
+        status = "conflict" if self.resolved else "blocked"
+        return f"[{status}] '{self.target}' ({self.package}): {self.reason}"
+
+
+class Plan:
+    """
+    Ordered list of actions (and conflicts found) of an operation.
+
+    While planning, `probe` give the state of a path as it will be after
+    the actions planned so far, so later packages see what earlier ones do.
+    """
+
+    def __init__(self, parent: "Plan | None" = None) -> None:
+        self.actions: List[Action] = []
+        self.conflicts: List[Conflict] = []
+        # share the planned state with parent, sub plan only split the work
+        self.overlay: Dict[str, Tuple[str, str]] = (
+            {} if parent is None else parent.overlay
+        )
+        self.created: Set[str] = set() if parent is None else parent.created
+
+    def add(
+        self,
+        kind: ActionType,
+        target: Path | str,
+        source: Path | str = "",
+        package: str = "",
+        is_dir: bool = False,
+        size: int = 0,
+    ) -> None:
+        target = str(target)
+        self.actions.append(Action(kind, target, str(source), package, is_dir, size))
+        match kind:
+            case ActionType.MKDIR:
+                self.overlay[target] = (TargetState.DIR, "")
+                self.created.add(target)
+            case ActionType.LINK:
+                self.overlay[target] = (TargetState.LINK, str(source))
+            case ActionType.UNLINK | ActionType.RMDIR:
+                self.overlay[target] = (TargetState.MISSING, "")
+
+    def conflict(
+        self, target: Path | str, package: str, reason: str, resolved: bool = True
+    ) -> None:
+        self.conflicts.append(Conflict(str(target), package, reason, resolved))
+        METRICS.count("conflicts")
+
+    def extend(self, other: "Plan") -> None:
+        self.actions.extend(other.actions)
+        self.conflicts.extend(other.conflicts)
+
+    def probe(
+        self, target: Path | str, cursor: DirCursor | None = None
+    ) -> Tuple[str, str]:
+        """
+        Return (state, link value) of the path, planned state first.
+
+        Path inside a directory that the plan create is known to be missing
+        without asking the file system.
+
+        :param cursor: for many targets of the same directory
+        """
+        target = str(target)
+        if (state := self.overlay.get(target)) is not None:
+            return state
+        if os.path.dirname(target) in self.created:
+            return (TargetState.MISSING, "")
+
+        try:
+            st = lstat(target, cursor)
+        except (FileNotFoundError, NotADirectoryError):
+            return (TargetState.MISSING, "")
+        if stat.S_ISLNK(st.st_mode):
+            return (TargetState.LINK, readlink(target, cursor))
+        if stat.S_ISDIR(st.st_mode):
+            return (TargetState.DIR, "")
+        return (TargetState.FILE, "")
+
+    def blocked(self) -> Dict[str, str]:
+        """
+        Return the first unresolved conflict of every blocked package.
+        """
+        blocked: Dict[str, str] = {}
+        for c in self.conflicts:
+            if not c.resolved:
+                blocked.setdefault(c.package, f"'{c.target}' {c.reason}")
+        return blocked
+
+    def summary(self) -> str:
+        counts = {kind: 0 for kind in ActionType}
+        copy_bytes = 0
+        for action in self.actions:
+            counts[action.kind] += 1
+            copy_bytes += action.size
+        items = [f"{kind.value}: {n}" for kind, n in counts.items() if n]
+        items.append(f"copy: {copy_bytes} bytes")
+        items.append(f"conflicts: {len(self.conflicts)}")
+        return "-- plan: " + ", ".join(items)
+
+    def print(self) -> None:
+        for conflict in self.conflicts:
+            print(conflict)
+        for action in self.actions:
+            print(action)
+        print(self.summary())
+
+
+# ============================================================= #
+# EXECUTOR ==================================================== #
+
+# where BACKUP actions save the files, set by the script (`None` skip them)
+backup_store: "BackupStore | None" = None
+
+# called after every action applied with (action, seconds, error or None),
+# set by the script for `--format=ndjson`
+on_action: Callable[[Action, float, Exception | None], None] | None = None
+
+
+class SkippedError(RuntimeError):
+    """
+    Action not run, a previous action on the same target failed, or
+    nothing to do (directory not removed, not empty).
+
+    Reported for the action, but not a failure of its package.
+    """
+
+
+def apply_action(action: Action, cursor: DirCursor | None = None) -> None:
+    """
+    :param cursor: mkdir/link/unlink relative to the parent directory fd
+    """
+    name, fd = cursor.at(action.target) if cursor else (action.target, None)
+    match action.kind:
+        case ActionType.MKDIR:
+            try:
+                os.mkdir(name, dir_fd=fd)
+            except FileExistsError:
+                if not os.path.isdir(action.target):
+                    raise
+            except FileNotFoundError:
+                Path(action.target).mkdir(parents=True, exist_ok=True)
+        case ActionType.LINK:
+            os.symlink(action.source, name, action.is_dir, dir_fd=fd)
+        case ActionType.UNLINK:
+            os.unlink(name, dir_fd=fd)
+        case ActionType.ADOPT_COPY:
+            copier.copyfile(Path(action.target), Path(action.source))
+        case ActionType.RESTORE_COPY:
+            if action.is_dir:
+                copier.copytree(Path(action.source), Path(action.target))
+            else:
+                copier.copy(Path(action.source), Path(action.target))
+        case ActionType.BACKUP:
+            if backup_store is not None:
+                # the target itself is removed right after
+                move = action.source == action.target
+                backup_store.save(action.source, action.package, move)
+        case ActionType.RMDIR:
+            try:
+                os.rmdir(action.target)
+            except OSError as e:
+                # well, don't remove non empty folder
+                raise SkippedError(f"skipped, {e.strerror}") from e
+
+
+def execute_plan(
+    plan: Plan, jobs: int = 1, journal: "Journal | None" = None
+) -> List[Tuple[Action, Exception]]:
+    """
+    Apply the plan, return the actions that failed.
+
+    Directory structure (mkdir, directory links) is applied first
+    in plan order, then the rest is applied in batches grouped by parent
+    directory (batches run in a thread pool when `jobs` > 1, each one
+    relative to an fd of its directory), and empty directories are removed
+    last. When an action fail, the following
+    actions on the same target are skipped, so a failed adopt copy never
+    lead to removing the file on system.
+
+    With a `journal`, every action is recorded before the first one run,
+    and every batch is marked done after it finish.
+    """
+    failed: List[Tuple[Action, Exception]] = []
+    failed_targets: Set[str] = set()
+    actions = plan.actions
+
+    def run(batch: List[int], lazy: bool = True) -> None:
+        with DirCursor(lazy) as cursor:
+            for seq in batch:
+                action = actions[seq]
+                error: Exception | None = None
+                if action.target in failed_targets:
+                    error = SkippedError("skipped, previous action failed")
+                    failed.append((action, error))
+                    if on_action is not None:
+                        on_action(action, 0.0, error)
+                    continue
+                start = time.perf_counter() if on_action is not None else 0.0
+                try:
+                    apply_action(action, cursor)
+                except SkippedError as e:
+                    error = e
+                except Exception as e:  # noqa: BLE001
+                    error = e
+                    failed.append((action, e))
+                    failed_targets.add(action.target)
+                if on_action is not None:
+                    on_action(action, time.perf_counter() - start, error)
+        if journal is not None:
+            journal.done(batch)
+
+    structure: List[int] = []
+    rmdirs: List[int] = []
+    batches: Dict[str, List[int]] = {}
+    for seq, action in enumerate(actions):
+        if action.kind == ActionType.MKDIR or (
+            action.is_dir
+            and action.kind in (ActionType.LINK, ActionType.UNLINK, ActionType.BACKUP)
+        ):
+            structure.append(seq)
+        elif action.kind == ActionType.RMDIR:
+            rmdirs.append(seq)
+        else:
+            batches.setdefault(os.path.dirname(action.target), []).append(seq)
+
+    with METRICS.phase("link"):
+        if journal is not None:
+            journal.begin(actions)
+        run(structure)
+        if jobs > 1 and len(batches) > 1:
+            from concurrent.futures import ThreadPoolExecutor
+
+            with ThreadPoolExecutor(max_workers=jobs) as pool:
+                groups = list(batches.values())
+                list(pool.map(run, groups, [len(b) < 2 for b in groups]))
+        else:
+            for batch in batches.values():
+                # a lone action don't pay for opening its directory
+                run(batch, len(batch) < 2)
+        run(rmdirs)
+        if journal is not None:
+            journal.commit()
+        if backup_store is not None:
+            # blob of a file that was not removed is its own copy again
+            backup_store.settle()
+
+    links = sum(action.kind == ActionType.LINK for action in actions)
+    failed_links = sum(action.kind == ActionType.LINK for action, _ in failed)
+    METRICS.count("links_created", links - failed_links)
+    return failed
@@ -0,0 +1,199 @@
+import os
+import stat
+from typing import Dict, Iterable, List, Sequence, Set, Tuple
+from fsops import DirCursor, readlink
+from tree import PathTree
+
+
+# ============================================================= #
+# ============================================================= #
+
+
+class EntryStatus:
+    # plain strings (not Enum), counting 100k of them stay cheap
+    OK = "linked-ok"
+    MISSING = "missing"
+    BROKEN = "broken"
+    ELSEWHERE = "elsewhere"
+    CONFLICT = "conflict"
+
+
+ALL_STATUS = (
+    EntryStatus.OK,
+    EntryStatus.MISSING,
+    EntryStatus.BROKEN,
+    EntryStatus.ELSEWHERE,
+    EntryStatus.CONFLICT,
+)
+
+
+def list_dirs(dirs: Iterable[str]) -> Dict[str, Dict[str, os.DirEntry]]:
+    """
+    List every directory once, return {dir: {name: entry}}.
+
+    Directory that can't be listed (missing, not a directory...) is empty.
+    """
+    listing: Dict[str, Dict[str, os.DirEntry]] = {}
+    for dir in dirs:
+        if dir not in listing:
+            listing[dir] = list_dir(dir)
+    return listing
+
+
+def list_dir(dir: str) -> Dict[str, os.DirEntry]:
+    try:
+        with os.scandir(dir) as it:
+            return {entry.name: entry for entry in it}
+    except OSError:
+        return {}
+
+
+def list_names(dirs: Iterable[str]) -> Dict[str, Set[str]]:
+    """
+    Same as `list_dirs`, only the names.
+    """
+    listing: Dict[str, Set[str]] = {}
+    for dir in dirs:
+        if dir not in listing:
+            listing[dir] = list_names_of(dir)
+    return listing
+
+
+def list_names_of(dir: str) -> Set[str]:
+    try:
+        return set(os.listdir(dir))
+    except OSError:
+        return set()
+
+
+def check_links(links: List[Tuple[str, str]]) -> List[Tuple[str, str]]:
+    """
+    Check that every target is a link to its source, return (status, link
+    value) for each (target, source).
+    """
+    tree = PathTree()
+    targets, sources = tree.add_pairs(links)
+    return check_nodes(tree, targets, sources)
+
+
+def check_nodes(
+    tree: PathTree, targets: Sequence[int], sources: Sequence[int]
+) -> List[Tuple[str, str]]:
+    """
+    `check_links` of links given as nodes of the tree.
+
+    Targets (and sources) are checked in one pass by listing their parent
+    directories, instead of `lstat` every path. Only links need one more
+    syscall (`readlink`), and the few that not point to their source one
+    more (`stat`) to tell broken from pointing elsewhere.
+
+    Paths are only made (one per directory, and for the links) while
+    checking, never kept.
+    """
+    parents, names = tree.parents, tree.names
+    # directory node -> (path with separator, listing)
+    target_dirs: Dict[int, Tuple[str, Dict[str, os.DirEntry]]] = {}
+    source_dirs: Dict[int, Tuple[str, Set[str]]] = {}
+
+    result: List[Tuple[str, str]] = []
+    append = result.append
+    with DirCursor() as cursor:
+        for target, source in zip(targets, sources):
+            dir = parents[target]
+            if (found := target_dirs.get(dir)) is None:
+                prefix = tree.prefix(dir)
+                found = target_dirs[dir] = (prefix, list_dir(prefix))
+            prefix, listing = found
+            name = names[target]
+            entry = listing.get(name)
+            if entry is None:
+                append((EntryStatus.MISSING, ""))
+                continue
+            if not entry.is_symlink():
+                append((EntryStatus.CONFLICT, ""))
+                continue
+
+            src_dir = parents[source]
+            if (src_found := source_dirs.get(src_dir)) is None:
+                src_prefix = tree.prefix(src_dir)
+                src_found = source_dirs[src_dir] = (
+                    src_prefix,
+                    list_names_of(src_prefix),
+                )
+            src_prefix, src_names = src_found
+            src_name = names[source]
+            path = prefix + name
+            value = readlink(path, cursor)
+            if value == src_prefix + src_name:
+                ok = src_name in src_names
+                append((EntryStatus.OK if ok else EntryStatus.BROKEN, value))
+            elif os.path.exists(path):
+                append((EntryStatus.ELSEWHERE, value))
+            else:
+                append((EntryStatus.BROKEN, value))
+    return result
+
+
+def check_link(target: str, source: str) -> Tuple[str, str]:
+    """
+    `check_links` of a single link, with `lstat` instead of listing the
+    parent directory. A file inside a folded directory (a parent linked to
+    the package) is linked too.
+    """
+    try:
+        st = os.lstat(target)
+    except (FileNotFoundError, NotADirectoryError):
+        return (EntryStatus.MISSING, "")
+    if not stat.S_ISLNK(st.st_mode):
+        if os.path.realpath(target) == os.path.realpath(source):
+            return (EntryStatus.OK, "")
+        return (EntryStatus.CONFLICT, "")
+
+    value = os.readlink(target)
+    if value == source:
+        ok = os.path.lexists(source)
+        return (EntryStatus.OK if ok else EntryStatus.BROKEN, value)
+    if os.path.exists(target):
+        return (EntryStatus.ELSEWHERE, value)
+    return (EntryStatus.BROKEN, value)
+
+
+def find_dangling(
+    dirs: Iterable[str], prefixes: Tuple[str, ...]
+) -> List[Tuple[str, str]]:
+    """
+    Return (link, link value) of every dangling link directly inside `dirs`
+    that point into one of `prefixes`.
+
+    Each directory is listed once, only links are `readlink`, and the
+    values are checked in one more batch (listing their parent directories).
+    """
+    links: List[Tuple[str, str]] = []
+    with DirCursor() as cursor:
+        for entries in list_dirs(dirs).values():
+            for entry in entries.values():
+                if not entry.is_symlink():
+                    continue
+                try:
+                    value = readlink(entry.path, cursor)
+                except OSError:
+                    continue
+                if value.startswith(prefixes):
+                    links.append((entry.path, value))
+
+    values = [value.rpartition(os.sep) for _, value in links]
+    listing = list_names(dir for dir, _, _ in values)
+    return [
+        link for link, (dir, _, name) in zip(links, values) if name not in listing[dir]
+    ]
+
+
+def count_status(statuses: List[Tuple[str, str]]) -> Dict[str, int]:
+    counts = {status: 0 for status in ALL_STATUS}
+    for status, _ in statuses:
+        counts[status] += 1
+    return counts
+
+
+def format_counts(counts: Dict[str, int]) -> str:
+    return ", ".join(f"{n} {status}" for status, n in counts.items() if n)
@@ -0,0 +1,72 @@
+import os
+import sys
+import json
+import shutil
+import tempfile
+import unittest
+import subprocess
+from typing import Dict, List
+
+REPO = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if REPO not in sys.path:
+    sys.path.insert(0, REPO)
+
+
+# ============================================================= #
+# ============================================================= #
+
+
+class SandboxCase(unittest.TestCase):
+    """
+    A copy of the script with its own `config.json` (manifests, journal,
+    backups are kept next to it), a source and a root directory, all in a
+    temporary directory.
+    """
+
+    def setUp(self) -> None:
+        self.tmp = tempfile.mkdtemp(prefix="me-stow-test-")
+        self.addCleanup(shutil.rmtree, self.tmp, True)
+        self.app = os.path.join(self.tmp, "app")
+        self.source = os.path.join(self.tmp, "src")
+        self.root = os.path.join(self.tmp, "home")
+        for path in (self.app, self.source, self.root):
+            os.mkdir(path)
+        for name in os.listdir(REPO):
+            if name.endswith(".py"):
+                shutil.copy(os.path.join(REPO, name), self.app)
+        config = {"source_path": self.source, "root_path": self.root}
+        with open(os.path.join(self.app, "config.json"), "w") as file:
+            json.dump(config, file)
+
+    def write(self, path: str, content: str = "") -> str:
+        """
+        Write a file under the sandbox, `path` relative to it.
+        """
+        path = os.path.join(self.tmp, path)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, "w") as file:
+            file.write(content)
+        return path
+
+    def stow(self, *args: str) -> subprocess.CompletedProcess:
+        return subprocess.run(
+            [sys.executable, os.path.join(self.app, "main.py"), *args],
+            input="",
+            capture_output=True,
+            text=True,
+            # never the root, so relative paths are not resolved by luck
+            cwd=self.tmp,
+            env=self.env(),
+            timeout=60,
+            check=False,
+        )
+
+    def env(self) -> Dict[str, str]:
+        # nothing of the environment running the tests
+        env = {k: v for k, v in os.environ.items() if not k.startswith("ME_STOW_")}
+        env["ME_STOW_NONINTERACTIVE"] = "1"
+        return env
+
+    def records(self, *args: str) -> List[Dict]:
+        result = self.stow("--format=ndjson", *args)
+        return [json.loads(line) for line in result.stdout.splitlines()]
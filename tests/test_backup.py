@@ -0,0 +1,59 @@
+import os
+import shutil
+import tempfile
+import unittest
+from pathlib import Path
+from helpers import SandboxCase
+from backup import BackupStore
+
+
+class TestBackupStore(unittest.TestCase):
+    def setUp(self) -> None:
+        self.tmp = tempfile.mkdtemp(prefix="me-stow-test-")
+        self.addCleanup(shutil.rmtree, self.tmp, True)
+        self.store = BackupStore(Path(self.tmp) / "backups")
+        self.addCleanup(self.store.close)
+        self.file = os.path.join(self.tmp, "file")
+        with open(self.file, "w") as f:
+            f.write("old\n")
+
+    def test_moved_file_not_removed(self) -> None:
+        record = self.store.save(self.file, "pk", move=True)
+        blob = self.store.blob(record["digest"])
+        # the unlink that should follow the backup failed
+        self.store.settle()
+
+        self.assertEqual(os.stat(blob).st_nlink, 1)
+        with open(self.file, "w") as f:
+            f.write("edited\n")
+        self.assertEqual(blob.read_text(), "old\n")
+
+    def test_moved_file_removed(self) -> None:
+        record = self.store.save(self.file, "pk", move=True)
+        blob = self.store.blob(record["digest"])
+        ino = os.stat(blob).st_ino
+        os.unlink(self.file)
+        self.store.settle()
+
+        # nothing copied
+        self.assertEqual(os.stat(blob).st_ino, ino)
+        self.assertEqual(blob.read_text(), "old\n")
+
+
+class TestRestore(SandboxCase):
+    def test_restore_replaced_file(self) -> None:
+        self.write("src/pk/.rc", "package\n")
+        target = self.write("home/.rc", "system\n")
+        self.stow("--init", "--force", "pk")
+        self.assertTrue(os.path.islink(target))
+
+        result = self.stow("--restore-backup", "pk")
+
+        self.assertEqual(result.returncode, 0, result.stdout)
+        self.assertFalse(os.path.islink(target))
+        with open(target) as file:
+            self.assertEqual(file.read(), "system\n")
+
+
+if __name__ == "__main__":
+    unittest.main()
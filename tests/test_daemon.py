@@ -0,0 +1,69 @@
+import os
+import sys
+import json
+import time
+import socket
+import unittest
+import subprocess
+from helpers import SandboxCase
+
+
+class TestServe(SandboxCase):
+    def setUp(self) -> None:
+        super().setUp()
+        self.socket = os.path.join(self.app, "me-stow.sock")
+
+    def serve(self) -> None:
+        proc = subprocess.Popen(
+            [sys.executable, os.path.join(self.app, "main.py"), "--serve"],
+            stdin=subprocess.DEVNULL,
+            stdout=subprocess.DEVNULL,
+            stderr=subprocess.DEVNULL,
+            cwd=self.tmp,
+            env=self.env(),
+        )
+        self.addCleanup(proc.wait, 10)
+        self.addCleanup(proc.terminate)
+        deadline = time.monotonic() + 10
+        while not os.path.exists(self.socket):
+            if time.monotonic() > deadline or proc.poll() is not None:
+                self.fail("server did not start")
+            time.sleep(0.05)
+
+    def ask(self, line: str) -> dict:
+        with socket.socket(socket.AF_UNIX) as sock:
+            sock.connect(self.socket)
+            sock.sendall((line + "\n").encode())
+            reply = b""
+            while not reply.endswith(b"\n"):
+                if not (chunk := sock.recv(65536)):
+                    break
+                reply += chunk
+        return json.loads(reply)
+
+    def test_status_folded_directory(self) -> None:
+        self.write("src/p1/.p1rc", "p1\n")
+        self.write("src/p2/.config/app/a.conf", "a\n")
+        self.write("src/p2/.config/app/b.conf", "b\n")
+        result = self.stow("--init", "--fold")
+        self.assertEqual(result.returncode, 0, result.stdout)
+        self.assertTrue(os.path.islink(os.path.join(self.root, ".config")))
+        self.serve()
+
+        reply = self.ask("status p2")
+
+        self.assertEqual(list(reply["p2"]), ["linked-ok"], reply)
+
+    def test_owner(self) -> None:
+        self.write("src/p1/.p1rc", "p1\n")
+        self.stow("--init")
+        self.serve()
+
+        reply = self.ask(f"owner {os.path.join(self.root, '.p1rc')}")
+
+        self.assertEqual(reply["package"], "p1")
+        self.assertEqual(reply["status"], "linked-ok")
+
+
+if __name__ == "__main__":
+    unittest.main()
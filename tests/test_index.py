@@ -0,0 +1,56 @@
+import os
+import sys
+import threading
+import unittest
+from helpers import REPO  # noqa: F401, put the app on the path
+from index import TargetIndex
+
+
+class TestTargetIndex(unittest.TestCase):
+    def test_collisions(self) -> None:
+        index = TargetIndex()
+        index.add("/home/.config", "a", True)
+        index.add("/home/.config/x", "a")
+        index.add("/home/.config", "b", True)
+        self.assertEqual(index.add("/home/.config/x", "b"), "a")
+        self.assertEqual(index.owner("/home/.config/x"), "b")
+        self.assertEqual(index.sorted_collisions(), [("/home/.config/x", ["a", "b"])])
+
+    def test_add_from_threads(self) -> None:
+        interval = sys.getswitchinterval()
+        # switch threads as often as possible
+        sys.setswitchinterval(1e-6)
+        self.addCleanup(sys.setswitchinterval, interval)
+        index = TargetIndex()
+        barrier = threading.Barrier(8)
+
+        def paths(worker: int):
+            # shared directories, own files
+            for i in range(3000):
+                yield os.path.join("/root", f"d{i % 50}", f"s{i % 7}", f"w{worker}-{i}")
+
+        def fill(worker: int) -> None:
+            barrier.wait()
+            for path in paths(worker):
+                index.add(path, f"p{worker}")
+
+        threads = [threading.Thread(target=fill, args=(w,)) for w in range(8)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        tree = index.tree
+        self.assertEqual(len(tree.parents), len(tree.names))
+        for worker in range(8):
+            for path in paths(worker):
+                node = tree.find(path)
+                self.assertIsNotNone(node, path)
+                self.assertEqual(tree.path(node), path)
+                self.assertEqual(index.owner(path), f"p{worker}")
+        # every node once: root, /root, 50 dirs, 350 sub dirs, the files
+        self.assertEqual(len(tree), 1 + 1 + 50 + 350 + 8 * 3000)
+
+
+if __name__ == "__main__":
+    unittest.main()
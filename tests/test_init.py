@@ -0,0 +1,38 @@
+import os
+import unittest
+from helpers import SandboxCase
+
+
+class TestInit(SandboxCase):
+    def test_adopt_relative_foreign_link(self) -> None:
+        package_file = self.write("src/pk/.rc", "package\n")
+        self.write("home/other/rc", "system\n")
+        target = os.path.join(self.root, ".rc")
+        os.symlink(os.path.join("other", "rc"), target)
+
+        result = self.stow("--init", "--resolve=adopt", "pk")
+
+        self.assertEqual(result.returncode, 0, result.stderr)
+        self.assertEqual(os.readlink(target), package_file)
+        # content of the link target, read from the link's directory
+        with open(package_file) as file:
+            self.assertEqual(file.read(), "system\n")
+
+    def test_collision_steady_state(self) -> None:
+        self.write("src/pka/.shared", "a\n")
+        self.write("src/pka/.arc", "a\n")
+        winner = self.write("src/pkb/.shared", "b\n")
+        self.stow("--init")
+        self.stow("--init")
+
+        records = self.records("--init", "--dry-run")
+
+        self.assertEqual([r for r in records if r["type"] == "action"], [])
+        self.assertIn("collision", [r["type"] for r in records])
+        self.assertEqual(os.readlink(os.path.join(self.root, ".shared")), winner)
+        result = self.stow("--status")
+        self.assertEqual(result.returncode, 0, result.stdout)
+
+
+if __name__ == "__main__":
+    unittest.main()
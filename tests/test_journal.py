@@ -0,0 +1,41 @@
+import os
+import shutil
+import tempfile
+import unittest
+from helpers import REPO  # noqa: F401, put the app on the path
+from journal import replay
+from planner import Action, ActionType
+
+
+class TestReplay(unittest.TestCase):
+    def setUp(self) -> None:
+        self.tmp = tempfile.mkdtemp(prefix="me-stow-test-")
+        self.addCleanup(shutil.rmtree, self.tmp, True)
+
+    def write(self, name: str, content: str) -> str:
+        path = os.path.join(self.tmp, name)
+        with open(path, "w") as file:
+            file.write(content)
+        return path
+
+    def test_adopt_through_foreign_link(self) -> None:
+        package_file = self.write("package", "package\n")
+        self.write("system", "system\n")
+        target = os.path.join(self.tmp, "target")
+        os.symlink("system", target)
+        # interrupted before the copy was done
+        actions = [
+            Action(ActionType.ADOPT_COPY, target, package_file, "pk"),
+            Action(ActionType.UNLINK, target, package="pk"),
+            Action(ActionType.LINK, target, package_file, "pk"),
+        ]
+
+        self.assertEqual(replay(actions), [])
+
+        self.assertEqual(os.readlink(target), package_file)
+        with open(package_file) as file:
+            self.assertEqual(file.read(), "system\n")
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,24 @@
+import os
+import unittest
+from helpers import SandboxCase
+
+
+class TestPrune(SandboxCase):
+    def test_emptied_directories_removed(self) -> None:
+        self.write("src/pk/.rc", "rc\n")
+        deleted = self.write("src/pk/.config/app/sub/conf", "conf\n")
+        self.write("src/pk/.config/other/conf", "conf\n")
+        self.stow("--init", "pk")
+        os.unlink(deleted)
+
+        result = self.stow("--prune", "pk")
+
+        self.assertEqual(result.returncode, 0, result.stdout)
+        config = os.path.join(self.root, ".config")
+        self.assertFalse(os.path.lexists(os.path.join(config, "app")))
+        # still has a link of the package
+        self.assertTrue(os.path.islink(os.path.join(config, "other", "conf")))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,24 @@
+import os
+import unittest
+from helpers import SandboxCase
+
+
+class TestRemove(SandboxCase):
+    def test_directory_not_empty_skipped(self) -> None:
+        self.write("src/pk/.config/app/conf", "conf\n")
+        self.stow("--init", "pk")
+        # not from the package, the directory stay
+        self.write("home/.config/app/local", "local\n")
+
+        records = self.records("--remove", "pk")
+
+        rmdirs = {r["path"]: r for r in records if r.get("action") == "rmdir"}
+        app_dir = os.path.join(self.root, ".config", "app")
+        self.assertEqual(rmdirs[app_dir]["outcome"], "skipped")
+        self.assertTrue(os.path.isdir(app_dir))
+        package = [r for r in records if r["type"] == "package"]
+        self.assertEqual([r["outcome"] for r in package], ["ok"])
+
+
+if __name__ == "__main__":
+    unittest.main()
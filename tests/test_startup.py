@@ -0,0 +1,30 @@
+import os
+import sys
+import unittest
+import subprocess
+from helpers import REPO
+
+
+class TestStartup(unittest.TestCase):
+    def test_help_imports_classes_only(self) -> None:
+        for entry in ("main.py", "me-stow.py"):
+            result = subprocess.run(
+                [sys.executable, "-S", "-X", "importtime", entry, "-h"],
+                cwd=REPO,
+                stdin=subprocess.DEVNULL,
+                capture_output=True,
+                text=True,
+                check=False,
+            )
+            local = {name[:-3] for name in os.listdir(REPO) if name.endswith(".py")}
+            imported = [
+                name
+                for line in result.stderr.splitlines()
+                if (name := line.rsplit("|", 1)[-1].strip()) in local
+            ]
+            self.assertEqual(result.returncode, 0, result.stderr)
+            self.assertEqual(imported, ["classes"], entry)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,52 @@
+import os
+import unittest
+from helpers import SandboxCase
+
+
+class TestStatus(SandboxCase):
+    def test_healthy(self) -> None:
+        self.write("src/pk/.rc", "rc\n")
+        self.write("src/pk/.config/app/conf", "conf\n")
+        self.stow("--init", "pk")
+
+        result = self.stow("--status", "pk")
+
+        self.assertEqual(result.returncode, 0, result.stdout)
+
+    def test_file_added_after_init(self) -> None:
+        self.write("src/pk/.rc", "rc\n")
+        self.stow("--init", "pk")
+        self.write("src/pk/.config/app/conf", "conf\n")
+
+        result = self.stow("--status", "pk")
+
+        self.assertEqual(result.returncode, 1)
+        target = os.path.join(self.root, ".config", "app", "conf")
+        self.assertIn(f"[missing] '{target}'", result.stdout)
+
+    def test_file_deleted_after_init(self) -> None:
+        source = self.write("src/pk/.rc", "rc\n")
+        self.write("src/pk/.other", "other\n")
+        self.stow("--init", "pk")
+        os.unlink(source)
+
+        result = self.stow("--status", "pk")
+
+        # the link of the manifest is still checked
+        self.assertEqual(result.returncode, 1)
+        self.assertIn(os.path.join(self.root, ".rc"), result.stdout)
+
+    def test_relative_root(self) -> None:
+        self.write("src/pk/.rc", "rc\n")
+        self.write("src/pk/.config/app/conf", "conf\n")
+        # relative to the sandbox, the directory the script run from
+        self.stow("--init", "--root=home", "pk")
+
+        result = self.stow("--status", "--root=home", "pk")
+
+        self.assertEqual(result.returncode, 0, result.stdout)
+        self.assertTrue(os.path.islink(os.path.join(self.root, ".rc")))
+
+
+if __name__ == "__main__":
+    unittest.main()
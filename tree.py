@@ -0,0 +1,113 @@
+from array import array
+import os
+import sys
+from typing import Dict, Iterable, List, Tuple
+
+
+# ============================================================= #
+# ============================================================= #
+
+
+class PathTree:
+    """
+    Compact tree of paths, for what hold every entry of the packages at
+    once (conflicts, status).
+
+    A node is an index into flat arrays: `parents[i]` is its parent node,
+    `names[i]` its last component, interned, so `.config`, `init.lua`...
+    are stored once for the whole tree. A path cost one int, one reference
+    and a slot in its directory, instead of a string of the whole path
+    (and of its parent, to list it).
+
+    Node 0 is the file system root.
+
+    Not thread safe, adding a path change several structures one after
+    the other, hold a lock to add from many threads (see `TargetIndex`).
+    """
+
+    __slots__ = ("_dirs", "children", "names", "parents")
+
+    def __init__(self) -> None:
+        self.parents = array("l", [-1])
+        self.names: List[str] = [""]
+        # directory node -> {name: node}
+        self.children: Dict[int, Dict[str, int]] = {}
+        # directory path -> node, one per directory (not per entry), so
+        # adding a path is a lookup of its directory and of its name
+        self._dirs: Dict[str, int] = {"": 0}
+
+    def __len__(self) -> int:
+        return len(self.parents)
+
+    def child(self, parent: int, name: str) -> int:
+        """
+        Return the node of `name` in `parent`, added if not there yet.
+        """
+        kids = self.children.get(parent)
+        if kids is None:
+            kids = self.children[parent] = {}
+        elif (node := kids.get(name)) is not None:
+            return node
+        return self._new(kids, parent, name)
+
+    def _new(self, kids: Dict[str, int], parent: int, name: str) -> int:
+        name = sys.intern(name)
+        node = kids[name] = len(self.parents)
+        self.parents.append(parent)
+        self.names.append(name)
+        return node
+
+    def add(self, path: str) -> int:
+        """
+        Return the node of an absolute path, added (with its parents) if
+        not there yet.
+
+        :raise ValueError: `path` is relative
+        """
+        dir, _, name = path.rpartition(os.sep)
+        if not dir and path[:1] != os.sep:
+            raise ValueError(f"not an absolute path: '{path}'")
+        if (node := self._dirs.get(dir)) is None:
+            node = self._dirs[dir] = self.add(dir)
+        if not name:
+            return node
+        kids = self.children.get(node)
+        if kids is None:
+            kids = self.children[node] = {}
+        elif (found := kids.get(name)) is not None:
+            return found
+        return self._new(kids, node, name)
+
+    def add_pairs(self, pairs: Iterable[Tuple[str, str]]) -> Tuple[array, array]:
+        """
+        Add every (target, source), return the nodes of the targets and of
+        the sources.
+        """
+        targets, sources = array("l"), array("l")
+        for target, source in pairs:
+            targets.append(self.add(target))
+            sources.append(self.add(source))
+        return targets, sources
+
+    def find(self, path: str) -> int | None:
+        node = 0
+        for part in path.split(os.sep):
+            if not part:
+                continue
+            kids = self.children.get(node)
+            if kids is None or (node := kids.get(part)) is None:
+                return None
+        return node
+
+    def path(self, node: int) -> str:
+        parts: List[str] = []
+        while node > 0:
+            parts.append(self.names[node])
+            node = self.parents[node]
+        return os.sep + os.sep.join(reversed(parts))
+
+    def prefix(self, node: int) -> str:
+        """
+        Path of a directory node with the separator, to join a name to.
+        """
+        return self.path(node) if node == 0 else self.path(node) + os.sep
@@ -0,0 +1,151 @@
+from pathlib import Path
+import os
+from typing import TYPE_CHECKING, Dict, Iterator, List, Tuple
+
+if TYPE_CHECKING:
+    from ignore import IgnoreMatcher
+    from tree import PathTree
+
+
+# ============================================================= #
+# ============================================================= #
+
+
+def scan_dir(path: Path | str) -> Tuple[List[os.DirEntry], List[os.DirEntry]]:
+    """
+    List a directory with a single `scandir`, return (dirs, files).
+
+    Entry type come from the directory listing itself, so no `stat` is
+    needed (except for symlinks, which are followed like `Path.is_dir`).
+    Anything that is neither file nor directory (broken link, socket...)
+    is skipped.
+    """
+    dirs: List[os.DirEntry] = []
+    files: List[os.DirEntry] = []
+    with os.scandir(path) as it:
+        for entry in it:
+            if entry.is_dir():
+                dirs.append(entry)
+            elif entry.is_file():
+                files.append(entry)
+    return dirs, files
+
+
+class ScanCache:
+    """
+    `scan_dir` (and mtime) of every source directory listed in a run, so a
+    package deployed to several roots is read only once.
+
+    Only for the source side, which a run never change.
+    """
+
+    def __init__(self) -> None:
+        self.scans: Dict[str, Tuple[List[os.DirEntry], List[os.DirEntry]]] = {}
+        self.mtimes: Dict[str, int] = {}
+
+    def scan(self, path: Path | str) -> Tuple[List[os.DirEntry], List[os.DirEntry]]:
+        key = str(path)
+        if (found := self.scans.get(key)) is None:
+            found = self.scans[key] = scan_dir(path)
+        return found
+
+    def mtime(self, path: Path | str) -> int:
+        key = str(path)
+        if (found := self.mtimes.get(key)) is None:
+            found = self.mtimes[key] = os.stat(path).st_mtime_ns
+        return found
+
+
+class WalkEntry:
+    """
+    One entry yielded by `walk`.
+
+    Set `descend` to `False` (when it's a directory) to prune it, the walker
+    will not list it.
+    """
+
+    __slots__ = ("depth", "descend", "entry", "is_dir", "is_last", "node", "rel")
+
+    def __init__(
+        self, entry: os.DirEntry, rel: str, depth: int, is_dir: bool, is_last: bool
+    ) -> None:
+        self.entry = entry
+        self.rel = rel
+        self.depth = depth
+        self.is_dir = is_dir
+        self.is_last = is_last
+        self.descend = is_dir
+        # node in the tree given to `walk`, -1 without
+        self.node = -1
+
+    @property
+    def name(self) -> str:
+        return self.entry.name
+
+    @property
+    def path(self) -> str:
+        return self.entry.path
+
+    def stat(self) -> os.stat_result:
+        # cached by `DirEntry`
+        return self.entry.stat()
+
+
+def _level(
+    path: Path | str,
+    rel: str,
+    depth: int,
+    ignore: "IgnoreMatcher | None",
+    scans: ScanCache | None,
+    tree: "PathTree | None",
+    node: int,
+) -> List[WalkEntry]:
+    dirs, files = scan_dir(path) if scans is None else scans.scan(path)
+    prefix = rel + "/" if rel else ""
+    items = [WalkEntry(d, prefix + d.name, depth, True, False) for d in dirs]
+    items += [WalkEntry(f, prefix + f.name, depth, False, False) for f in files]
+    if ignore:
+        # ignored directory is never listed, its whole subtree is pruned
+        items = [i for i in items if not ignore.match(i.rel, i.name, i.is_dir)]
+    if items:
+        items[-1].is_last = True
+    if tree is not None:
+        for item in items:
+            item.node = tree.child(node, item.name)
+    return items
+
+
+def walk(
+    top: Path | str,
+    ignore: "IgnoreMatcher | None" = None,
+    scans: ScanCache | None = None,
+    tree: "PathTree | None" = None,
+    node: int = 0,
+) -> Iterator[WalkEntry]:
+    """
+    Lazily walk a directory tree, depth first (pre-order), with directories
+    of each level yielded before files. Entries matched by `ignore` are
+    skipped (and not descended).
+
+    Use an explicit stack instead of recursion, only the remaining entries
+    of the directories on the current path are kept in memory, so it work
+    on very deep trees without hitting the recursion limit.
+
+    With `scans`, directories already listed in the run are not listed
+    again. With `tree`, every entry is added under `node` (the node of
+    `top`, or of where it's mapped to) and get its node.
+    """
+
+    def level(path: Path | str, rel: str, depth: int, node: int) -> Iterator[WalkEntry]:
+        return iter(_level(path, rel, depth, ignore, scans, tree, node))
+
+    stack: List[Iterator[WalkEntry]] = [level(top, "", 0, node)]
+    while stack:
+        item = next(stack[-1], None)
+        if item is None:
+            stack.pop()
+            continue
+
+        yield item
+        if item.descend:
+            stack.append(level(item.path, item.rel, item.depth + 1, item.node))
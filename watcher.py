@@ -0,0 +1,225 @@
+from pathlib import Path
+import os
+import time
+import select
+import struct
+from abc import ABC, abstractmethod
+from typing import Dict, List, Set
+
+try:
+    import ctypes
+except ImportError:  # python built without ctypes
+    ctypes = None
+
+
+# ============================================================= #
+# ============================================================= #
+
+# from sys/inotify.h, only changes of directory entries matter (a link
+# point to the file, so changing file content need nothing)
+IN_MOVED_FROM = 0x00000040
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_DELETE = 0x00000200
+IN_DELETE_SELF = 0x00000400
+IN_MOVE_SELF = 0x00000800
+IN_Q_OVERFLOW = 0x00004000
+IN_IGNORED = 0x00008000
+IN_ONLYDIR = 0x01000000
+IN_ISDIR = 0x40000000
+IN_NONBLOCK = 0o4000
+IN_CLOEXEC = 0o2000000
+
+WATCH_MASK = (
+    IN_MOVED_FROM
+    | IN_MOVED_TO
+    | IN_CREATE
+    | IN_DELETE
+    | IN_DELETE_SELF
+    | IN_MOVE_SELF
+    | IN_ONLYDIR
+)
+EVENT = struct.Struct("iIII")
+
+
+class Watcher(ABC):
+    """
+    Report directories whose entries changed (added, removed, renamed).
+    """
+
+    @abstractmethod
+    def add_tree(self, top: Path | str) -> None:
+        """
+        Watch `top` and every directory under it.
+        """
+
+    @abstractmethod
+    def wait(self, timeout: float | None) -> Set[str]:
+        """
+        Block until something change (or `timeout`), return the changed
+        directories, empty on timeout.
+        """
+
+    def close(self) -> None:  # noqa: B027, intentional no-op default
+        """
+        Release what the watcher hold, nothing by default (the polling
+        watcher has nothing open).
+        """
+
+    def collect(self, debounce: float, max_delay: float) -> Set[str]:
+        """
+        Wait for the first change, then keep collecting until nothing
+        happen for `debounce` seconds (or `max_delay` is reached), so a
+        burst (like `git checkout`) come back as one batch.
+        """
+        changed = self.wait(None)
+        start = time.monotonic()
+        while time.monotonic() - start < max_delay:
+            more = self.wait(debounce)
+            if not more:
+                break
+            changed |= more
+        return changed
+
+
+def sub_dirs(top: Path | str) -> List[str]:
+    """
+    Return `top` and every directory under it (links not followed).
+    """
+    dirs = [str(top)]
+    i = 0
+    while i < len(dirs):
+        try:
+            with os.scandir(dirs[i]) as it:
+                dirs.extend(e.path for e in it if e.is_dir(follow_symlinks=False))
+        except OSError:
+            pass
+        i += 1
+    return dirs
+
+
+class InotifyWatcher(Watcher):
+    """
+    Linux inotify through ctypes, one watch for every directory.
+
+    :raise OSError: if inotify is not available
+    """
+
+    def __init__(self) -> None:
+        if ctypes is None:
+            raise OSError("ctypes not available")
+        self.libc = ctypes.CDLL(None, use_errno=True)
+        if not hasattr(self.libc, "inotify_init1"):
+            raise OSError("inotify not available")
+        self.fd = self.libc.inotify_init1(IN_NONBLOCK | IN_CLOEXEC)
+        if self.fd < 0:
+            raise OSError(ctypes.get_errno(), "inotify_init1 failed")
+        self.paths: Dict[int, str] = {}
+
+    def add_tree(self, top: Path | str) -> None:
+        for dir in sub_dirs(top):
+            wd = self.libc.inotify_add_watch(self.fd, os.fsencode(dir), WATCH_MASK)
+            if wd >= 0:
+                self.paths[wd] = dir
+
+    def wait(self, timeout: float | None) -> Set[str]:
+        ready, _, _ = select.select([self.fd], [], [], timeout)
+        if not ready:
+            return set()
+
+        changed: Set[str] = set()
+        try:
+            data = os.read(self.fd, 64 * 1024)
+        except BlockingIOError:
+            return changed
+
+        offset = 0
+        new_dirs: List[str] = []
+        while offset < len(data):
+            wd, mask, _, size = EVENT.unpack_from(data, offset)
+            offset += EVENT.size
+            name = os.fsdecode(data[offset : offset + size].rstrip(b"\0"))
+            offset += size
+
+            if mask & IN_Q_OVERFLOW:
+                # events was lost, every watched directory may be changed
+                changed.update(self.paths.values())
+                continue
+            dir = self.paths.get(wd)
+            if dir is None:
+                continue
+            if mask & IN_IGNORED:
+                del self.paths[wd]
+                continue
+            changed.add(dir)
+            if mask & IN_ISDIR and mask & (IN_CREATE | IN_MOVED_TO):
+                new_dirs.append(os.path.join(dir, name))
+
+        for dir in new_dirs:
+            self.add_tree(dir)
+            # content created before the watch was added
+            changed.update(sub_dirs(dir))
+        return changed
+
+    def close(self) -> None:
+        os.close(self.fd)
+
+
+class PollWatcher(Watcher):
+    """
+    Fallback for system without inotify: compare mtime of every directory
+    every `interval` seconds (one `stat` per directory, files are not
+    touched).
+    """
+
+    def __init__(self, interval: float = 1.0) -> None:
+        self.interval = interval
+        self.tops: List[str] = []
+        self.mtimes: Dict[str, int] = {}
+
+    def add_tree(self, top: Path | str) -> None:
+        self.tops.append(str(top))
+        self.mtimes.update(self.scan(str(top)))
+
+    def scan(self, top: str) -> Dict[str, int]:
+        mtimes: Dict[str, int] = {}
+        for dir in sub_dirs(top):
+            try:
+                mtimes[dir] = os.stat(dir).st_mtime_ns
+            except OSError:
+                pass
+        return mtimes
+
+    def wait(self, timeout: float | None) -> Set[str]:
+        start = time.monotonic()
+        while True:
+            current: Dict[str, int] = {}
+            for top in self.tops:
+                current.update(self.scan(top))
+            changed = {
+                dir
+                for dir in current.keys() | self.mtimes.keys()
+                if current.get(dir) != self.mtimes.get(dir)
+            }
+            self.mtimes = current
+            if changed:
+                return changed
+            if timeout is not None and time.monotonic() - start >= timeout:
+                return set()
+            time.sleep(
+                self.interval
+                if timeout is None
+                else min(self.interval, max(timeout - (time.monotonic() - start), 0))
+            )
+
+
+def make_watcher(poll: bool = False) -> Watcher:
+    """
+    Return an inotify watcher, or the polling one if not supported.
+    """
+    if not poll:
+        try:
+            return InotifyWatcher()
+        except OSError as e:
+            print(f"[warning] -- inotify not available ({e}), polling instead")
+    return PollWatcher()